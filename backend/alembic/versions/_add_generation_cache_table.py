@@ -0,0 +1,27 @@
+import sqlalchemy as sa
+import alembic.op as op
+
+def upgrade():
+    op.add_column('mcp_services', sa.Column('test_report', sa.Text()))
+    op.add_column('mcp_services', sa.Column('cache_key', sa.String(length=64)))
+    op.create_index('ix_mcp_services_cache_key', 'mcp_services', ['cache_key'])
+    op.create_table(
+        'generation_cache',
+        sa.Column('cache_key', sa.String(length=64), primary_key=True),
+        sa.Column('model', sa.String(length=100), nullable=False),
+        sa.Column('source_service_id', sa.String(length=50)),
+        sa.Column('name', sa.String(length=200)),
+        sa.Column('file_path', sa.String(length=500)),
+        sa.Column('code', sa.Text(), nullable=False),
+        sa.Column('readme', sa.Text()),
+        sa.Column('requirements', sa.Text()),
+        sa.Column('test_report', sa.Text()),
+        sa.Column('quality_score', sa.Float()),
+        sa.Column('test_pass_rate', sa.Float()),
+        sa.Column('generation_cost', sa.Float()),
+        sa.Column('generation_time', sa.Integer()),
+        sa.Column('hit_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('last_hit_at', sa.DateTime())
+    )
+    op.create_index('ix_generation_cache_last_hit_at', 'generation_cache', ['last_hit_at'])
@@ -0,0 +1,8 @@
+import sqlalchemy as sa
+import alembic.op as op
+
+def upgrade():
+    op.add_column('mcp_services', sa.Column('lease_owner', sa.String(length=100)))
+    op.add_column('mcp_services', sa.Column('lease_expires_at', sa.DateTime()))
+    op.add_column('mcp_services', sa.Column('attempt_count', sa.Integer(), nullable=False, server_default='0'))
+    op.create_index('ix_mcp_services_status_lease', 'mcp_services', ['status', 'lease_expires_at'])
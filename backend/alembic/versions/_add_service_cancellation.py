@@ -0,0 +1,6 @@
+import sqlalchemy as sa
+import alembic.op as op
+
+def upgrade():
+    op.execute("ALTER TYPE servicestatus ADD VALUE IF NOT EXISTS 'CANCELLED'")
+    op.add_column('mcp_services', sa.Column('cancel_requested_at', sa.DateTime()))
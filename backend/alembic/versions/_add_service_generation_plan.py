@@ -0,0 +1,5 @@
+import sqlalchemy as sa
+import alembic.op as op
+
+def upgrade():
+    op.add_column('mcp_services', sa.Column('generation_plan', sa.Text()))
@@ -11,6 +11,7 @@ from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 import time
 
@@ -72,29 +73,33 @@ async def lifespan(app: FastAPI):
         logger.warning("⚠️ Continuing without database...")
     
     # 延迟加载MCPybarra工作流 - 避免启动时的导入副作用触发reload
-    # workflow 将在首次请求时按需创建
-    app.state.workflow = None
-    app.state.workflow_ready = False
+    # workflow 由 workflow_registry 在首次请求时编译，之后全进程共享
+    
+    # 共享进度存储：订阅 worker 进程广播的进度事件并转发到 WebSocket
+    from backend.services.progress_store import progress_store
+    progress_forwarder = None
+    if progress_store.distributed:
+        progress_forwarder = asyncio.create_task(progress_store.forward(notify_service_progress))
     
     logger.info("✅ Application startup complete (workflow will be loaded on first request)")
     
     yield
     
     logger.info("🛑 Shutting down application...")
+    if progress_forwarder is not None:
+        progress_forwarder.cancel()
+        await asyncio.gather(progress_forwarder, return_exceptions=True)
+    from backend.services.generation_executor import close_generation_executor
+    await close_generation_executor()
+    await progress_store.close()
+    from backend.services.workflow_checkpoint import close_checkpointer
+    await close_checkpointer()
     logger.info("✅ Cleanup complete")
 
 async def get_workflow(app: FastAPI):
-    """按需加载MCPybarra工作流（首次调用时初始化）"""
-    if not app.state.workflow_ready:
-        try:
-            from backend.mcpybarra_core.framework.mcp_swe_flow.graph import create_mcp_swe_workflow
-            app.state.workflow = create_mcp_swe_workflow()
-            app.state.workflow_ready = True
-            logger.info("✅ MCPybarra workflow loaded on first request")
-        except Exception as e:
-            logger.error(f"❌ Failed to load MCPybarra workflow: {e}")
-            raise
-    return app.state.workflow
+    """按需加载MCPybarra工作流（首次调用时编译，之后复用进程共享实例）"""
+    from backend.services.workflow_registry import get_workflow as get_shared_workflow
+    return get_shared_workflow()
 
 # 创建FastAPI应用实例
 app = FastAPI(
@@ -176,10 +181,12 @@ async def health_check():
     
     返回系统运行状态和版本信息
     """
+    from backend.services.workflow_registry import workflow_registry
     return {
         "status": "healthy",
         "version": app.version,
-        "service": "ZhiNongLianXiao API"
+        "service": "ZhiNongLianXiao API",
+        "workflow": workflow_registry.stats()
     }
 
 
@@ -255,6 +262,12 @@ async def websocket_endpoint(websocket: WebSocket, service_id: str):
     await websocket.accept()
     active_connections[service_id] = websocket
     
+    # 连接建立时先推送当前进度快照，之后由节点完成事件驱动推送
+    from backend.services.progress_store import progress_store
+    snapshot = await progress_store.get(service_id)
+    if snapshot:
+        await websocket.send_text(json.dumps({"type": "progress", **snapshot}, ensure_ascii=False))
+    
     try:
         while True:
             # 保持连接活跃
@@ -24,30 +24,24 @@ from backend.api.dependencies import (
 )
 from backend.api.schemas.service import (
     ServiceDeploymentRequest,
+    BatchServiceDeploymentRequest,
+    BatchDeploymentResponse,
     DeploymentResponse,
     ServiceStatusResponse
 )
 from backend.models.mcp_service import MCPService, ServiceStatus
 from backend.models.farmer import Farmer
-from backend.services.service_manager import ServiceManager, PromptBuilder
+from backend.services.service_manager import PromptBuilder
 from backend.services.deployment_service import DeploymentService
+from backend.services.workflow_registry import get_service_manager
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# 应用级单例，避免重复创建
-_service_manager: Optional[ServiceManager] = None
+# 应用级单例，避免重复创建（ServiceManager 由 workflow_registry 统一提供）
 _deployment_service: Optional[DeploymentService] = None
 
 
-def get_service_manager() -> ServiceManager:
-    """获取ServiceManager单例"""
-    global _service_manager
-    if _service_manager is None:
-        _service_manager = ServiceManager()
-    return _service_manager
-
-
 def get_deployment_service() -> DeploymentService:
     """获取DeploymentService单例"""
     global _deployment_service
@@ -103,7 +97,8 @@ async def deploy_product_service(
             product_info=product_info,
             service_type=request.service_type or "full",
             model=request.model,
-            request_id=request_id
+            request_id=request_id,
+            force_regenerate=request.force_regenerate
         )
         
         logger.info(f"[{request_id}] Service generation started: {task_id}")
@@ -119,7 +114,7 @@ async def deploy_product_service(
             service_id=task_id,
             status="generating",
             endpoints=[],
-            message=f"服务生成已启动，任务ID: {task_id}。请通过 /deploy/status/{task_id} 查询进度。"
+            message=f"服务生成已启动，任务ID: {task_id}。请订阅 /ws/service/{task_id} 或通过 /deploy/status/{task_id} 查询进度。"
         )
         
     except Exception as e:
@@ -130,6 +125,86 @@ async def deploy_product_service(
         )
 
 
+@router.post(
+    "/deploy-product-services/batch",
+    response_model=BatchDeploymentResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="批量生成产品MCP服务",
+    description="按品类/服务类型/模型分组，每组只规划一次，组内产品并发生成代码（生成完成后通过 /deploy/deploy/{service_id} 部署）"
+)
+async def deploy_product_services_batch(
+    request: BatchServiceDeploymentRequest,
+    current_farmer: Farmer = Depends(get_current_farmer),
+    request_id: str = Depends(get_request_id)
+):
+    """
+    批量提交产品信息，生成MCP服务
+    
+    适用于合作社一次性上架整个产品目录的场景。
+    """
+    products = [product.dict(exclude_unset=True) for product in request.products]
+    if request.use_catalog:
+        products.extend(_catalog_products())
+    
+    if not products:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="请提供产品列表或设置 use_catalog=true"
+        )
+    
+    from backend.services.cost_calculator import CostCalculator
+    max_services = CostCalculator.PRICING_TIERS[current_farmer.tier.value]["max_services"]
+    if current_farmer.services_count + len(products) > max_services:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Service quota exceeded. Current tier allows {max_services} services, "
+                   f"{current_farmer.services_count} used, {len(products)} requested."
+        )
+    
+    logger.info(f"[{request_id}] Received batch request for {len(products)} products from farmer {current_farmer.id}")
+    
+    try:
+        items = await get_service_manager().start_batch_generation(
+            farmer_id=current_farmer.id,
+            products=products,
+            service_type=request.service_type or "full",
+            model=request.model,
+            request_id=request_id
+        )
+    except Exception as e:
+        logger.error(f"[{request_id}] Failed to start batch generation: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"批量生成启动失败: {str(e)}"
+        )
+    
+    groups = len({item["group"] for item in items})
+    return BatchDeploymentResponse(
+        services=items,
+        groups=groups,
+        message=f"已提交{len(items)}个产品，共{groups}个分组共享规划。请通过 /deploy/status/{{service_id}} 查询各服务进度。"
+    )
+
+
+def _catalog_products() -> List[dict]:
+    """将 PRODUCT_CATALOG 中的SKU展开为产品信息"""
+    from backend.config.product_config import PRODUCT_CATALOG
+    
+    products = []
+    for category in PRODUCT_CATALOG.values():
+        for sku in category.get("skus", []):
+            products.append({
+                "name": sku["name"],
+                "category": category["category_name"],
+                "price": sku["price"],
+                "stock": sku.get("stock", 0),
+                "description": category.get("description"),
+                "origin": category.get("origin"),
+                "certifications": category.get("certification"),
+            })
+    return products
+
+
 async def _auto_deploy_when_ready(task_id: str, request_id: str):
     """后台任务：等待服务生成完成后自动部署"""
     service_manager = get_service_manager()
@@ -228,10 +303,13 @@ async def get_deployment_status(
         status=service.status.value,
         progress=progress_info.get("progress", 0),
         current_stage=progress_info.get("current_stage"),
+        current_node=progress_info.get("current_node"),
         message=progress_info.get("message"),
         cost=service.generation_cost,
         quality_score=service.quality_score,
-        generation_time=service.generation_time
+        generation_time=service.generation_time,
+        queue_position=progress_info.get("queue_position"),
+        estimated_wait_seconds=progress_info.get("estimated_wait_seconds")
     )
 
 
@@ -28,15 +28,14 @@ from backend.api.schemas.service import (
 )
 from backend.models.farmer import Farmer
 from backend.models.mcp_service import MCPService, ServiceStatus
-from backend.services.service_manager import ServiceManager
+from backend.services.workflow_registry import get_service_manager
 from backend.services.deployment_service import DeploymentService
 from backend.services.cost_calculator import CostCalculator
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-# 初始化服务管理器(单例)
-service_manager = ServiceManager()
+# 服务管理器由 workflow_registry 在首次使用时创建并在进程内共享
 deployment_service = DeploymentService()
 cost_calculator = CostCalculator()
 
@@ -90,12 +89,13 @@ async def generate_service(
         logger.info(f"[{request_id}] Estimated cost: ${estimate['estimated_cost_usd']}")
         
         # 2. 启动服务生成任务
-        task_id = await service_manager.start_generation(
+        task_id = await get_service_manager().start_generation(
             user_input=request.requirement,
             farmer_id=current_farmer.id,
             product_category=request.product_category,
             model=request.model,
-            request_id=request_id
+            request_id=request_id,
+            force_regenerate=request.force_regenerate
         )
         
         logger.info(f"[{request_id}] Service generation task created: {task_id}")
@@ -155,15 +155,18 @@ async def get_service_status(
     # 如果正在生成，尝试获取实时进度
     if service.status == ServiceStatus.GENERATING:
         try:
-            progress = await service_manager.get_current_progress(service_id)
+            progress = await get_service_manager().get_current_progress(service_id)
             return ServiceStatusResponse(
                 service_id=service_id,
                 status=service.status.value,
                 progress=progress.get("progress", 0),
                 current_stage=progress.get("current_stage"),
+                current_node=progress.get("current_node"),
                 message=progress.get("message"),
                 cost=service.generation_cost,
-                quality_score=service.quality_score
+                quality_score=service.quality_score,
+                queue_position=progress.get("queue_position"),
+                estimated_wait_seconds=progress.get("estimated_wait_seconds")
             )
         except Exception as e:
             logger.error(f"Failed to get progress for service {service_id}: {e}", exc_info=True)
@@ -174,7 +177,7 @@ async def get_service_status(
         service_id=service_id,
         status=service.status.value,
         progress=100 if service.status == ServiceStatus.READY else 0,
-        current_stage="completed" if service.status == ServiceStatus.READY else "failed",
+        current_stage=_get_final_stage(service.status),
         message=_get_status_message(service.status),
         cost=service.generation_cost,
         quality_score=service.quality_score,
@@ -467,6 +470,60 @@ async def stop_service(
         )
 
 
+@router.delete(
+    "/{service_id}/generation",
+    summary="取消服务生成",
+    description="取消排队中或正在生成的服务，已消耗的LLM成本会记录在服务上"
+)
+async def cancel_service_generation(
+    service_id: str,
+    db: AsyncSession = Depends(get_session),
+    current_farmer: Farmer = Depends(get_current_farmer)
+):
+    """
+    取消服务生成
+    
+    Args:
+        service_id: 服务ID
+        db: 数据库会话
+        current_farmer: 当前农户
+    """
+    result = await db.execute(
+        select(MCPService).where(
+            MCPService.id == service_id,
+            MCPService.farmer_id == current_farmer.id
+        )
+    )
+    service = result.scalar_one_or_none()
+    
+    if not service:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Service not found"
+        )
+    
+    if service.status != ServiceStatus.GENERATING:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Service is not generating (status: {service.status.value})"
+        )
+    
+    outcome = await get_service_manager().cancel_generation(service_id)
+    if outcome is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Service generation already finished"
+        )
+    
+    logger.info(f"Cancellation of service {service_id} requested: {outcome}")
+    
+    return {
+        "service_id": service_id,
+        "status": outcome,
+        "message": "服务生成已取消" if outcome == "cancelled" else "正在取消服务生成..."
+    }
+
+
 @router.delete(
     "/{service_id}",
     summary="删除服务",
@@ -693,6 +750,15 @@ async def call_service_tool(
 
 # ==================== 辅助函数 ====================
 
+def _get_final_stage(status: ServiceStatus) -> str:
+    """获取非生成中状态对应的阶段"""
+    if status == ServiceStatus.READY:
+        return "completed"
+    if status == ServiceStatus.CANCELLED:
+        return "cancelled"
+    return "failed"
+
+
 def _get_status_message(status: ServiceStatus) -> str:
     """获取状态描述信息"""
     messages = {
@@ -701,6 +767,7 @@ def _get_status_message(status: ServiceStatus) -> str:
         ServiceStatus.READY: "服务已就绪，可以部署",
         ServiceStatus.DEPLOYED: "服务已部署并运行中",
         ServiceStatus.FAILED: "服务生成失败",
-        ServiceStatus.ARCHIVED: "服务已归档"
+        ServiceStatus.ARCHIVED: "服务已归档",
+        ServiceStatus.CANCELLED: "服务生成已取消"
     }
     return messages.get(status, "未知状态")
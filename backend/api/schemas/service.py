@@ -25,6 +25,10 @@ class ServiceGenerationRequest(BaseModel):
         description="指定使用的LLM模型(默认gemini-2.5-pro)",
         example="gemini-2.5-pro"
     )
+    force_regenerate: bool = Field(
+        False,
+        description="跳过生成结果缓存，强制重新执行完整工作流"
+    )
     
     @validator('requirement')
     def requirement_must_be_detailed(cls, v):
@@ -89,6 +93,42 @@ class ServiceDeploymentRequest(BaseModel):
         description="指定LLM模型（可选）",
         example="gpt-4o"
     )
+    force_regenerate: bool = Field(
+        False,
+        description="跳过生成结果缓存，强制重新执行完整工作流"
+    )
+    
+    @validator('service_type')
+    def validate_service_type(cls, v):
+        allowed = ["full", "query", "order", "traceability"]
+        if v and v not in allowed:
+            raise ValueError(f"service_type必须是以下之一: {allowed}")
+        return v or "full"
+
+
+class BatchServiceDeploymentRequest(BaseModel):
+    """
+    批量服务生成请求
+    同品类、同服务类型、同模型的产品共享一次规划阶段
+    """
+    products: List[ServiceDeploymentRequest] = Field(
+        default_factory=list,
+        max_items=100,
+        description="产品列表（可单独指定 service_type / model）"
+    )
+    use_catalog: bool = Field(
+        False,
+        description="是否导入 product_config.PRODUCT_CATALOG 中的全部SKU"
+    )
+    service_type: Optional[str] = Field(
+        "full",
+        description="默认服务类型: full/query/order/traceability",
+        example="query"
+    )
+    model: Optional[str] = Field(
+        None,
+        description="默认LLM模型（可选）"
+    )
     
     @validator('service_type')
     def validate_service_type(cls, v):
@@ -98,6 +138,21 @@ class ServiceDeploymentRequest(BaseModel):
         return v or "full"
 
 
+class BatchServiceItem(BaseModel):
+    """批量生成中的单个服务"""
+    service_id: str
+    product_name: Optional[str] = None
+    group: str = Field(..., description="分组: 品类/服务类型/模型")
+    status: str
+
+
+class BatchDeploymentResponse(BaseModel):
+    """批量生成响应"""
+    services: List[BatchServiceItem]
+    groups: int = Field(..., description="共享规划的分组数")
+    message: str
+
+
 class ServiceGenerationResponse(BaseModel):
     """服务生成响应"""
     service_id: str = Field(..., description="服务任务ID")
@@ -113,11 +168,14 @@ class ServiceStatusResponse(BaseModel):
     service_id: str
     status: str = Field(..., description="服务状态: generating/testing/ready/deployed/failed")
     progress: int = Field(0, ge=0, le=100, description="生成进度(0-100)")
-    current_stage: Optional[str] = Field(None, description="当前阶段: planning/coding/testing/refining")
+    current_stage: Optional[str] = Field(None, description="当前阶段: queued/planning/coding/testing/refining/finalizing")
+    current_node: Optional[str] = Field(None, description="最近完成的工作流节点")
     message: Optional[str] = Field(None, description="状态消息")
     cost: Optional[float] = Field(None, description="实际成本(美元)")
     quality_score: Optional[float] = Field(None, description="质量评分(0-100)")
     generation_time: Optional[int] = Field(None, description="生成耗时(秒)")
+    queue_position: Optional[int] = Field(None, description="排队位置(1开始，0表示执行中)")
+    estimated_wait_seconds: Optional[int] = Field(None, description="预计等待时间(秒)")
 
 
 class ServiceDetail(BaseModel):
@@ -62,6 +62,7 @@ class Settings(BaseSettings):
     
     # Agent 模型配置（用于 MCPybarra 工作流）
     SWE_AGENT_MODEL: Optional[str] = None
+    SWE_AGENT_FORCED_MODEL: str = "openrouter/anthropic/claude-3.5-sonnet"  # 固定SWE-Agent模型，置空则使用请求指定的模型
     SERVER_TEST_AGENT_MODEL: Optional[str] = None
     CODE_REFINER_AGENT_MODEL: Optional[str] = None
     DEFAULT_AGENT_MODEL: Optional[str] = None
@@ -78,6 +79,74 @@ class Settings(BaseSettings):
     MAX_PLANNING_TOOL_CALLS: int = 2
     MAX_CODEGEN_TOOL_CALLS: int = 3
     
+    # 规划阶段结果缓存（产品字段不同、需求等价的请求复用开发计划）
+    PLAN_CACHE_ENABLED: bool = True
+    PLAN_CACHE_TTL_HOURS: int = 168
+    PLAN_CACHE_MAX_ENTRIES: int = 500
+    PLAN_CACHE_SIMILARITY: float = 0.92
+    
+    # 单轮LLM响应中的多个工具调用并发执行
+    TOOL_CALL_TIMEOUT_SECONDS: int = 60
+    MAX_PARALLEL_TOOL_CALLS: int = 4
+    
+    # 流式代码生成与增量语法检查
+    ENABLE_STREAMING_CODEGEN: bool = True
+    CODEGEN_STREAM_CHECK_CHARS: int = 1500
+    MAX_CODEGEN_STREAM_ABORTS: int = 2
+    
+    # 代码生成/优化循环的上下文token预算
+    CONTEXT_TOKEN_BUDGET: int = 48000
+    CONTEXT_TOOL_OUTPUT_CHARS: int = 600
+    
+    # 服务名生成：本地规则为主，LLM仅作兜底
+    ENABLE_LLM_SERVER_NAME_FALLBACK: bool = False
+    
+    # 服务器测试计划按依赖关系并发执行
+    TEST_PLAN_MAX_CONCURRENCY: int = 4
+    TEST_PLAN_CACHE_ENABLED: bool = True  # 工具签名不变时复用测试计划
+    
+    # 服务启动就绪探测（单次启动，MCP握手 / HTTP轮询）
+    MCP_SERVER_READY_TIMEOUT_SECONDS: int = 30
+    DEPLOY_READY_TIMEOUT_SECONDS: int = 30
+    
+    # 服务器测试前的静态预检（语法/导入/工具签名）
+    ENABLE_STATIC_TEST_GATE: bool = True
+    
+    # 生成任务队列（Worker 租约）
+    WORKER_LEASE_SECONDS: int = 60
+    WORKER_HEARTBEAT_SECONDS: int = 15
+    WORKER_MAX_ATTEMPTS: int = 3
+    WORKER_MAX_IN_FLIGHT: int = 8
+    WORKER_JOB_TIMEOUT_SECONDS: int = 1800
+    WORKER_POLL_INTERVAL_SECONDS: int = 30  # LISTEN 不可用或漏通知时的兜底轮询间隔
+    
+    # 生成执行器（inprocess/process_pool/worker），process_pool/worker 使生成负载与API请求处理隔离
+    GENERATION_EXECUTOR: str = "inprocess"
+    GENERATION_PROCESS_POOL_SIZE: int = 2
+    # 批量生成时本进程同时执行的规划/生成任务上限，其余任务排队（租约持续续约）
+    BATCH_MAX_CONCURRENCY: int = 4
+    
+    # 生成结果缓存
+    ENABLE_GENERATION_CACHE: bool = True
+    GENERATION_CACHE_TTL_DAYS: int = 30
+    GENERATION_CACHE_MAX_ENTRIES: int = 5000
+    
+    # 模板快速通道：query/order/traceability 服务直接由审核过的模板生成，不调用LLM
+    ENABLE_TEMPLATE_FAST_PATH: bool = True
+    
+    # 多模型竞速生成（仅对开通竞速的等级生效，需要 SWE_AGENT_FORCED_MODEL 置空）
+    ENABLE_MODEL_RACE: bool = False
+    MODEL_RACE_MODELS: str = ""  # 逗号分隔，与请求的模型一起参赛
+    MODEL_RACE_GATE_TIMEOUT_SECONDS: int = 60
+    
+    # 工作流检查点（none/memory/sqlite/postgres），中断的生成任务从最后完成的节点继续
+    WORKFLOW_CHECKPOINTER: str = "sqlite"
+    WORKFLOW_CHECKPOINT_SQLITE_PATH: str = "workspace/checkpoints/workflow.sqlite"
+    
+    # 生成进度存储（memory/redis），使用 worker_daemon 执行任务时需选择 redis 才能实时推送进度
+    PROGRESS_STORE_BACKEND: str = "memory"
+    PROGRESS_TTL_SECONDS: int = 3600
+    
     #搜索： Tavily 配置 [必填](MCPyabarra需要)
     TAVILY_API_KEY: str | None = None 
     
@@ -14,6 +14,8 @@ from mcp.shared.exceptions import McpError
 
 from logger import logger
 from mcp_swe_flow.adapters import MCPToolAdapter
+from mcp_swe_flow.server_readiness import StderrCapture, await_handshake
+
 
 class MCPClientAdapter:
     """
@@ -57,6 +59,44 @@ class MCPClientAdapter:
                 logger.error(f"发送HTTP请求时出错: {e}", exc_info=True)
                 raise
 
+    async def _open_stdio_session(self, server_params: StdioServerParameters, max_output_length: int) -> List[MCPToolAdapter]:
+        """启动服务器子进程（只启动一次），以MCP initialize握手作为就绪探测，然后加载工具
+
+        握手与子进程退出（stderr管道EOF）同时等待：服务器秒退时立即失败并输出stderr，
+        无需先试启动再重启；握手超过 MCP_SERVER_READY_TIMEOUT_SECONDS（默认30秒）视为启动失败。
+
+        Args:
+            server_params: MCP服务器的STDIO启动参数
+            max_output_length: 工具返回结果的最大长度
+
+        Returns:
+            适配后的LangChain工具列表
+        """
+        stderr = StderrCapture()
+        try:
+            stdio_transport = await self.exit_stack.enter_async_context(
+                stdio_client(server_params, errlog=stderr.errlog)
+            )
+        except BaseException:
+            stderr.close()
+            raise
+        stderr.start()
+        self._initialized = True
+        
+        # 创建会话
+        read, write = stdio_transport
+        self.session = await self.exit_stack.enter_async_context(
+            ClientSession(read, write)
+        )
+        
+        logger.info(f"✅ MCP服务器进程已启动，等待握手")
+        
+        # 初始化会话（就绪探测）：握手与子进程退出同时等待
+        await await_handshake(self.session.initialize(), stderr, max_output_length)
+        
+        # 获取并转换工具
+        return await self.load_tools(max_output_length=max_output_length)
+
     async def connect_stdio(self, module_name: str, cwd: Optional[Path] = None, max_output_length: int = 1200) -> List[MCPToolAdapter]:
         """通过STDIO连接MCP服务器
         
@@ -88,67 +128,15 @@ class MCPClientAdapter:
             except TypeError:
                 server_params = StdioServerParameters(command=command, args=args)
             logger.info(f"🔄 创建服务器参数: {server_params}")
-
-            # ---- 预检：先试启动 0.8s，若秒退则抓 stdout/stderr ----
-            try:
-                proc = await asyncio.create_subprocess_exec(
-                    command, *args,
-                    cwd=cwd_str,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE
-                )
-                await asyncio.sleep(0.8)
-                ret = proc.returncode
-                if ret is not None:
-                    out = (await proc.stdout.read()).decode("utf-8", errors="ignore")
-                    err = (await proc.stderr.read()).decode("utf-8", errors="ignore")
-                    logger.error("❌ MCP server 进程启动后立刻退出 (returncode={})", ret)
-                    if out.strip():
-                        logger.error("---- server stdout ----\n{}", out[-max_output_length:])
-                    if err.strip():
-                        logger.error("---- server stderr ----\n{}", err[-max_output_length:])
-                    raise RuntimeError("MCP server 秒退：请根据 stderr 修复生成代码/依赖/环境变量后重试")
-                # 仍在运行：终止预检进程（避免占用），然后走 stdio_client 正式连接
-                proc.terminate()
-                try:
-                    await asyncio.wait_for(proc.wait(), timeout=1.0)
-                except Exception:
-                    proc.kill()
-            except Exception as precheck_exc:
-                # 预检失败不应该吞掉信息
-                logger.error("❌ MCP server 预检失败: {}", precheck_exc, exc_info=True)
-                raise
-            # ---- 预检结束 ----
             
-            # 通过subprocess启动并连接到MCP服务器
-            stdio_transport = await self.exit_stack.enter_async_context(
-                stdio_client(server_params)
-            )
-            
-            # 创建会话
-            read, write = stdio_transport
-            self.session = await self.exit_stack.enter_async_context(
-                ClientSession(read, write)
-            )
-            
-            logger.info(f"✅ MCP服务器连接成功")
-            
-            # 初始化会话
-            await self.session.initialize()
-            logger.info("✅ MCP会话初始化成功")
-            
-            self._initialized = True
-            
-            # 获取并转换工具
-            return await self.load_tools(max_output_length=max_output_length)
+            return await self._open_stdio_session(server_params, max_output_length)
             
         except Exception as e:
             logger.error(f"❌ MCP服务器连接失败: {e}", exc_info=True)
             if isinstance(e, ExceptionGroup):
                 for i, sub_exc in enumerate(e.exceptions):
                     logger.error(f"  -> Sub-exception [{i+1}/{len(e.exceptions)}]: {sub_exc}", exc_info=True)
-            if self.session:
-                await self.disconnect()
+            await self.disconnect()
             raise
 
     async def load_tools(self, max_output_length: int = 1200) -> List[MCPToolAdapter]:
@@ -232,35 +220,14 @@ class MCPClientAdapter:
         try:
             logger.info(f"🔌 正在通过预设参数连接MCP服务器: {server_params}")
             
-            # 通过subprocess启动并连接到MCP服务器
-            stdio_transport = await self.exit_stack.enter_async_context(
-                stdio_client(server_params)
-            )
-            
-            # 创建会话
-            read, write = stdio_transport
-            self.session = await self.exit_stack.enter_async_context(
-                ClientSession(read, write)
-            )
-            
-            logger.info(f"✅ MCP服务器连接成功")
-            
-            # 初始化会话
-            await self.session.initialize()
-            logger.info("✅ MCP会话初始化成功")
-            
-            self._initialized = True
-            
-            # 获取并转换工具
-            return await self.load_tools(max_output_length=max_output_length)
+            return await self._open_stdio_session(server_params, max_output_length)
             
         except Exception as e:
             logger.error(f"❌ MCP服务器连接失败: {e}", exc_info=True)
             if isinstance(e, ExceptionGroup):
                 for i, sub_exc in enumerate(e.exceptions):
                     logger.error(f"  -> Sub-exception [{i+1}/{len(e.exceptions)}]: {sub_exc}", exc_info=True)
-            if self.session:
-                await self.disconnect()
+            await self.disconnect()
             raise
 
     async def connect_stdio_file(self, file_path: str, cwd: Optional[Path] = None, max_output_length: int = 1200) -> List[MCPToolAdapter]:
@@ -295,33 +262,12 @@ class MCPClientAdapter:
             server_params = StdioServerParameters(command=command, args=args)
             logger.info(f"🔄 创建服务器参数: {server_params}")
             
-            # 通过subprocess启动并连接到MCP服务器
-            stdio_transport = await self.exit_stack.enter_async_context(
-                stdio_client(server_params)
-            )
-            
-            # 创建会话
-            read, write = stdio_transport
-            self.session = await self.exit_stack.enter_async_context(
-                ClientSession(read, write)
-            )
-            
-            logger.info(f"✅ MCP服务器连接成功")
-            
-            # 初始化会话
-            await self.session.initialize()
-            logger.info("✅ MCP会话初始化成功")
-            
-            self._initialized = True
-            
-            # 获取并转换工具
-            return await self.load_tools(max_output_length=max_output_length)
+            return await self._open_stdio_session(server_params, max_output_length)
             
         except Exception as e:
             logger.error(f"❌ MCP服务器连接失败: {e}", exc_info=True)
             if isinstance(e, ExceptionGroup):
                 for i, sub_exc in enumerate(e.exceptions):
                     logger.error(f"  -> Sub-exception [{i+1}/{len(e.exceptions)}]: {sub_exc}", exc_info=True)
-            if self.session:
-                await self.disconnect()
+            await self.disconnect()
             raise 
\ No newline at end of file
@@ -7,6 +7,8 @@ from typing import Dict, Any, List, Optional
 import os
 from dotenv import load_dotenv
 import re
+from contextvars import ContextVar
+from contextlib import contextmanager
 
 # Load environment variables from a .env file at the project root
 # The .env file should be located at the same level as the 'framwork' directory
@@ -30,6 +32,9 @@ MODEL_CONFIG = {
     r"^openrouter/": {
         "provider": "openrouter",
         "env_prefix": "OPENROUTER",
+        # Price of a cached prompt token relative to an uncached one (approximate:
+        # Anthropic 0.1, Gemini 0.25, OpenAI 0.5 behind OpenRouter)
+        "cache_read_ratio": 0.25,
         "costs": {
             # Anthropic models via OpenRouter
             "openrouter/anthropic/claude-3.5-sonnet": {"prompt": 0.000003, "completion": 0.000015},
@@ -60,6 +65,7 @@ MODEL_CONFIG = {
     r"^(qwen|deepseek)-": {
         "provider": "qwen",
         "env_prefix": "QWEN",
+        "cache_read_ratio": 0.4,
         "costs": {
             "qwen-max": {"prompt": 0.0000024, "completion": 0.0000096},
             "qwen-max-latest": {"prompt": 0.0000024, "completion": 0.0000096},
@@ -74,6 +80,7 @@ MODEL_CONFIG = {
     r"^(gpt|claude)-": {
         "provider": "gptsapi",
         "env_prefix": "GPTSAPI",
+        "cache_read_ratio": 0.5,
         "costs": {
             "claude-sonnet-4-20250514": {"prompt": 0.00002376, "completion": 0.0001188},
             "gpt-4o": {"prompt": 0.000018, "completion": 0.000072},
@@ -85,6 +92,7 @@ MODEL_CONFIG = {
     r"^gemini-": {
         "provider": "gemini",
         "env_prefix": "GEMINI",
+        "cache_read_ratio": 0.25,
         "costs": {
             "gemini-2.5-pro": {"prompt": 0.00000138, "completion": 0.000011},
             "default": {"prompt": 0.0000025, "completion": 0.000005}
@@ -118,24 +126,112 @@ def get_provider_config(model_name: str) -> Dict[str, Any]:
             return config
     return MODEL_CONFIG["default"]
 
-def calculate_cost(model_name: str, prompt_tokens: int, completion_tokens: int) -> Dict[str, float]:
-    """Calculates the token cost for a given model."""
+# Models that take Anthropic-style `cache_control` breakpoints on message content
+# parts. OpenAI, Qwen, DeepSeek and Gemini's OpenAI-compatible endpoint cache
+# byte-identical prompt prefixes automatically and need no hint.
+CACHE_CONTROL_MODEL_PATTERNS = (
+    r"^(openrouter/)?anthropic/",
+    r"^(openrouter/)?google/gemini",
+    r"^claude-",
+)
+
+
+def supports_cache_control(model_name: Optional[str]) -> bool:
+    """Whether prompts for this model should carry explicit cache_control hints."""
+    return bool(model_name) and any(re.match(p, model_name) for p in CACHE_CONTROL_MODEL_PATTERNS)
+
+
+def get_cached_prompt_tokens(token_usage: Dict[str, Any]) -> int:
+    """Extracts prompt tokens served from the provider's prompt cache."""
+    details = token_usage.get("prompt_tokens_details") or {}
+    cached = (
+        details.get("cached_tokens")                    # OpenAI / OpenRouter / Qwen
+        or token_usage.get("prompt_cache_hit_tokens")   # DeepSeek
+        or token_usage.get("cache_read_input_tokens")   # Anthropic-compatible proxies
+        or 0
+    )
+    return int(cached)
+
+
+def calculate_cost(model_name: str, prompt_tokens: int, completion_tokens: int, cached_prompt_tokens: int = 0) -> Dict[str, float]:
+    """Calculates the token cost for a given model; cached prompt tokens are billed at the provider's cache rate."""
     provider_config = get_provider_config(model_name)
     model_cost_config = provider_config["costs"]
     
     # Find specific cost or use default for that provider
     costs = model_cost_config.get(model_name, model_cost_config["default"])
+    cache_read_ratio = provider_config.get("cache_read_ratio", 1.0)
     
-    prompt_cost = prompt_tokens * costs["prompt"]
+    cached_prompt_tokens = min(cached_prompt_tokens, prompt_tokens)
+    uncached_prompt_tokens = prompt_tokens - cached_prompt_tokens
+    prompt_cost = (uncached_prompt_tokens + cached_prompt_tokens * cache_read_ratio) * costs["prompt"]
     completion_cost = completion_tokens * costs["completion"]
     total_cost = prompt_cost + completion_cost
     
     return {
         "prompt_cost": prompt_cost,
         "completion_cost": completion_cost,
-        "total_cost": total_cost
+        "total_cost": total_cost,
+        "cache_savings": cached_prompt_tokens * (1 - cache_read_ratio) * costs["prompt"]
     }
 
+# Per-run usage accumulator. Callers that need the cost of a single workflow run
+# (e.g. to bill a cancelled run) call track_run_usage() inside the task that
+# drives the graph; LangChain copies the context into callback executions, so
+# every TokenCounterHandler in that run adds to the same dict.
+_run_usage: ContextVar[Optional[Dict[str, float]]] = ContextVar("mcp_swe_run_usage", default=None)
+
+
+def track_run_usage() -> Dict[str, float]:
+    """Start accumulating LLM usage for the current task and return the live dict."""
+    usage = {"llm_calls": 0, "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+    _run_usage.set(usage)
+    return usage
+
+
+# Usage of phases inside a run (e.g. planning, one model of a race). Unlike the
+# run-level dict they are scoped and nest: every enclosing phase also counts the
+# calls of an inner one, and the previous phases are restored when a block exits.
+_phase_usage: ContextVar[tuple] = ContextVar("mcp_swe_phase_usage", default=())
+
+
+@contextmanager
+def track_phase_usage():
+    """Accumulate LLM usage of the enclosed calls into a fresh dict (yielded)."""
+    usage = {"llm_calls": 0, "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+    token = _phase_usage.set(_phase_usage.get() + (usage,))
+    try:
+        yield usage
+    finally:
+        _phase_usage.reset(token)
+
+
+def _final_message(response: Any):
+    try:
+        return response.generations[0][0].message
+    except (AttributeError, IndexError, TypeError):
+        return None
+
+
+def _usage_from_generations(response: Any) -> Dict[str, Any]:
+    """Converts a streamed message's usage_metadata into the token_usage layout."""
+    usage_metadata = getattr(_final_message(response), "usage_metadata", None) or {}
+    if not usage_metadata:
+        return {}
+    return {
+        "prompt_tokens": usage_metadata.get("input_tokens", 0),
+        "completion_tokens": usage_metadata.get("output_tokens", 0),
+        "total_tokens": usage_metadata.get("total_tokens", 0),
+        "prompt_tokens_details": {
+            "cached_tokens": (usage_metadata.get("input_token_details") or {}).get("cache_read", 0)
+        },
+    }
+
+
+def _model_from_generations(response: Any) -> Optional[str]:
+    return (getattr(_final_message(response), "response_metadata", None) or {}).get("model_name")
+
+
 # Token计数回调处理器
 class TokenCounterHandler(BaseCallbackHandler):
     """跟踪LLM调用的token使用情况的回调处理器"""
@@ -174,14 +270,17 @@ class TokenCounterHandler(BaseCallbackHandler):
         
     def on_llm_end(self, response: Any, **kwargs):
         """记录LLM调用结束和token使用"""
-        usage = response.llm_output.get("token_usage", {})
+        llm_output = response.llm_output or {}
+        # Streamed responses carry usage on the final message instead of llm_output
+        usage = llm_output.get("token_usage") or _usage_from_generations(response)
         prompt_tokens = usage.get("prompt_tokens", 0)
         completion_tokens = usage.get("completion_tokens", 0)
         total_tokens = usage.get("total_tokens", 0)
+        cached_prompt_tokens = get_cached_prompt_tokens(usage)
         
         # 计算成本（如果需要）
-        model_name = response.llm_output.get("model_name", "unknown")
-        costs = calculate_cost(model_name, prompt_tokens, completion_tokens)
+        model_name = llm_output.get("model_name") or _model_from_generations(response) or "unknown"
+        costs = calculate_cost(model_name, prompt_tokens, completion_tokens, cached_prompt_tokens)
         
         # 记录使用信息
         self.agent_logger.log_llm_usage(
@@ -193,15 +292,25 @@ class TokenCounterHandler(BaseCallbackHandler):
             completion_cost=costs["completion_cost"]
         )
         
+        for usage in (_run_usage.get(), *_phase_usage.get()):
+            if usage is not None:
+                usage["llm_calls"] += 1
+                usage["input_tokens"] += prompt_tokens
+                usage["cached_input_tokens"] += cached_prompt_tokens
+                usage["output_tokens"] += completion_tokens
+                usage["cost"] += costs["total_cost"]
+        
         # 记录响应日志
         self.agent_logger.log(event_type="llm_response", 
                            call_id=self.call_id,
                            usage_metadata={
                                "model": model_name,
                                "input_tokens": prompt_tokens,
+                               "cached_input_tokens": cached_prompt_tokens,
                                "output_tokens": completion_tokens,
                                "total_tokens": total_tokens,
-                               "cost": costs["total_cost"]
+                               "cost": costs["total_cost"],
+                               "cache_savings": costs["cache_savings"]
                            })
                        
     def on_llm_error(self, error: Exception, **kwargs):
@@ -210,16 +319,25 @@ class TokenCounterHandler(BaseCallbackHandler):
                            call_id=getattr(self, "call_id", str(uuid.uuid4())),
                            error=str(error))
 
+def get_forced_swe_model() -> Optional[str]:
+    """
+    Model pinned for every SWE-Agent by SWE_AGENT_FORCED_MODEL, regardless of
+    the requested one (empty disables the pin, so requested models are used).
+    """
+    return os.getenv("SWE_AGENT_FORCED_MODEL", "openrouter/anthropic/claude-3.5-sonnet").strip() or None
+
+
 # --- Dynamic LLM Instantiation ---
 # Global llm and llm_with_tools are removed.
 
 def get_llm_for_agent(agent_name: str, model_override: Optional[str] = None) -> ChatOpenAI:
     """
     Dynamically gets an LLM instance for a specific agent.
-    - If a 'model_override' is provided for an 'SWE-Agent', it will be used.
+    - If SWE_AGENT_FORCED_MODEL is set, it is used for every 'SWE-Agent'.
+    - Else if a 'model_override' is provided for an 'SWE-Agent', it will be used.
     - Otherwise, it determines the correct model from AGENT_MODEL_MAPPING.
     """
-    model_override = "openrouter/anthropic/claude-3.5-sonnet"
+    model_override = get_forced_swe_model() or model_override
     # 🔧 新增:清理agent_name中的非ASCII字符,防止HTTP headers编码错误
     safe_agent_name = re.sub(r'[^\x00-\x7F]+', '', agent_name)
     if not safe_agent_name:
@@ -345,9 +463,12 @@ __all__ = [
     "DEFAULT_REFINEMENT_DIR",
     "DEFAULT_TEST_REPORT_DIR",
     "get_llm_for_agent",
+    "get_forced_swe_model",
     "MODEL_CONFIG",
     "AGENT_MODEL_MAPPING",
     "get_provider_config",
     "calculate_cost",
+    "supports_cache_control",
+    "get_cached_prompt_tokens",
     "TokenCounterHandler"
 ] 
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""
+Token-budgeted conversation context for the codegen and refiner loops.
+
+Both loops resend their whole history on every turn: full Tavily dumps,
+Context7 pages and every earlier code draft. Prompt tokens therefore grow
+quadratically with the number of turns. ``ContextBudget.fit`` builds the
+message list actually sent for a turn. The stored history is left untouched
+and the first message (the task prompt) is never altered.
+
+1. Only the latest code draft is kept. Earlier drafts are replaced by a
+   one-line placeholder. A draft is a save-file tool call's ``content``, or an
+   assistant reply containing a ``refined_code`` JSON or a Python code block.
+2. If the prompt is still over CONTEXT_TOKEN_BUDGET, tool outputs older than
+   the latest turn are cut to their first CONTEXT_TOOL_OUTPUT_CHARS
+   characters.
+3. If that is not enough, those old tool outputs are evicted, leaving a
+   one-line note.
+4. As a last resort, the oldest turns are dropped as whole groups: an
+   assistant message together with its tool results, so tool_call ids stay
+   paired.
+
+Each compaction is deterministic, so a message compacts the same way on every
+later turn, and provider prefix caches keep matching from one turn to the next.
+Every ``fit`` logs a ``context_budget`` event with the prompt size before and
+after compaction.
+
+Environment:
+    CONTEXT_TOKEN_BUDGET       prompt token budget per call (default 48000, 0 disables steps 2-4)
+    CONTEXT_TOOL_OUTPUT_CHARS  characters kept from old tool outputs (default 600)
+"""
+import json
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+
+from logger import logger
+from mcp_swe_flow.config import get_env_int
+from mcp_swe_flow.tool_executor import SAVE_FILE_TOOL_NAME
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def _text_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _content_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return str(content or "")
+
+
+def message_tokens(message: BaseMessage) -> int:
+    """Approximate prompt tokens of one message (content plus tool call arguments)."""
+    tokens = 4 + _text_tokens(_content_text(message.content))
+    for call in getattr(message, "tool_calls", None) or []:
+        tokens += _text_tokens(call.get("name") or "") + _text_tokens(json.dumps(call.get("args") or {}, ensure_ascii=False))
+    return tokens
+
+
+def estimate_tokens(messages: List[BaseMessage]) -> int:
+    return sum(message_tokens(m) for m in messages)
+
+
+def _is_code_draft(message: BaseMessage) -> bool:
+    if not isinstance(message, AIMessage):
+        return False
+    if any(call.get("name") == SAVE_FILE_TOOL_NAME for call in message.tool_calls or []):
+        return True
+    text = _content_text(message.content)
+    return '"refined_code"' in text or "```python" in text
+
+
+def _draft_placeholder(code: str) -> str:
+    return f"[earlier code draft omitted ({len(code.splitlines())} lines); superseded by a later draft]"
+
+
+def _without_draft(message: AIMessage) -> AIMessage:
+    tool_calls = []
+    for call in message.tool_calls or []:
+        args = call.get("args") or {}
+        if call.get("name") == SAVE_FILE_TOOL_NAME and isinstance(args.get("content"), str):
+            call = {**call, "args": {**args, "content": _draft_placeholder(args["content"])}}
+        tool_calls.append(call)
+    text = _content_text(message.content)
+    content = _draft_placeholder(text) if ('"refined_code"' in text or "```python" in text) else message.content
+    return message.model_copy(update={"content": content, "tool_calls": tool_calls})
+
+
+def _shrink_tool_output(message: ToolMessage, keep_chars: int) -> ToolMessage:
+    text = _content_text(message.content)
+    if len(text) <= keep_chars:
+        return message
+    if keep_chars <= 0:
+        content = f"[earlier tool output evicted ({len(text)} chars) to stay within the context budget]"
+    else:
+        content = f"{text[:keep_chars]}\n... [truncated {len(text) - keep_chars} chars of earlier tool output]"
+    return message.model_copy(update={"content": content})
+
+
+class ContextBudget:
+    """Compacts a loop's message history to a per-call prompt token budget."""
+
+    def __init__(self, agent_logger=None, budget: Optional[int] = None, tool_output_chars: Optional[int] = None):
+        self.agent_logger = agent_logger
+        self.budget = get_env_int("CONTEXT_TOKEN_BUDGET", 48000) if budget is None else budget
+        self.tool_output_chars = (
+            get_env_int("CONTEXT_TOOL_OUTPUT_CHARS", 600) if tool_output_chars is None else tool_output_chars
+        )
+        self.turns: List[Dict[str, int]] = []
+
+    def _over(self, messages: List[BaseMessage]) -> bool:
+        return self.budget > 0 and estimate_tokens(messages) > self.budget
+
+    def fit(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        """
+        Returns the messages to send for the next call, within the token budget
+        where possible.
+        """
+        tokens_before = estimate_tokens(messages)
+        fitted = list(messages)
+
+        # The latest assistant message and everything after it form the current turn
+        last_ai = max((i for i, m in enumerate(fitted) if isinstance(m, AIMessage)), default=len(fitted))
+        drafts = [i for i, m in enumerate(fitted) if i > 0 and _is_code_draft(m)]
+        for i in drafts[:-1]:
+            fitted[i] = _without_draft(fitted[i])
+
+        evicted = 0
+        for keep_chars in (self.tool_output_chars, 0):
+            if not self._over(fitted):
+                break
+            for i in range(1, last_ai):
+                if isinstance(fitted[i], ToolMessage):
+                    shrunk = _shrink_tool_output(fitted[i], keep_chars)
+                    evicted += shrunk is not fitted[i]
+                    fitted[i] = shrunk
+
+        dropped = 0
+        while self._over(fitted):
+            # Oldest droppable group: a message (plus the tool results answering it) before the current turn
+            last_ai = max((i for i, m in enumerate(fitted) if isinstance(m, AIMessage)), default=len(fitted))
+            if last_ai <= 1:
+                break
+            end = 2
+            while end < last_ai and isinstance(fitted[end], ToolMessage):
+                end += 1
+            dropped += end - 1
+            del fitted[1:end]
+
+        tokens_after = estimate_tokens(fitted) if fitted is not messages else tokens_before
+        stats = {
+            "turn": len(self.turns) + 1,
+            "messages": len(fitted),
+            "tokens_before": tokens_before,
+            "tokens_after": tokens_after,
+            "budget": self.budget,
+            "drafts_omitted": max(len(drafts) - 1, 0),
+            "tool_outputs_compacted": evicted,
+            "messages_dropped": dropped,
+        }
+        self.turns.append(stats)
+        logger.info(
+            f"Context turn {stats['turn']}: ~{tokens_after} prompt tokens "
+            f"(~{tokens_before} before compaction, budget {self.budget})"
+        )
+        if self.agent_logger:
+            self.agent_logger.log(event_type="context_budget", **stats)
+        return fitted
+
+
+__all__ = ["ContextBudget", "estimate_tokens", "message_tokens"]
@@ -13,8 +13,15 @@ from mcp_swe_flow.nodes import (
 from logger import logger
 
 
-def create_mcp_swe_workflow():
-    """Creates the LangGraph workflow for the MCP agent system."""
+def create_mcp_swe_workflow(checkpointer=None):
+    """
+    Creates the LangGraph workflow for the MCP agent system.
+
+    Args:
+        checkpointer: Optional LangGraph checkpoint saver. When provided, every
+            completed node is checkpointed under the run's ``thread_id`` so an
+            interrupted run can resume from the last completed node.
+    """
     workflow = StateGraph(MCPWorkflowState)
 
     # Add nodes to the graph
@@ -106,6 +113,6 @@ def create_mcp_swe_workflow():
 
     # Compile the graph
     logger.info("Compiling the graph...")
-    app = workflow.compile()
+    app = workflow.compile(checkpointer=checkpointer)
     logger.info("Graph compiled successfully.")
     return app 
\ No newline at end of file
@@ -0,0 +1,169 @@
+"""
+Speculative multi-model racing for code generation.
+
+Generation latency differs a lot between providers, so for premium requests
+``swe_generate_node`` can start code generation on several models at once
+(``state["race_models"]``). Each candidate writes into its own model directory
+and, once its server file is saved, must pass two gates:
+
+- static: the pre-test gate of ``static_gate`` (syntax, imports, FastMCP
+  tool signatures and the ``run()`` entry point);
+- server start: the server launches over stdio, completes the MCP handshake
+  and lists at least one tool.
+
+The first candidate through both gates wins and the others are cancelled, so
+they stop spending tokens. The full server test then runs on the winner as
+usual. Every race records, per candidate, latency, LLM usage and cost, and the
+outcome (``won`` / ``failed`` / ``cancelled``). The report is logged as a
+``model_race`` event and returned as ``state["race_report"]``, so the extra
+spend can be weighed against the latency gained.
+
+Each candidate runs under its own agent name (``race_candidate``), so its LLM
+usage lands in its own log files: the statistics node only sees the chosen
+candidate's logs and the other candidates' cost comes from this report.
+Usage is recorded when an LLM call completes; a call still in flight when its
+candidate is cancelled is billed by the provider but never reported, so
+cancelled candidates' cost is a lower bound (flagged in the report).
+
+Candidates resolving to the same effective model (e.g. under
+SWE_AGENT_FORCED_MODEL) are collapsed, so a pinned deployment never races.
+"""
+import asyncio
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from logger import logger, get_agent_logger
+from mcp_swe_flow.config import PROJECT_ROOT, get_forced_swe_model, get_env_int, track_phase_usage
+from mcp_swe_flow.static_gate import check_server_file
+
+GenerateFn = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+def candidate_models(models: Optional[List[str]]) -> List[str]:
+    """Distinct race candidates; empty or single-entry when racing is pointless."""
+    forced = get_forced_swe_model()
+    if forced:
+        return [forced] if models else []
+    seen = []
+    for model in models or []:
+        if model and model not in seen:
+            seen.append(model)
+    return seen
+
+
+async def server_start_gate(server_file: Path) -> List[str]:
+    """Launches the server, completes the MCP handshake and lists its tools."""
+    from mcp_swe_flow.adapters.mcp_client_adapter import MCPClientAdapter
+
+    adapter = MCPClientAdapter()
+    timeout = get_env_int("MODEL_RACE_GATE_TIMEOUT_SECONDS", 60)
+    try:
+        tools = await asyncio.wait_for(adapter.connect_stdio_file(str(server_file), cwd=PROJECT_ROOT), timeout)
+        return [] if tools else ["server started but lists no tools"]
+    except asyncio.TimeoutError:
+        return [f"server did not complete the MCP handshake within {timeout}s"]
+    except Exception as e:
+        return [f"server failed to start: {e}"]
+    finally:
+        await adapter.disconnect()
+
+
+async def race_generation(state: Dict[str, Any], models: List[str], generate: GenerateFn) -> Dict[str, Any]:
+    """
+    Runs ``generate`` for every model concurrently and returns the state of the
+    first candidate that passes both gates (with ``race_report`` added).
+
+    If no candidate passes, the first candidate (in ``models`` order) that
+    produced a server file is returned so the normal test/refine loop can
+    still repair it; if none did, the first candidate's (error) state.
+    """
+    agent_logger = get_agent_logger("SWE-Agent-ModelRace")
+    logger.info(f"--- Racing code generation on {models} ---")
+    agent_logger.log(event_type="model_race_start", models=models)
+    race_started = time.monotonic()
+
+    records = {model: {"model": model, "outcome": "running"} for model in models}
+    results: Dict[str, Dict[str, Any]] = {}
+
+    async def run_candidate(model: str) -> bool:
+        record = records[model]
+        started = time.monotonic()
+        with track_phase_usage() as usage:
+            try:
+                result = await generate({
+                    **state,
+                    "swe_model": model,
+                    "race_models": None,
+                    "race_candidate": model,
+                    "log_files": list(state.get("log_files") or []),
+                })
+                results[model] = result
+                server_file = result.get("server_file_path")
+                if result.get("error") or not server_file:
+                    issues = [result.get("error") or "no server file was saved"]
+                else:
+                    issues = check_server_file(Path(server_file)).issues or await server_start_gate(Path(server_file))
+                record["outcome"] = "passed" if not issues else "failed"
+                if issues:
+                    record["issues"] = issues
+                return not issues
+            except asyncio.CancelledError:
+                record["outcome"] = "cancelled"
+                # The call in flight at cancellation never reports its usage
+                record["cost_is_lower_bound"] = True
+                raise
+            except Exception as e:
+                record["outcome"] = "failed"
+                record["issues"] = [str(e)]
+                return False
+            finally:
+                record["latency_s"] = round(time.monotonic() - started, 3)
+                record.update({key: usage[key] for key in ("llm_calls", "input_tokens", "output_tokens")})
+                record["cost"] = round(usage["cost"], 6)
+
+    tasks = {asyncio.create_task(run_candidate(model)): model for model in models}
+    winner = None
+    try:
+        pending = set(tasks)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Among candidates finishing in the same tick, prefer the configured order
+            for task in sorted(done, key=lambda t: models.index(tasks[t])):
+                if not task.cancelled() and task.exception() is None and task.result():
+                    winner = tasks[task]
+                    break
+    finally:
+        losers = [task for task in tasks if not task.done()]
+        for task in losers:
+            task.cancel()
+        await asyncio.gather(*losers, return_exceptions=True)
+
+    if winner:
+        records[winner]["outcome"] = "won"
+        chosen = winner
+    else:
+        chosen = next((m for m in models if (results.get(m) or {}).get("server_file_path")), models[0])
+    report = {
+        "winner": winner,
+        "chosen": chosen,
+        "wall_time_s": round(time.monotonic() - race_started, 3),
+        "total_cost": round(sum(r.get("cost", 0.0) for r in records.values()), 6),
+        "total_cost_is_lower_bound": any(r.get("cost_is_lower_bound") for r in records.values()),
+        "candidates": [records[m] for m in models],
+    }
+    logger.info(
+        f"Model race finished in {report['wall_time_s']}s: winner={winner}, "
+        f"total cost ${report['total_cost']:.4f} across {len(models)} candidates"
+    )
+    agent_logger.log(event_type="model_race", **report)
+
+    result = results.get(chosen) or {
+        **state,
+        "error": "All race candidates failed before producing a result.",
+        "next_step": "error_handler",
+    }
+    return {**result, "race_report": report}
+
+
+__all__ = ["candidate_models", "race_generation", "server_start_gate"]
@@ -4,11 +4,13 @@ from pathlib import Path
 
 from langchain_core.messages import HumanMessage, ToolMessage, AIMessage
 
-from mcp_swe_flow.prompts.utils import load_prompt
+from mcp_swe_flow.prompts.utils import load_prompt, build_prompt_message
 from mcp_swe_flow.state import MCPWorkflowState
 from mcp_swe_flow.config import llm, PROJECT_ROOT, get_llm_for_agent, get_env_int
 from mcp_swe_flow.tool import save_file_tool, read_file_tool, tavily_search_tool, context7_docs_tool
 from mcp_swe_flow.schema import Memory
+from mcp_swe_flow.tool_executor import execute_tool_calls
+from mcp_swe_flow.context_budget import ContextBudget
 from mcp_swe_flow.logger import logger, get_agent_logger
 
 # Define the maximum number of refinement loops to prevent infinite loops
@@ -17,6 +19,38 @@ MAX_REFINE_LOOPS = get_env_int("MAX_REFINE_LOOPS", 2)
 MAX_INTERNAL_TURNS = get_env_int("MAX_INTERNAL_TURNS", 5)
 MAX_INTERNAL_TOOL_CALLS = get_env_int("MAX_INTERNAL_TOOL_CALLS", 3)
 
+async def _assess_deliverability(api_name, server_code, test_report, agent_logger):
+    """Asks the LLM whether the tested code is deliverable; returns (decision, reason, assessment_data)."""
+    agent_logger.log(event_type="start_initial_assessment")
+    assessment_template = load_prompt("code_refiner/assess_deliverability.prompt")
+    assessment_prompt_str = assessment_template.render(
+        server_code=server_code,
+        test_report_str=json.dumps(test_report, indent=2) if isinstance(test_report, dict) else str(test_report)
+    )
+
+    assessment_llm = get_llm_for_agent(f"CodeRefiner-Agent-{api_name or 'custom'}")
+    assessment_response = await assessment_llm.ainvoke([HumanMessage(content=assessment_prompt_str)])
+
+    try:
+        json_match = re.search(r'```json\s*([\s\S]*?)\s*```', assessment_response.content, re.DOTALL)
+        if not json_match:
+            raise json.JSONDecodeError("No JSON block found in assessment response", assessment_response.content, 0)
+        assessment_data = json.loads(json_match.group(1).strip())
+        initial_decision = assessment_data["decision"]
+        reason = assessment_data.get("reason", "No reason provided.")
+        logger.info(f"Initial Assessment: {initial_decision}. Reason: {reason}")
+        agent_logger.log(event_type="initial_assessment_complete", decision=initial_decision, reason=reason)
+    except (json.JSONDecodeError, KeyError) as e:
+        error_msg = f"Failed to parse initial assessment from LLM: {e}. Defaulting to refinement."
+        logger.warning(error_msg)
+        initial_decision = "NEEDS_REFINEMENT"
+        reason = "Could not parse initial assessment."
+        agent_logger.log(event_type="initial_assessment_failed", error=error_msg)
+        # Ensure assessment_data exists even on failure, for logging purposes.
+        assessment_data = {"decision": initial_decision, "reason": reason, "error_details": error_msg}
+    return initial_decision, reason, assessment_data
+
+
 async def refine_code_node(state: MCPWorkflowState) -> MCPWorkflowState:
     """
     Refines the code based on the test report and decides whether to continue testing or deliver.
@@ -37,7 +71,8 @@ async def refine_code_node(state: MCPWorkflowState) -> MCPWorkflowState:
         logger.debug(f"Entered refine_code_node. Received state keys: {list(state.keys())}")
         
         refinement_loop_count = state.get("refinement_loop_count", 0) + 1
-        logger.info(f"--- Code Refinement Cycle {refinement_loop_count}/{MAX_REFINE_LOOPS} ---")
+        max_refine_loops = state.get("max_refine_loops") or MAX_REFINE_LOOPS
+        logger.info(f"--- Code Refinement Cycle {refinement_loop_count}/{max_refine_loops} ---")
         agent_logger.log(event_type="start_node", state={"refinement_loop_count": refinement_loop_count})
 
         # Get necessary information from state
@@ -52,38 +87,23 @@ async def refine_code_node(state: MCPWorkflowState) -> MCPWorkflowState:
         
         # --- Stage 1: Initial Assessment (Decide if refinement is needed) ---
         logger.info("--- Stage 1: Initial Code Assessment ---")
-        agent_logger.log(event_type="start_initial_assessment")
-        assessment_template = load_prompt("code_refiner/assess_deliverability.prompt")
-        assessment_prompt_str = assessment_template.render(
-            server_code=server_code,
-            test_report_str=json.dumps(test_report, indent=2) if isinstance(test_report, dict) else str(test_report)
-        )
-        
-        assessment_llm = get_llm_for_agent(f"CodeRefiner-Agent-{api_name or 'custom'}")
-        assessment_response = await assessment_llm.ainvoke([HumanMessage(content=assessment_prompt_str)])
-        
-        try:
-            json_match = re.search(r'```json\s*([\s\S]*?)\s*```', assessment_response.content, re.DOTALL)
-            if not json_match:
-                raise json.JSONDecodeError("No JSON block found in assessment response", assessment_response.content, 0)
-            assessment_data = json.loads(json_match.group(1).strip())
-            initial_decision = assessment_data["decision"]
-            reason = assessment_data.get("reason", "No reason provided.")
+        static_gate_issues = state.get("static_gate_issues") or []
+        if static_gate_issues:
+            # The server failed the static pre-test gate: it cannot be delivered, no assessment call needed
+            initial_decision = "NEEDS_REFINEMENT"
+            reason = f"Static pre-test gate failed with {len(static_gate_issues)} issue(s)."
+            assessment_data = {"decision": initial_decision, "reason": reason, "static_gate_issues": static_gate_issues}
             logger.info(f"Initial Assessment: {initial_decision}. Reason: {reason}")
             agent_logger.log(event_type="initial_assessment_complete", decision=initial_decision, reason=reason)
-        except (json.JSONDecodeError, KeyError) as e:
-            error_msg = f"Failed to parse initial assessment from LLM: {e}. Defaulting to refinement."
-            logger.warning(error_msg)
-            initial_decision = "NEEDS_REFINEMENT"
-            reason = "Could not parse initial assessment."
-            agent_logger.log(event_type="initial_assessment_failed", error=error_msg)
-            # Ensure assessment_data exists even on failure, for logging purposes.
-            assessment_data = {"decision": initial_decision, "reason": reason, "error_details": error_msg}
+        else:
+            initial_decision, reason, assessment_data = await _assess_deliverability(
+                api_name, server_code, test_report, agent_logger
+            )
 
         refined_code = server_code
         decision = initial_decision
         
-        is_max_refine_loops = refinement_loop_count >= MAX_REFINE_LOOPS
+        is_max_refine_loops = refinement_loop_count >= max_refine_loops
 
         # --- Stage 2: In-depth Refinement (if necessary) ---
         if initial_decision == "NEEDS_REFINEMENT" and not is_max_refine_loops:
@@ -108,15 +128,16 @@ async def refine_code_node(state: MCPWorkflowState) -> MCPWorkflowState:
             )
 
             memory = Memory()
-            memory.add_message(HumanMessage(content=refine_prompt))
+            memory.add_message(build_prompt_message(refine_prompt, refiner_llm))
             
             # --- Internal Loop: Refinement with Tools ---
             decision_data = None
             internal_tool_calls_used = 0
+            context = ContextBudget(agent_logger)
             for i in range(MAX_INTERNAL_TURNS):
                 logger.info(f"Refiner internal research turn {i + 1}/{MAX_INTERNAL_TURNS} (Tool calls used: {internal_tool_calls_used}/{MAX_INTERNAL_TOOL_CALLS})")
                 try:
-                    response_message = await refiner_llm.ainvoke(memory.messages)
+                    response_message = await refiner_llm.ainvoke(context.fit(memory.messages))
                 except UnicodeEncodeError as e:
                     logger.error(f"Encoding error in code refiner: {e}")
                     safe_messages = []
@@ -133,30 +154,15 @@ async def refine_code_node(state: MCPWorkflowState) -> MCPWorkflowState:
                     internal_tool_calls_used += len(response_message.tool_calls)
                     logger.info(f"LLM requested to execute tools: {[tc['name'] for tc in response_message.tool_calls]}")
                     tool_messages = []
-                    for tool_call in response_message.tool_calls:
-                        agent_logger.log(event_type="tool_call", tool=tool_call["name"], args=tool_call["args"], call_id=tool_call["id"])
-                        tool_to_execute = next((t for t in tools if t.name == tool_call["name"]), None)
-                        if tool_to_execute:
-                            try:
-                                tool_output = await tool_to_execute.ainvoke(tool_call["args"])
-                                
-                                final_output = str(tool_output)
-                                if internal_tool_calls_used >= MAX_INTERNAL_TOOL_CALLS:
-                                    final_output += f"\n\n[INFO] You have used all {MAX_INTERNAL_TOOL_CALLS} tool calls. You MUST now provide the complete 'refined_code'."
-
-                                logger.info(f"Tool output: {final_output}")
-                                agent_logger.log(event_type="tool_result", tool=tool_call["name"], output=final_output, call_id=tool_call["id"])
-                                tool_messages.append(ToolMessage(content=final_output, tool_call_id=tool_call["id"]))
-                            except Exception as e:
-                                error_msg = f"Error executing tool '{tool_call['name']}': {e}"
-                                logger.error(error_msg)
-                                agent_logger.log(event_type="tool_error", tool=tool_call["name"], error=error_msg, call_id=tool_call["id"])
-                                tool_messages.append(ToolMessage(content=error_msg, tool_call_id=tool_call["id"]))
-                        else:
-                            error_msg = f"Error: Tool '{tool_call['name']}' not found."
-                            logger.warning(error_msg)
-                            agent_logger.log(event_type="tool_error", tool=tool_call["name"], error=error_msg, call_id=tool_call["id"])
-                            tool_messages.append(ToolMessage(content=error_msg, tool_call_id=tool_call["id"]))
+                    results = await execute_tool_calls(response_message.tool_calls, tools, agent_logger)
+                    for result in results:
+                        if not result.ok:
+                            tool_messages.append(ToolMessage(content=result.error, tool_call_id=result.call_id))
+                            continue
+                        final_output = str(result.output)
+                        if internal_tool_calls_used >= MAX_INTERNAL_TOOL_CALLS:
+                            final_output += f"\n\n[INFO] You have used all {MAX_INTERNAL_TOOL_CALLS} tool calls. You MUST now provide the complete 'refined_code'."
+                        tool_messages.append(ToolMessage(content=final_output, tool_call_id=result.call_id))
                     
                     memory.add_messages(tool_messages)
                     continue
@@ -240,18 +246,19 @@ async def refine_code_node(state: MCPWorkflowState) -> MCPWorkflowState:
             "server_file_path": str(refined_server_path),
             "refinement_loop_count": refinement_loop_count,
             "last_refinement_reason": reason,
+            "deliverability_assessment": decision,
             "project_dir": str(project_dir),
             "api_name": api_name
         }
         
         is_deliverable = decision == "DELIVERABLE"
-        is_max_refine_loops = refinement_loop_count >= MAX_REFINE_LOOPS
+        is_max_refine_loops = refinement_loop_count >= max_refine_loops
 
         # If deliverable, or if we've hit the max attempts, finalize.
         if is_deliverable or is_max_refine_loops:
             logger.info("✅ Code is ready for delivery or has reached the maximum number of retries. Entering project finalization phase.")
             if is_max_refine_loops and not is_deliverable:
-                logger.warning(f"Maximum refinement attempts ({MAX_REFINE_LOOPS}) reached. Forcing delivery.")
+                logger.warning(f"Maximum refinement attempts ({max_refine_loops}) reached. Forcing delivery.")
             
             # --- Project Finalization ---
             agent_logger.log(event_type="start_project_finalization")
@@ -268,7 +275,7 @@ async def refine_code_node(state: MCPWorkflowState) -> MCPWorkflowState:
             logger.info("📄 Generating README.md...")
             readme_template = load_prompt("code_refiner/generate_readme.prompt")
             readme_prompt = readme_template.render(refined_code=refined_code, api_name=api_name, mcp_doc=mcp_doc)
-            readme_response = await finalizer_llm.ainvoke([HumanMessage(content=readme_prompt)])
+            readme_response = await finalizer_llm.ainvoke([build_prompt_message(readme_prompt, finalizer_llm)])
             await save_file_tool.ainvoke({"file_path": str(relative_readme_path), "content": readme_response.content.strip()})
             logger.info(f"✅ README.md saved to: {readme_path}")
             agent_logger.log(event_type="readme_generated", path=str(readme_path))
@@ -277,7 +284,7 @@ async def refine_code_node(state: MCPWorkflowState) -> MCPWorkflowState:
             logger.info("📦 Generating requirements.txt...")
             req_template = load_prompt("code_refiner/generate_requirements.prompt")
             req_prompt = req_template.render(refined_code=refined_code)
-            req_response = await finalizer_llm.ainvoke([HumanMessage(content=req_prompt)])
+            req_response = await finalizer_llm.ainvoke([build_prompt_message(req_prompt, finalizer_llm)])
             await save_file_tool.ainvoke({"file_path": str(relative_req_path), "content": req_response.content.strip()})
             logger.info(f"✅ requirements.txt saved to: {requirements_path}")
             agent_logger.log(event_type="requirements_generated", path=str(requirements_path))
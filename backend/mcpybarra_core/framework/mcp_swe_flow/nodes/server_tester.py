@@ -7,216 +7,76 @@ from pathlib import Path
 from typing import Dict, List, Any
 import re
 
-from langchain_core.messages import HumanMessage
 from mcp_swe_flow.state import MCPWorkflowState
-from mcp_swe_flow.config import PROJECT_ROOT, get_llm_for_agent
+from mcp_swe_flow.config import PROJECT_ROOT, get_llm_for_agent, track_phase_usage
 from tool import save_file_tool
 from mcp_swe_flow.adapters import MCPClientAdapter
+from mcp_swe_flow.static_gate import check_server_code, static_gate_enabled
+from mcp_swe_flow.server_test_cache import load_test_plan, store_test_plan, tool_surface_hash
+from mcp_swe_flow.server_test_plan import execute_test_plan, validate_test_plan
 from logger import logger, get_agent_logger
-from mcp_swe_flow.prompts.utils import load_prompt
+from mcp_swe_flow.prompts.utils import load_prompt, build_prompt_message
 
-def _substitute_parameters(params: Dict[str, Any], outputs: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Recursively substitutes placeholders in a parameter dictionary.
-    This version uses a robust greedy traversal logic to handle keys containing dots.
-    Placeholder format: "$outputs.step_id.json_path" or "$outputs.step_id[index].json_path"
-    """
-    substituted_params = {}
-    for key, value in params.items():
-        if isinstance(value, str) and value.startswith("$outputs."):
-            try:
-                placeholder = value.replace("$outputs.", "")
-                
-                # Extract step_id using regex, stopping at the first '[' or '.'
-                match = re.match(r'^([a-zA-Z0-9_]+)', placeholder)
-                if not match:
-                    raise ValueError(f"Invalid placeholder format: could not extract step_id from '{placeholder}'")
-                
-                step_id = match.group(1)
-                path_to_process = placeholder[len(step_id):]
-                
-                if step_id not in outputs:
-                    raise KeyError(f"Step ID '{step_id}' not found in outputs")
-
-                current_value = outputs[step_id]['result']
-                
-                # --- Robust JSON parsing ---
-                if isinstance(current_value, str):
-                    json_match = re.search(r'```json\s*([\s\S]*?)\s*```', current_value, re.DOTALL)
-                    str_to_parse = json_match.group(1).strip() if json_match else current_value
-                    try:
-                        current_value = json.loads(str_to_parse)
-                    except json.JSONDecodeError:
-                        logger.warning(f"Could not parse output from step '{step_id}' as JSON. Proceeding with raw string.")
-                
-                # --- Greedy Traversal Logic ---
-                while path_to_process:
-                    # Check for index access first
-                    match_index = re.match(r'\[(\d+)\]', path_to_process)
-                    if match_index:
-                        index = int(match_index.group(1))
-                        if not isinstance(current_value, list):
-                            raise TypeError(f"Cannot apply index [{index}] to non-list value (type: {type(current_value).__name__}).")
-                        current_value = current_value[index]
-                        path_to_process = path_to_process[match_index.end():]
-                        continue
-
-                    # If not an index, it must be a dot-prefixed key
-                    if not path_to_process.startswith('.'):
-                        raise ValueError(f"Invalid path segment in placeholder: '{path_to_process}'")
-                    
-                    path_to_process = path_to_process[1:] # Consume the dot
-                    
-                    # Find the end of the current key segment (before next '[' or end of string)
-                    key_segment_match = re.match(r'[^\[\]]+', path_to_process)
-                    key_segment = key_segment_match.group(0)
-                    
-                    # Process this segment using greedy key matching
-                    sub_keys_to_process = key_segment.split('.')
-                    while sub_keys_to_process:
-                        matched = False
-                        # Try to match the longest possible key from the remaining parts
-                        for i in range(len(sub_keys_to_process), 0, -1):
-                            potential_key = ".".join(sub_keys_to_process[0:i])
-                            if isinstance(current_value, dict) and potential_key in current_value:
-                                current_value = current_value[potential_key]
-                                # Consume the matched parts
-                                sub_keys_to_process = sub_keys_to_process[i:]
-                                matched = True
-                                break # Restart the while loop with remaining sub_keys
-                        
-                        if not matched:
-                            unresolved_key = ".".join(sub_keys_to_process)
-                            raise KeyError(f"Could not resolve key '{unresolved_key}' in placeholder '{value}'")
-                    
-                    # Consume the processed segment from the main path
-                    path_to_process = path_to_process[len(key_segment):]
-
-                substituted_params[key] = current_value
-
-            except (KeyError, TypeError, IndexError, ValueError) as e:
-                logger.error(f"❌ Failed to resolve placeholder '{value}': {e}")
-                substituted_params[key] = None # Mark as failed
-        elif isinstance(value, dict):
-            substituted_params[key] = _substitute_parameters(value, outputs)
-        elif isinstance(value, list):
-            substituted_params[key] = [
-                _substitute_parameters(item, outputs) if isinstance(item, dict) else item
-                for item in value
-            ]
-        else:
-            substituted_params[key] = value
-    return substituted_params
-
-def _validate_test_plan(test_plan: List[Dict[str, Any]]):
-    """Validates the structure and logic of the test plan."""
-    defined_step_ids = set()
-    for i, step in enumerate(test_plan):
-        if not all(k in step for k in ["step_id", "tool_name", "parameters", "description"]):
-            raise ValueError(f"Test plan step {i+1} is missing required fields ('step_id', 'tool_name', 'parameters', 'description').")
-        
-        step_id = step["step_id"]
-        if step_id in defined_step_ids:
-            raise ValueError(f"Found duplicate step_id in test plan: '{step_id}'")
-        
-        params_str = json.dumps(step["parameters"])
-        dependencies = re.findall(r'"\$outputs\.([^.\["]+)', params_str)
-        for dep_id in dependencies:
-            if dep_id not in defined_step_ids:
-                raise ValueError(f"Step '{step_id}' depends on an undefined step '{dep_id}'.")
-        
-        defined_step_ids.add(step_id)
-    logger.info("✅ Test plan validation passed.")
-
-
-async def _execute_test_plan(mcp_adapter: MCPClientAdapter, test_plan: List[Dict[str, Any]], agent_logger) -> List[Dict[str, Any]]:
-    """
-    Executes the test plan, handling dependencies and logging results.
-    This function does not interact with an LLM.
-    """
-    logger.info("🚀 Starting test plan execution...")
-    execution_log = []
-    step_outputs = {}
-
-    for i, step in enumerate(test_plan):
-        step_id = step.get("step_id")
-        tool_name = step.get("tool_name")
-        params = step.get("parameters", {})
-        description = step.get("description", "No description")
-
-        logger.info(f"🔄 (Step {i+1}/{len(test_plan)}) Preparing to execute: {step_id} - {tool_name}")
-        agent_logger.log(event_type="test_step_start", step_id=step_id, tool_name=tool_name, description=description)
-
-        substituted_params = _substitute_parameters(params, step_outputs)
-        
+async def _generate_test_plan(test_agent_llm, tools_info: List[Dict[str, Any]], server_code: str) -> List[Dict[str, Any]]:
+    """Asks the ServerTest-Agent for a test plan covering the listed tools."""
+    # New: List available files in the test files directory
+    test_files_dir = PROJECT_ROOT / "testSystem" / "testFiles"
+    test_files_info = "No test files currently available."
+    if test_files_dir.exists() and test_files_dir.is_dir():
         try:
-            # Propagate failure: if any substituted parameter is None due to a previous step's failure, this step should also fail.
-            if any(v is None for v in substituted_params.values()):
-                # Find the first placeholder that resolved to None
-                failed_placeholder = next((p_val for p_key, p_val in params.items() if substituted_params.get(p_key) is None), "unknown")
-                raise ValueError(f"A required parameter resolved to None, likely due to a failure in a dependency. Failed placeholder: '{failed_placeholder}'")
+            test_files_paths = [str(f.resolve()) for f in test_files_dir.iterdir() if f.is_file()]
+            if test_files_paths:
+                test_files_info = (
+                    "The following files are available for testing. When testing tools that require file paths,"
+                    "you **must** use the absolute paths provided below:\n"
+                    + "\n".join([f"- `{path}`" for path in test_files_paths])
+                )
+            logger.info(f"Found test files:\n{test_files_info}")
+        except Exception as e:
+            logger.warning(f"Error scanning test file directory '{test_files_dir}': {e}")
+            test_files_info = f"Error scanning for test files: {e}"
+    else:
+        logger.warning(f"Test file directory not found: {test_files_dir}")
 
-            tool_to_invoke = next((t for t in mcp_adapter.tools if t.name == tool_name), None)
-            if not tool_to_invoke:
-                raise ValueError(f"Tool '{tool_name}' not found in adapter")
+    plan_template = load_prompt("server_tester/generate_test_plan.prompt")
+    plan_prompt = plan_template.render(
+        tool_schemas=json.dumps(tools_info, indent=2, ensure_ascii=False),
+        server_code=server_code,
+        test_files_info=test_files_info
+    )
 
-            # Enhanced robustness: add a 60-second timeout for the tool call
-            result = await asyncio.wait_for(
-                tool_to_invoke.ainvoke(substituted_params),
-                timeout=60.0
-            )
+    logger.info("🤖 Requesting LLM to generate test plan...")
+    plan_response = await test_agent_llm.ainvoke([build_prompt_message(plan_prompt, test_agent_llm)])
 
-            # 检查结果是否包含错误信息，但排除适配器截断标记
-            is_error_in_result = isinstance(result, str) and (
-                ("error" in result.lower() 
-                or "failed" in result.lower() 
-                or "invalid" in result.lower()
-                or "exception" in result.lower())
-                # 排除适配器截断标记导致的误判
-                and not ("adapter_truncation_note" in result.lower() or "__adapter_truncation_note__" in result.lower())
-            )
+    json_match = re.search(r'```json\s*([\s\S]*?)\s*```', plan_response.content)
+    json_str = json_match.group(1).strip() if json_match else plan_response.content
+    test_plan = json.loads(json_str).get("test_plan", [])
 
-            if is_error_in_result:
-                logger.warning(f"    - ⚠️  Tool '{tool_name}' returned a potential error message: {result}")
-                step_result = {"status": "error", "result": result}
-                agent_logger.log(event_type="test_step_error", step_id=step_id, error=f"Tool returned an error message: {result}")
-            else:
-                # 检查是否存在适配器截断标记
-                has_adapter_truncation = isinstance(result, str) and ("adapter_truncation_note" in result.lower() or "__adapter_truncation_note__" in result.lower())
-                if has_adapter_truncation:
-                    logger.info(f"    - ℹ️ Execution successful with adapter truncation (not a tool error): {result[:200]}...")
-                else:
-                    logger.info(f"    - ✅ Execution successful: {result}")
-                    
-                step_result = {"status": "success", "result": result}
-                agent_logger.log(event_type="test_step_success", step_id=step_id, result=result)
-        
-        except asyncio.TimeoutError:
-            error_msg = f"Tool '{tool_name}' execution timed out (exceeded 60 seconds)."
-            logger.error(f"    - ❌ {error_msg}")
-            step_result = {"status": "error", "result": error_msg}
-            agent_logger.log(event_type="test_step_timeout", step_id=step_id, error=error_msg)
+    if not test_plan:
+        raise ValueError("Generated test plan is empty or incorrectly formatted.")
+    logger.info(f"✅ Successfully parsed test plan with {len(test_plan)} steps.")
+    logger.info(f"✅ Successfully parsed test plan:{test_plan}")
+    return test_plan
 
-        except Exception as e:
-            error_msg = f"Tool '{tool_name}' call failed: {e}"
-            logger.error(f"    - ❌ {error_msg}")
-            step_result = {"status": "error", "result": str(e)}
-            agent_logger.log(event_type="test_step_error", step_id=step_id, error=str(e))
-        
-        step_outputs[step_id] = step_result
-        execution_log.append({
-            "step": step,
-            "substituted_params": substituted_params,
-            "result": step_result
-        })
 
-    logger.info("✅ Test plan execution completed.")
-    return execution_log
+def _refinement_carry_over(state: MCPWorkflowState, project_dir: Path) -> Dict[str, Any]:
+    """Critical state passed on to the refiner explicitly, to prevent loss."""
+    carry_over = {
+        "server_file_path": state.get("server_file_path"),
+        "mcp_doc": state.get("mcp_doc"),
+        "project_dir": str(project_dir),  # Pass the stable project root directory
+    }
+    # Explicitly carry over the refinement loop count to ensure it's not lost
+    if "refinement_loop_count" in state:
+        carry_over["refinement_loop_count"] = state.get("refinement_loop_count")
+    return carry_over
 
 
 async def server_test_node(state: MCPWorkflowState) -> MCPWorkflowState:
     """
     Server test node, using a "Plan-Execute-Report" three-stage model.
+    A static pre-test gate runs first; code failing it goes straight back to
+    the refiner without starting the server or asking for a test plan.
     """
     api_name = state.get("api_name")
     agent_logger = get_agent_logger(f"ServerTest-Agent-{api_name or 'custom'}")
@@ -250,6 +110,30 @@ async def server_test_node(state: MCPWorkflowState) -> MCPWorkflowState:
         update["server_code"] = server_code
         logger.info(f"✅ Successfully read server code: {server_file_path}")
 
+        # ----------------- Stage 0: Static Pre-Test Gate -----------------
+        update["static_gate_issues"] = []
+        if static_gate_enabled():
+            gate = check_server_code(server_code, server_file_path)
+            agent_logger.log(event_type="static_gate", passed=gate.passed, issues=gate.issues, tools=gate.tools, elapsed_ms=gate.elapsed_ms)
+            if not gate.passed:
+                logger.warning(f"⛔ Static pre-test gate failed in {gate.elapsed_ms}ms ({len(gate.issues)} issues); skipping server start and test planning.")
+                test_report_content = gate.to_report(api_name)
+                report_path = current_test_output_dir / f"test_report_{api_name or 'custom'}.md"
+                try:
+                    relative_report_path = current_test_output_dir.relative_to(PROJECT_ROOT / "workspace") / report_path.name
+                    await save_file_tool.ainvoke({"file_path": str(relative_report_path), "content": test_report_content})
+                except Exception as e:
+                    logger.warning(f"⚠️ Failed to save static gate report: {e}")
+                update.update({
+                    "static_gate_issues": gate.issues,
+                    "test_report_path": str(report_path),
+                    "test_report_content": test_report_content,
+                    "next_step": "refine_code",
+                    **_refinement_carry_over(state, project_dir),
+                })
+                return  # the finally block assembles the state update
+            logger.info(f"✅ Static pre-test gate passed in {gate.elapsed_ms}ms ({len(gate.tools)} tools).")
+
         # 根据路径特征选择合适的连接方式
         if "gemini-2.5-pro" in str(server_file_path):
             logger.info(f"🔍 检测到 Gemini 模型生成的服务器，使用文件路径方式连接")
@@ -265,8 +149,8 @@ async def server_test_node(state: MCPWorkflowState) -> MCPWorkflowState:
             await mcp_adapter.connect_stdio(module_name, cwd=PROJECT_ROOT)
             agent_logger.log(event_type="mcp_adapter_connected", connection_type="module", module_name=module_name)
         
-        # ----------------- Stage 1: Generate Test Plan -----------------
-        logger.info("=============== Stage 1: Generate Test Plan ===============")
+        # ----------------- Stage 1: Generate (or Reuse) Test Plan -----------------
+        logger.info("=============== Stage 1: Generate (or Reuse) Test Plan ===============")
         
         tools_info = [{
             "name": tool.name,
@@ -274,51 +158,32 @@ async def server_test_node(state: MCPWorkflowState) -> MCPWorkflowState:
             "args_schema": tool.args_schema
         } for tool in mcp_adapter.tools]
         
-        # New: List available files in the test files directory
-        test_files_dir = PROJECT_ROOT / "testSystem" / "testFiles"
-        test_files_info = "No test files currently available."
-        if test_files_dir.exists() and test_files_dir.is_dir():
-            try:
-                test_files_paths = [str(f.resolve()) for f in test_files_dir.iterdir() if f.is_file()]
-                if test_files_paths:
-                    test_files_info = (
-                        "The following files are available for testing. When testing tools that require file paths,"
-                        "you **must** use the absolute paths provided below:\n"
-                        + "\n".join([f"- `{path}`" for path in test_files_paths])
-                    )
-                logger.info(f"Found test files:\n{test_files_info}")
-            except Exception as e:
-                logger.warning(f"Error scanning test file directory '{test_files_dir}': {e}")
-                test_files_info = f"Error scanning for test files: {e}"
-        else:
-            logger.warning(f"Test file directory not found: {test_files_dir}")
-
-        plan_template = load_prompt("server_tester/generate_test_plan.prompt")
-        plan_prompt = plan_template.render(
-            tool_schemas=json.dumps(tools_info, indent=2, ensure_ascii=False),
-            server_code=server_code,
-            test_files_info=test_files_info
-        )
-        
-        logger.info("🤖 Requesting LLM to generate test plan...")
         test_agent_llm = get_llm_for_agent(f"ServerTest-Agent-{api_name}")
-        plan_response = await test_agent_llm.ainvoke([HumanMessage(content=plan_prompt)])
-        
-        json_match = re.search(r'```json\s*([\s\S]*?)\s*```', plan_response.content)
-        json_str = json_match.group(1).strip() if json_match else plan_response.content
-        test_plan = json.loads(json_str).get("test_plan", [])
+        tool_surface = tool_surface_hash(mcp_adapter.tools)
+        cached_plan = load_test_plan(current_test_output_dir, tool_surface)
+        if cached_plan:
+            test_plan = cached_plan["test_plan"]
+            logger.info(f"♻️ Tool surface unchanged, reusing cached test plan with {len(test_plan)} steps.")
+            agent_logger.log(
+                event_type="test_plan_cache_hit",
+                tool_surface=tool_surface,
+                steps=len(test_plan),
+                planning_tokens_saved=cached_plan.get("planning_tokens", 0),
+                planning_cost_saved=cached_plan.get("planning_cost", 0.0),
+            )
+            validate_test_plan(test_plan)
+        else:
+            with track_phase_usage() as planning_usage:
+                test_plan = await _generate_test_plan(test_agent_llm, tools_info, server_code)
 
-        if not test_plan:
-            raise ValueError("Generated test plan is empty or incorrectly formatted.")
-        logger.info(f"✅ Successfully parsed test plan with {len(test_plan)} steps.")
-        logger.info(f"✅ Successfully parsed test plan:{test_plan}")
-        
-        # Enhanced robustness: validate the test plan
-        _validate_test_plan(test_plan)
+            # Enhanced robustness: validate the test plan
+            validate_test_plan(test_plan)
+            if store_test_plan(current_test_output_dir, tool_surface, test_plan, planning_usage):
+                agent_logger.log(event_type="test_plan_cache_store", tool_surface=tool_surface, planning_usage=planning_usage)
 
         # ----------------- Stage 2: Execute Test Plan -----------------
         logger.info("=============== Stage 2: Execute Test Plan ===============")
-        execution_log = await _execute_test_plan(mcp_adapter, test_plan, agent_logger)
+        execution_log = await execute_test_plan(mcp_adapter, test_plan, agent_logger)
         
         # Enhanced robustness: persist the raw execution log
         try:
@@ -350,7 +215,7 @@ async def server_test_node(state: MCPWorkflowState) -> MCPWorkflowState:
         report_prompt = load_prompt("server_tester/final_report.prompt").render(**report_context)
         
         logger.info("🤖 Requesting LLM to generate final test report...")
-        report_response = await test_agent_llm.ainvoke([HumanMessage(content=report_prompt)])
+        report_response = await test_agent_llm.ainvoke([build_prompt_message(report_prompt, test_agent_llm)])
         test_report_content = report_response.content
         logger.info("✅ Successfully generated test report.")
 
@@ -368,14 +233,7 @@ async def server_test_node(state: MCPWorkflowState) -> MCPWorkflowState:
         update["test_report_path"] = str(report_path)
         update["test_report_content"] = test_report_content
         update["next_step"] = "refine_code"
-
-        # Ensure critical state is passed to the next node to prevent loss
-        update['server_file_path'] = state.get('server_file_path')
-        update['mcp_doc'] = state.get('mcp_doc')
-        update['project_dir'] = str(project_dir) # Pass the stable project root directory
-        # Explicitly carry over the refinement loop count to ensure it's not lost
-        if "refinement_loop_count" in state:
-            update["refinement_loop_count"] = state.get("refinement_loop_count")
+        update.update(_refinement_carry_over(state, project_dir))
         
     except Exception as e:
         error_details = traceback.format_exc()
@@ -32,6 +32,8 @@ async def statistics_logger_node(state: MCPWorkflowState) -> MCPWorkflowState:
         logger.info(f"Aggregating statistics from {len(log_files)} log file(s)...")
         
         total_prompt_tokens = 0
+        total_cached_prompt_tokens = 0
+        total_cache_savings = 0.0
         total_completion_tokens = 0
         total_tokens = 0
         total_cost = 0.0
@@ -61,20 +63,24 @@ async def statistics_logger_node(state: MCPWorkflowState) -> MCPWorkflowState:
 
                                 model = metadata.get("model", "unknown")
                                 prompt_tokens = metadata.get("input_tokens", 0)
+                                cached_prompt_tokens = metadata.get("cached_input_tokens", 0)
                                 completion_tokens = metadata.get("output_tokens", 0)
                                 # The 'llm_response' event uses the 'cost' key for the total cost.
                                 cost = metadata.get("cost", 0.0)
                                 
                                 # Aggregate totals
                                 total_prompt_tokens += prompt_tokens
+                                total_cached_prompt_tokens += cached_prompt_tokens
+                                total_cache_savings += metadata.get("cache_savings", 0.0)
                                 total_completion_tokens += completion_tokens
                                 total_cost += cost
 
                                 # Aggregate per-model stats
                                 if model not in model_usage:
-                                    model_usage[model] = {"prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "calls": 0}
+                                    model_usage[model] = {"prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "calls": 0}
                                 
                                 model_usage[model]["prompt_tokens"] += prompt_tokens
+                                model_usage[model]["cached_prompt_tokens"] += cached_prompt_tokens
                                 model_usage[model]["completion_tokens"] += completion_tokens
                                 model_usage[model]["cost"] += cost
                                 model_usage[model]["calls"] += 1
@@ -92,6 +98,7 @@ async def statistics_logger_node(state: MCPWorkflowState) -> MCPWorkflowState:
                 logger.error(f"Failed to read or process log file {log_path}: {e}")
 
         total_tokens = total_prompt_tokens + total_completion_tokens
+        cache_hit_rate = total_cached_prompt_tokens / total_prompt_tokens if total_prompt_tokens else 0.0
 
         # --- Format the report ---
         report_content = f"""# Workflow Execution Statistics
@@ -104,6 +111,9 @@ async def statistics_logger_node(state: MCPWorkflowState) -> MCPWorkflowState:
 | **总预估成本 (RMB)** | **¥{total_cost:.6f}** |
 | **总工具调用次数** | **{total_tool_calls}** |
 | 提示 Token | {total_prompt_tokens:,} |
+| 其中缓存命中 Token | {total_cached_prompt_tokens:,} ({cache_hit_rate:.1%}) |
+| 其中未缓存 Token | {total_prompt_tokens - total_cached_prompt_tokens:,} |
+| 提示缓存节省 (RMB) | ¥{total_cache_savings:.6f} |
 | 完成 Token | {total_completion_tokens:,} |
 
 ---
@@ -124,6 +134,7 @@ async def statistics_logger_node(state: MCPWorkflowState) -> MCPWorkflowState:
 | **总成本 (RMB)** | **¥{usage['cost']:.6f}** |
 | 总 Token | {usage['prompt_tokens'] + usage['completion_tokens']:,} |
 | 提示 Token | {usage['prompt_tokens']:,} |
+| 缓存命中 Token | {usage['cached_prompt_tokens']:,} |
 | 完成 Token | {usage['completion_tokens']:,} |
 """
         
@@ -136,7 +147,7 @@ async def statistics_logger_node(state: MCPWorkflowState) -> MCPWorkflowState:
             for tool_name, count in sorted(tool_usage_counts.items()):
                 report_content += f"| `{tool_name}` | {count} |\n"
 
-        logger.info(f"Generated statistics summary: Total Tokens={total_tokens}, Total Cost=¥{total_cost:.6f}, Total Tool Calls={total_tool_calls}")
+        logger.info(f"Generated statistics summary: Total Tokens={total_tokens}, Cached Prompt Tokens={total_cached_prompt_tokens}, Total Cost=¥{total_cost:.6f}, Total Tool Calls={total_tool_calls}")
 
     # --- Save the report ---
     try:
@@ -9,10 +9,16 @@ import io
 from langchain_core.messages import HumanMessage, ToolMessage, AIMessage
 
 from mcp_swe_flow.state import MCPWorkflowState
-from mcp_swe_flow.config import get_llm_for_agent, llm, get_env_int
+from mcp_swe_flow.config import get_llm_for_agent, llm, get_env_int, track_phase_usage
+from mcp_swe_flow.plan_cache import plan_cache, normalize_request, adapt_plan
+from mcp_swe_flow.tool_executor import execute_tool_calls
+from mcp_swe_flow.context_budget import ContextBudget
+from mcp_swe_flow.model_race import candidate_models, race_generation
+from mcp_swe_flow.server_naming import GENERIC_NAME, generate_server_name, unique_server_name, llm_fallback_enabled
+from mcp_swe_flow.streaming_codegen import IncrementalCodeValidator, stream_with_validation, streaming_enabled
 from tool import tavily_search_tool, save_file_tool, context7_docs_tool
 from logger import logger, get_agent_logger
-from mcp_swe_flow.prompts.utils import load_prompt
+from mcp_swe_flow.prompts.utils import load_prompt, build_prompt_message
 
 # 修复后 - 仅在非Uvicorn子进程中覆写，避免破坏reload通信
 if sys.platform == 'win32' and not os.environ.get('UVICORN_STARTED'):
@@ -88,7 +94,178 @@ def _normalize_and_extract_tool_calls(response_message: AIMessage) -> AIMessage:
     return response_message
 
 
+async def run_planning_phase(base_llm, request_specific_part: str, mcp_doc: str, swe_model: str, agent_logger,
+                             max_turns=None, max_tool_calls=None):
+    """
+    Runs the SWE planning phase (plan prompt + optional search tool turns).
+
+    ``max_turns`` / ``max_tool_calls`` override MAX_PLANNING_TURNS / MAX_PLANNING_TOOL_CALLS.
+
+    Returns:
+        A ``(plan, error)`` tuple; exactly one of them is ``None``.
+    """
+    logger.info("--- Starting SWE Planning Phase ---")
+    agent_logger.log(event_type="start_planning_phase")
+
+    planning_tools = [tavily_search_tool]
+    planning_llm = base_llm.bind_tools(planning_tools)
+    logger.info(f"SWE-Planner has been equipped with tools: {[tool.name for tool in planning_tools]}")
+
+    MAX_PLANNING_TURNS = max_turns or get_env_int("MAX_PLANNING_TURNS", 4)
+    MAX_PLANNING_TOOL_CALLS = max_tool_calls or get_env_int("MAX_PLANNING_TOOL_CALLS", 2)
+    planning_tool_calls_used = 0
+    plan_prompt_template = load_prompt("swe_generator/generate_plan.prompt")
+    plan_prompt = plan_prompt_template.render(
+        request_specific_part=request_specific_part,
+        mcp_doc=mcp_doc,
+        tavily_search_tool_name=tavily_search_tool.name,
+        tavily_search_tool_description=tavily_search_tool.description,
+        max_planning_tool_calls=MAX_PLANNING_TOOL_CALLS
+    )
+    
+    planning_messages = [build_prompt_message(plan_prompt, base_llm)]
+    plan = None
+
+    for i in range(MAX_PLANNING_TURNS):
+        logger.info(f"Planning turn {i + 1}/{MAX_PLANNING_TURNS} (Tool calls used: {planning_tool_calls_used}/{MAX_PLANNING_TOOL_CALLS})")
+        try:
+            response_message = await planning_llm.ainvoke(planning_messages)
+            response_message = _normalize_and_extract_tool_calls(response_message)
+        except UnicodeEncodeError as e:
+            logger.error(f"Encoding error during LLM invocation: {e}")
+            # 强制转换为UTF-8
+            planning_messages_safe = []
+            for msg in planning_messages:
+                if hasattr(msg, 'content') and isinstance(msg.content, str):
+                    safe_content = msg.content.encode('utf-8', errors='ignore').decode('utf-8') 
+                    planning_messages_safe.append(type(msg)(content=safe_content))
+                else:
+                    planning_messages_safe.append(msg)
+            response_message = await planning_llm.ainvoke(planning_messages_safe)
+        except Exception as e:
+            logger.error(f"LLM invocation failed during planning phase: {e}", exc_info=True)
+            return None, f"LLM invocation failed during planning: {e}"
+            
+        planning_messages.append(response_message)
+
+        if response_message.tool_calls:
+            planning_tool_calls_used += len(response_message.tool_calls)
+            tool_messages_to_add = []
+            results = await execute_tool_calls(
+                response_message.tool_calls, planning_tools, agent_logger, error_event="planning_tool_error"
+            )
+            for result in results:
+                if not result.ok:
+                    tool_messages_to_add.append(ToolMessage(content=result.error, tool_call_id=result.call_id))
+                    continue
+                final_output_with_round_info = f"Tool '{result.name}' output:\n{str(result.output)}"
+                if planning_tool_calls_used >= MAX_PLANNING_TOOL_CALLS:
+                    final_output_with_round_info += f"\n\n[INFO] You have used {planning_tool_calls_used}/{MAX_PLANNING_TOOL_CALLS} tool calls. You must now generate the final plan based on the information you have gathered."
+                tool_messages_to_add.append(ToolMessage(content=final_output_with_round_info, tool_call_id=result.call_id))
+            planning_messages.extend(tool_messages_to_add)
+        else:
+            plan_content = response_message.content
+            # 根据模型类型进行特殊处理
+            if swe_model and 'gemini' in swe_model.lower():
+                logger.info(f"Detected Gemini model response in planning phase, applying special processing")
+                # 处理 Gemini 模型的思考型输出，移除 <thought>...</thought> 部分
+                if '<thought>' in plan_content:
+                    # 尝试提取思考后的实际输出
+                    thought_match = re.search(r'<thought>.*?</thought>(.*)', plan_content, re.DOTALL)
+                    if thought_match:
+                        plan_content = thought_match.group(1).strip()
+                    else:
+                        # 如果无法提取，则直接移除整个思考部分
+                        plan_content = re.sub(r'<thought>.*?</thought>', '', plan_content, flags=re.DOTALL).strip()
+            
+            # Relaxed condition: As long as the critical "MCP Tools Plan" section is present, accept the plan.
+            logger.info("Successfully generated development plan (found 'MCP Tools Plan').")
+            plan = plan_content
+            agent_logger.log(event_type="plan_generated", plan=plan)
+            break
+    if not plan:
+        logger.error("Failed to generate a plan within the allowed turns.")
+        return None, "Failed to generate a plan within the allowed turns."
+    return plan, None
+
+
+async def plan_with_cache(base_llm, request_specific_part: str, mcp_doc: str, swe_model: str, agent_logger, mask_values=None,
+                          max_turns=None, max_tool_calls=None):
+    """
+    Runs the planning phase through the plan cache.
+
+    ``mask_values`` are the request's product fields (name, price, ...), in a
+    fixed order; they are masked out of the cache fingerprint and, on a hit,
+    substituted into the cached plan in place of the original request's values.
+
+    Returns:
+        A ``(plan, error)`` tuple like ``run_planning_phase``.
+    """
+    fingerprint = normalize_request(request_specific_part, mask_values)
+    scope = plan_cache.scope(swe_model, mcp_doc)
+    # Product prompts may reuse a similar product's plan; free-form requests only an exact one
+    cached = await asyncio.to_thread(plan_cache.lookup, fingerprint, scope, any(mask_values or []))
+    if cached:
+        logger.info(
+            f"--- Skipping SWE Planning Phase: plan cache {cached['match']} hit "
+            f"(score {cached['score']}, ~{cached.get('planning_tokens', 0)} tokens saved) ---"
+        )
+        agent_logger.log(
+            event_type="plan_cache_hit",
+            match=cached["match"],
+            score=cached["score"],
+            planning_tokens_saved=cached.get("planning_tokens", 0),
+            planning_cost_saved=cached.get("planning_cost", 0.0),
+        )
+        return adapt_plan(cached["plan"], cached.get("mask_values"), mask_values), None
+
+    with track_phase_usage() as usage:
+        plan, error = await run_planning_phase(
+            base_llm, request_specific_part, mcp_doc, swe_model, agent_logger, max_turns, max_tool_calls
+        )
+    if plan:
+        await asyncio.to_thread(plan_cache.store, fingerprint, scope, plan, swe_model, usage=usage, mask_values=mask_values)
+        agent_logger.log(event_type="plan_cache_store", planning_usage=usage)
+    return plan, error
+
+
+async def generate_shared_plan(user_input: str, swe_model: str, mcp_doc: str, mask_values=None):
+    """
+    Generates a development plan outside the graph so several runs can share it.
+
+    Used by batch generation: products in the same category / service type get
+    the same tool plan, so it is produced once and passed in as ``shared_plan``.
+
+    Returns:
+        The plan text, or ``None`` if planning failed.
+    """
+    base_llm = get_llm_for_agent("SWE-Agent-SharedPlanner", model_override=swe_model)
+    if base_llm is None:
+        logger.error("LLM is not initialized. Cannot generate shared plan.")
+        return None
+    agent_logger = get_agent_logger("SWE-Agent-SharedPlanner")
+    request_specific_part = f"""
+User Request:
+{user_input}
+"""
+    plan, error = await plan_with_cache(base_llm, request_specific_part, mcp_doc, swe_model, agent_logger, mask_values)
+    if error:
+        logger.error(f"Shared planning failed: {error}")
+    return plan
+
+
 async def swe_generate_node(state: MCPWorkflowState) -> MCPWorkflowState:
+    """
+    Generates the MCP server code. When ``race_models`` lists several models,
+    generation is raced across them and the first candidate passing the gates wins.
+    """
+    models = candidate_models(state.get("race_models"))
+    if len(models) > 1:
+        return await race_generation(state, models, _swe_generate_single)
+    return await _swe_generate_single(state)
+
+
+async def _swe_generate_single(state: MCPWorkflowState) -> MCPWorkflowState:
     """Asynchronously generates MCP server code using LLM and saves it using a tool."""
     api_name = state.get("api_name")
     api_spec = state.get("api_spec")
@@ -97,12 +274,6 @@ async def swe_generate_node(state: MCPWorkflowState) -> MCPWorkflowState:
     # Get the specified model for the SWE agent, providing a fallback to prevent None.
     swe_model = state.get("swe_model") or os.getenv("SWE_AGENT_MODEL")
 
-    if not api_name and user_input:
-        api_name = await generate_server_name_from_user_input(user_input, swe_model)
-    
-    if not api_name:
-        api_name = "unnamed_mcp_server"
-
     # 从 swe_generator.py 回溯到项目根目录：
     # backend/mcpybarra_core/framework/mcp_swe_flow/nodes/swe_generator.py
     # ↑ 5层目录到达项目根
@@ -112,6 +283,19 @@ async def swe_generate_node(state: MCPWorkflowState) -> MCPWorkflowState:
 
     workspace_dir = PROJECT_ROOT / "workspace"
     output_servers_dir = workspace_dir / "pipeline-output-servers"
+
+    if not api_name and user_input:
+        # 本地生成服务名（关键词 + 产品名拼音），仅在开启开关且无可用关键词时调用LLM
+        mask_values = state.get("plan_mask_values") or []
+        api_name = generate_server_name(user_input, product_name=mask_values[0] if mask_values else None)
+        if api_name == GENERIC_NAME and llm_fallback_enabled():
+            api_name = await generate_server_name_from_user_input(user_input, swe_model) or api_name
+        api_name = unique_server_name(api_name, output_servers_dir / swe_model)
+        logger.info(f"Server name: '{api_name}'")
+    
+    if not api_name:
+        api_name = "unnamed_mcp_server"
+
     project_dir = output_servers_dir / swe_model / api_name
     
     # Create __init__.py files to make directories importable packages
@@ -140,7 +324,11 @@ async def swe_generate_node(state: MCPWorkflowState) -> MCPWorkflowState:
     # The absolute path will be stored in the workflow state for subsequent nodes
     absolute_server_path = (project_dir / server_file_name).resolve()
 
-    agent_logger = get_agent_logger(f"SWE-Agent-{api_name}")
+    # Race candidates share the api_name; each gets its own agent name, hence its own log and usage
+    agent_name = f"SWE-Agent-{api_name}"
+    if state.get("race_candidate"):
+        agent_name += "-" + re.sub(r"[^A-Za-z0-9._-]+", "_", state["race_candidate"])
+    agent_logger = get_agent_logger(agent_name)
     
     # Add the logger's file path to the state for aggregation later
     log_files = state.get("log_files", [])
@@ -150,7 +338,7 @@ async def swe_generate_node(state: MCPWorkflowState) -> MCPWorkflowState:
     logger.info("--- Starting SWE Generate Node ---")
     agent_logger.log(event_type="start_node", state=state)
     
-    base_llm = get_llm_for_agent(f"SWE-Agent-{api_name}", model_override=swe_model) 
+    base_llm = get_llm_for_agent(agent_name, model_override=swe_model) 
     if base_llm is None:
          logger.error("LLM is not initialized. Cannot proceed.")
          return {**state, "error": "LLM not initialized", "next_step": "error_handler"}
@@ -160,13 +348,6 @@ async def swe_generate_node(state: MCPWorkflowState) -> MCPWorkflowState:
         return {**state, "error": "Missing required MCP documentation.", "next_step": "error_handler"}
 
     # --- Phase 1: Planning ---
-    logger.info("--- Starting SWE Planning Phase ---")
-    agent_logger.log(event_type="start_planning_phase")
-
-    planning_tools = [tavily_search_tool]
-    planning_llm = base_llm.bind_tools(planning_tools)
-    logger.info(f"SWE-Planner has been equipped with tools: {[tool.name for tool in planning_tools]}")
-
     is_api_mode = api_spec is not None and api_name is not None
     if is_api_mode:
         request_specific_part = f"""
@@ -181,100 +362,19 @@ User Request:
 {user_input}
 """
 
-    MAX_PLANNING_TURNS = get_env_int("MAX_PLANNING_TURNS", 4)
-    MAX_PLANNING_TOOL_CALLS = get_env_int("MAX_PLANNING_TOOL_CALLS", 2)
-    planning_tool_calls_used = 0
-    plan_prompt_template = load_prompt("swe_generator/generate_plan.prompt")
-    plan_prompt = plan_prompt_template.render(
-        request_specific_part=request_specific_part,
-        mcp_doc=mcp_doc,
-        tavily_search_tool_name=tavily_search_tool.name,
-        tavily_search_tool_description=tavily_search_tool.description,
-        max_planning_tool_calls=MAX_PLANNING_TOOL_CALLS
-    )
-    
-    planning_messages = [HumanMessage(content=plan_prompt)]
-    plan = None
-
-    for i in range(MAX_PLANNING_TURNS):
-        logger.info(f"Planning turn {i + 1}/{MAX_PLANNING_TURNS} (Tool calls used: {planning_tool_calls_used}/{MAX_PLANNING_TOOL_CALLS})")
-        try:
-            response_message = await planning_llm.ainvoke(planning_messages)
-            response_message = _normalize_and_extract_tool_calls(response_message)
-        except UnicodeEncodeError as e:
-            logger.error(f"Encoding error during LLM invocation: {e}")
-            # 强制转换为UTF-8
-            planning_messages_safe = []
-            for msg in planning_messages:
-                if hasattr(msg, 'content'):
-                    safe_content = msg.content.encode('utf-8', errors='ignore').decode('utf-8') 
-                    planning_messages_safe.append(type(msg)(content=safe_content))
-                else:
-                    planning_messages_safe.append(msg)
-            response_message = await planning_llm.ainvoke(planning_messages_safe)
-        except Exception as e:
-            logger.error(f"LLM invocation failed during planning phase: {e}", exc_info=True)
-            return {**state, "error": f"LLM invocation failed during planning: {e}", "next_step": "error_handler"}
-            
-        planning_messages.append(response_message)
-
-        if response_message.tool_calls:
-            planning_tool_calls_used += len(response_message.tool_calls)
-            tool_messages_to_add = []
-            for tool_call in response_message.tool_calls:
-                tool_name = tool_call.get("name")
-                tool_args = tool_call.get("args", {})
-                tool_id = tool_call.get("id")
-                
-                try:
-                    logger.info(f"Executing planning tool '{tool_name}':")
-                    agent_logger.log(event_type="tool_call", tool=tool_name, args=tool_args, call_id=tool_id)
-                    
-                    tool_to_execute = next((t for t in planning_tools if t.name == tool_name), None)
-                    
-                    if not tool_to_execute:
-                        tool_output = f"Error: LLM called unhandled tool: {tool_name}"
-                        logger.warning(tool_output)
-                    else:
-                        tool_output = await tool_to_execute.ainvoke(tool_args)
-
-                    logger.info(f"  - Execution result: {tool_output}")
-                    agent_logger.log(event_type="tool_result", tool=tool_name, output=str(tool_output), call_id=tool_id)
-                    
-                    final_output_with_round_info = f"Tool '{tool_name}' output:\n{str(tool_output)}"
-                    if planning_tool_calls_used >= MAX_PLANNING_TOOL_CALLS:
-                        final_output_with_round_info += f"\n\n[INFO] You have used {planning_tool_calls_used}/{MAX_PLANNING_TOOL_CALLS} tool calls. You must now generate the final plan based on the information you have gathered."
-
-                    tool_messages_to_add.append(ToolMessage(content=final_output_with_round_info, tool_call_id=tool_id))
-                except Exception as e:
-                    error_msg = f"Error executing planning tool {tool_name}: {e}"
-                    logger.error(error_msg)
-                    agent_logger.log(event_type="planning_tool_error", tool=tool_name, error=str(e))
-                    tool_messages_to_add.append(ToolMessage(content=error_msg, tool_call_id=tool_id))
-            planning_messages.extend(tool_messages_to_add)
-        else:
-            plan_content = response_message.content
-            # 根据模型类型进行特殊处理
-            if swe_model and 'gemini' in swe_model.lower():
-                logger.info(f"Detected Gemini model response in planning phase, applying special processing")
-                # 处理 Gemini 模型的思考型输出，移除 <thought>...</thought> 部分
-                if '<thought>' in plan_content:
-                    # 尝试提取思考后的实际输出
-                    thought_match = re.search(r'<thought>.*?</thought>(.*)', plan_content, re.DOTALL)
-                    if thought_match:
-                        plan_content = thought_match.group(1).strip()
-                    else:
-                        # 如果无法提取，则直接移除整个思考部分
-                        plan_content = re.sub(r'<thought>.*?</thought>', '', plan_content, flags=re.DOTALL).strip()
-            
-            # Relaxed condition: As long as the critical "MCP Tools Plan" section is present, accept the plan.
-            logger.info("Successfully generated development plan (found 'MCP Tools Plan').")
-            plan = plan_content
-            agent_logger.log(event_type="plan_generated", plan=plan)
-            break
-    if not plan:
-        logger.error("Failed to generate a plan within the allowed turns.")
-        return {**state, "error": "Failed to generate a plan within the allowed turns.", "next_step": "error_handler"}
+    shared_plan = state.get("shared_plan")
+    if shared_plan:
+        # Batch generation plans once per (category, service_type, model) group
+        logger.info("--- Skipping SWE Planning Phase: using shared group plan ---")
+        agent_logger.log(event_type="shared_plan_used", plan=shared_plan)
+        plan = shared_plan
+    else:
+        plan, plan_error = await plan_with_cache(
+            base_llm, request_specific_part, mcp_doc, swe_model, agent_logger, state.get("plan_mask_values"),
+            max_turns=state.get("max_planning_turns"), max_tool_calls=state.get("max_planning_tool_calls")
+        )
+        if not plan:
+            return {**state, "error": plan_error, "next_step": "error_handler"}
 
     # Save the generated plan to the project directory
     try:
@@ -299,9 +399,13 @@ User Request:
     agent_llm = base_llm.bind_tools(tools)
     logger.info(f"SWE-Agent has been equipped with tools: {[tool.name for tool in tools]}")
 
-    MAX_CODEGEN_TURNS = get_env_int("MAX_CODEGEN_TURNS", 5)
-    MAX_CODEGEN_TOOL_CALLS = get_env_int("MAX_CODEGEN_TOOL_CALLS", 3)
+    MAX_CODEGEN_TURNS = state.get("max_codegen_turns") or get_env_int("MAX_CODEGEN_TURNS", 5)
+    MAX_CODEGEN_TOOL_CALLS = state.get("max_codegen_tool_calls") or get_env_int("MAX_CODEGEN_TOOL_CALLS", 3)
     codegen_tool_calls_used = 0
+    use_streaming = streaming_enabled()
+    MAX_CODEGEN_STREAM_ABORTS = get_env_int("MAX_CODEGEN_STREAM_ABORTS", 2)
+    stream_aborts = 0
+    context = ContextBudget(agent_logger)
     code_gen_prompt_template = load_prompt("swe_generator/generate_code_from_plan.prompt")
 
     prompt = code_gen_prompt_template.render(
@@ -319,13 +423,30 @@ User Request:
         max_tool_calls=MAX_CODEGEN_TOOL_CALLS
     )
 
-    messages = [HumanMessage(content=prompt)]
+    messages = [build_prompt_message(prompt, base_llm)]
     saved_code = False
     for i in range(MAX_CODEGEN_TURNS):
         logger.info(f"Generation turn {i+1}/{MAX_CODEGEN_TURNS} (Tool calls used: {codegen_tool_calls_used}/{MAX_CODEGEN_TOOL_CALLS})")
 
         try:
-            response_message = await agent_llm.ainvoke(messages)
+            if use_streaming:
+                validator = IncrementalCodeValidator() if stream_aborts < MAX_CODEGEN_STREAM_ABORTS else None
+                response_message, abort_reason, partial_code = await stream_with_validation(
+                    agent_llm, context.fit(messages), save_file_tool.name, agent_logger, validator
+                )
+                if abort_reason:
+                    # Stop paying for a doomed completion: re-prompt with the error right away
+                    stream_aborts += 1
+                    excerpt = "\n".join(partial_code.splitlines()[:20])
+                    messages.append(HumanMessage(content=(
+                        f"Your '{save_file_tool.name}' call was aborted because its 'content' is not valid Python "
+                        f"({abort_reason}). The content must be the raw Python source only, with no markdown fences "
+                        f"or explanations. It started like this:\n{excerpt}\n\n"
+                        f"Call '{save_file_tool.name}' again with the complete, valid code."
+                    )))
+                    continue
+            else:
+                response_message = await agent_llm.ainvoke(context.fit(messages))
             response_message = _normalize_and_extract_tool_calls(response_message)
         except Exception as e:
             logger.error(f"LLM invocation failed during code generation phase: {e}", exc_info=True)
@@ -337,16 +458,21 @@ User Request:
             tool_messages_to_add = []
             final_update = None
 
+            # Research tools run concurrently (and alongside the save/review below);
+            # their results are consumed in call order so ToolMessages stay ordered.
+            other_calls = [tc for tc in response_message.tool_calls if tc.get("name") != save_file_tool.name]
+            other_results_task = asyncio.ensure_future(execute_tool_calls(other_calls, tools, agent_logger))
+            other_index = 0
+
             for tool_call in response_message.tool_calls:
                 tool_name = tool_call.get("name")
                 tool_args = tool_call.get("args", {})
                 tool_id = tool_call.get("id")
                 
                 try:
-                    logger.info(f"Executing tool '{tool_name}':")
-                    agent_logger.log(event_type="tool_call", tool=tool_name, args=tool_args, call_id=tool_id)
-                    
                     if tool_name == save_file_tool.name:
+                        logger.info(f"Executing tool '{tool_name}':")
+                        agent_logger.log(event_type="tool_call", tool=tool_name, args=tool_args, call_id=tool_id)
                         code_to_review = tool_args.get("content", "")
                         if not code_to_review.strip():
                             tool_output = "Error: LLM tried to save an empty file."
@@ -386,7 +512,7 @@ User Request:
                                 review_prompt_template = load_prompt("swe_generator/review_and_correct.prompt")
                                 review_prompt = review_prompt_template.render(code=original_code)
                                 
-                                code_review_llm = get_llm_for_agent(f"SWE-Agent-{api_name}-Reviewer", model_override=swe_model)
+                                code_review_llm = get_llm_for_agent(f"{agent_name}-Reviewer", model_override=swe_model)
                                 if not code_review_llm:
                                     raise ValueError("Could not create LLM for code review.")
 
@@ -426,16 +552,16 @@ User Request:
                             
                             # 更新 tool_args 以便日志和状态更新
                             tool_args['content'] = final_code_to_save
+                        logger.info(f"  - Execution result: {tool_output}")
+                        agent_logger.log(event_type="tool_result", tool=tool_name, output=str(tool_output), call_id=tool_id)
                     else:
-                        # --- Handle other tools normally ---
-                        tool_to_execute = next((t for t in tools if t.name == tool_name), None)
-                        if tool_to_execute:
-                            tool_output = await tool_to_execute.ainvoke(tool_args)
-                        else:
-                            tool_output = f"Error: LLM called unhandled tool: {tool_name}"
-                            logger.warning(tool_output)
-                    logger.info(f"  - Execution result: {tool_output}")
-                    agent_logger.log(event_type="tool_result", tool=tool_name, output=str(tool_output), call_id=tool_id)
+                        # --- Other tools were executed concurrently (and logged) by the tool executor ---
+                        result = (await other_results_task)[other_index]
+                        other_index += 1
+                        if not result.ok:
+                            tool_messages_to_add.append(ToolMessage(content=result.error, tool_call_id=tool_id))
+                            continue
+                        tool_output = result.output
                     
                     # --- After any tool call, prepare message and check for exit ---
                     final_output_with_round_info = str(tool_output)
@@ -507,6 +633,9 @@ User Request:
 async def generate_server_name_from_user_input(user_input: str, swe_model: str) -> str:
     """
     Generates a suitable API name from the user's natural language input using an LLM.
+
+    Names are normally built locally by ``server_naming.generate_server_name``;
+    this is only the fallback behind ENABLE_LLM_SERVER_NAME_FALLBACK.
     
     Args:
         user_input: The user's natural language request.
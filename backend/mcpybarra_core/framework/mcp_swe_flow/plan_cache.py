@@ -0,0 +1,364 @@
+"""
+Planning-phase result cache.
+
+The SWE planning loop costs up to MAX_PLANNING_TURNS LLM calls (plus Tavily
+searches) before any code is written, yet requests that differ only in product
+name, price or stock produce equivalent plans. Plans are cached on disk under
+``workspace/plan-cache/`` (one JSON file per entry, shared by every process
+that runs the workflow) and looked up by:
+
+- an exact key: sha256(normalized request, generate_plan.prompt version,
+  model, MCP doc hash), where product fields are masked out of the request;
+- a similarity fallback, for product prompts only (requests with product
+  fields to mask): among product entries with the same prompt version, model
+  and MCP doc, the closest normalized request above PLAN_CACHE_SIMILARITY.
+  Free-form requests only ever share a plan on an exact match.
+
+Product fields are masked field-aware (see ``_field_patterns``): numbers only
+next to their label, short values only where PromptBuilder delimits them, so
+unrelated text such as ports or status codes is never rewritten.
+
+Entries expire after PLAN_CACHE_TTL_HOURS; beyond PLAN_CACHE_MAX_ENTRIES the
+least recently used (file mtime, touched on every hit) are evicted. Each entry
+remembers the tokens and cost its planning run consumed, so hits report how
+much planning they saved.
+
+Environment:
+    PLAN_CACHE_ENABLED      "true"/"false" (default true)
+    PLAN_CACHE_TTL_HOURS    default 168
+    PLAN_CACHE_MAX_ENTRIES  default 500
+    PLAN_CACHE_SIMILARITY   0..1, default 0.92 (1 disables similarity lookup)
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from logger import logger
+from mcp_swe_flow.config import PROJECT_ROOT, get_env_int
+
+PLAN_PROMPT_PATH = Path(__file__).parent / "prompts" / "swe_generator" / "generate_plan.prompt"
+DEFAULT_CACHE_DIR = PROJECT_ROOT / "workspace" / "plan-cache"
+
+MASK = "<field>"
+
+# Field order of PromptBuilder.product_mask_values
+FIELD_NAMES = ("name", "price", "stock", "description", "origin", "certifications", "farmer")
+# Numeric fields are only rewritten next to one of their labels ("单价：12.8元", "price: 12.8") or units,
+# never as bare numbers, so ports, status codes and versions are left alone
+NUMERIC_FIELD_LABELS = {
+    "price": r"单价|价格|售价|price",
+    "stock": r"库存|stock|inventory|quantity",
+}
+NUMERIC_FIELD_UNITS = {
+    "price": r"元|yuan|rmb|cny",
+}
+# Shorter text values are only rewritten where PromptBuilder delimits them
+# (产品名称：X / 农户"X" / 产品：X（ / 产地位于X。); longer ones wherever they stand as a whole word
+MIN_FREE_TEXT_LENGTH = 3
+_DELIMITED_BEFORE = r'(?:(?<=[：:"“「（(])|(?<=位于))'
+_DELIMITED_AFTER = r'(?=[。，,；;"”」（()）\n]|$)'
+_NUMBER = re.compile(r"[-+]?\d+(?:\.\d+)?")
+# Placeholders use private-use code points, which never occur in the values being replaced
+_PLACEHOLDER_OPEN, _PLACEHOLDER_CLOSE = "\ue000", "\ue001"
+
+
+def _env_bool(key: str, default: bool) -> bool:
+    value = os.getenv(key)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, default))
+    except Exception:
+        return default
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def plan_prompt_version() -> str:
+    """Hash of the planning prompt template; editing it invalidates every entry."""
+    try:
+        return _sha256(PLAN_PROMPT_PATH.read_text(encoding="utf-8"))[:16]
+    except OSError:
+        return "unknown"
+
+
+def _placeholder(index: int) -> str:
+    return f"{_PLACEHOLDER_OPEN}{chr(0xE100 + index)}{_PLACEHOLDER_CLOSE}"
+
+
+def _field_patterns(field: Optional[str], value: str) -> List[re.Pattern]:
+    """Patterns matching ``value`` where it can only be the given product field."""
+    escaped = re.escape(value)
+    if _NUMBER.fullmatch(value):
+        if field not in NUMERIC_FIELD_LABELS:
+            # A pure number outside a numeric field is only masked where the prompt delimits it
+            return [re.compile(_DELIMITED_BEFORE + escaped + _DELIMITED_AFTER)]
+        number = rf"(?<![\d.]){escaped}(?![\d.]*\d)"
+        patterns = [re.compile(rf"((?:{NUMERIC_FIELD_LABELS[field]})[^\S\n]*[：:=]?[^\S\n]*){number}", re.IGNORECASE)]
+        if field in NUMERIC_FIELD_UNITS:
+            patterns.append(re.compile(rf"(){number}(?=[^\S\n]*(?:{NUMERIC_FIELD_UNITS[field]}))", re.IGNORECASE))
+        return patterns
+    if len(value) < MIN_FREE_TEXT_LENGTH:
+        return [re.compile(_DELIMITED_BEFORE + escaped + _DELIMITED_AFTER)]
+    return [re.compile(rf"(?<![A-Za-z0-9_]){escaped}(?![A-Za-z0-9_])")]
+
+
+def _clean_values(values: Optional[Iterable[Any]]) -> List[str]:
+    return [
+        str(v).strip() if v is not None and _PLACEHOLDER_OPEN not in str(v) else ""
+        for v in (values or [])
+    ]
+
+
+def _mask_fields(text: str, values: List[str]) -> Tuple[str, Dict[str, int]]:
+    """
+    Replaces every field value of ``values`` (PromptBuilder field order) by a
+    placeholder, longest value first so that "12.8" is masked before "12".
+
+    Returns:
+        The masked text and the placeholder -> field index mapping.
+    """
+    order = sorted((i for i, v in enumerate(values) if v), key=lambda i: len(values[i]), reverse=True)
+    placeholders = {}
+    for index in order:
+        field = FIELD_NAMES[index] if index < len(FIELD_NAMES) else None
+        placeholder = _placeholder(index)
+        for pattern in _field_patterns(field, values[index]):
+            if pattern.groups:
+                text = pattern.sub(lambda m: m.group(1) + placeholder, text)
+            else:
+                text = pattern.sub(placeholder, text)
+        placeholders[placeholder] = index
+    return text, placeholders
+
+
+def normalize_request(request: str, mask_values: Optional[Iterable[Any]] = None) -> str:
+    """
+    Builds the request fingerprint text used for lookups.
+
+    The product fields in ``mask_values`` (PromptBuilder field order) are
+    replaced by a placeholder where they appear as that field; whitespace is
+    collapsed and the text lower-cased.
+    """
+    text, placeholders = _mask_fields(request or "", _clean_values(mask_values))
+    for placeholder in placeholders:
+        text = text.replace(placeholder, MASK)
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def adapt_plan(plan: str, cached_values: Optional[Iterable[Any]], mask_values: Optional[Iterable[Any]]) -> str:
+    """
+    Rewrites the product fields of the request a plan was made for into the
+    current request's fields (position-wise; both lists come from
+    PromptBuilder.product_mask_values). Lists of different length are left alone.
+    """
+    old = _clean_values(cached_values)
+    new = _clean_values(mask_values)
+    if not plan or len(old) != len(new):
+        return plan
+    changed = [o if o != n else "" for o, n in zip(old, new)]
+    # Two passes through placeholders so a new value is never rewritten again
+    plan, placeholders = _mask_fields(plan, changed)
+    for placeholder, index in placeholders.items():
+        plan = plan.replace(placeholder, new[index])
+    return plan
+
+
+class PlanCache:
+    """Disk-backed plan cache with exact and similarity lookup."""
+
+    def __init__(self, cache_dir: Optional[Path] = None):
+        self.cache_dir = Path(cache_dir or DEFAULT_CACHE_DIR)
+        self.enabled = _env_bool("PLAN_CACHE_ENABLED", True)
+        self.ttl_seconds = get_env_int("PLAN_CACHE_TTL_HOURS", 168) * 3600
+        self.max_entries = get_env_int("PLAN_CACHE_MAX_ENTRIES", 500)
+        self.similarity = _env_float("PLAN_CACHE_SIMILARITY", 0.92)
+        self._lock = threading.Lock()
+
+        # Metrics (this process)
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.tokens_saved = 0
+        self.cost_saved = 0.0
+
+    # ---------- keys ----------
+
+    @staticmethod
+    def scope(model: str, mcp_doc: str) -> str:
+        """Entries are only comparable within the same prompt version, model and MCP doc."""
+        return _sha256(json.dumps([plan_prompt_version(), model or "", _sha256(mcp_doc or "")]))
+
+    @staticmethod
+    def make_key(fingerprint: str, scope: str) -> str:
+        return _sha256(scope + "\n" + fingerprint)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    # ---------- storage ----------
+
+    def _read(self, path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get("created_at", 0) > self.ttl_seconds:
+            path.unlink(missing_ok=True)
+            self.evictions += 1
+            return None
+        return entry
+
+    def _touch(self, path: Path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def lookup(self, fingerprint: str, scope: str, similar: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Returns a cached entry for the fingerprint, or ``None``.
+
+        Reads up to max_entries files; call it from a worker thread in async code.
+        ``similar`` enables the similarity fallback, which only considers entries
+        stored for product prompts (with mask values).
+
+        The returned dict carries ``match`` ("exact" or "similar") and, for
+        similar matches, the ``score`` that accepted it.
+        """
+        if not self.enabled or not self.cache_dir.exists():
+            self.misses += 1
+            return None
+
+        path = self._path(self.make_key(fingerprint, scope))
+        entry = self._read(path) if path.exists() else None
+        if entry is not None:
+            self._touch(path)
+            return self._record_hit(entry, "exact", 1.0)
+
+        if similar and self.similarity < 1.0:
+            best, best_score, best_path = None, 0.0, None
+            for candidate_path in self.cache_dir.glob("*.json"):
+                candidate = self._read(candidate_path)
+                if candidate is None or candidate.get("scope") != scope or not any(candidate.get("mask_values") or []):
+                    continue
+                matcher = SequenceMatcher(None, fingerprint, candidate.get("fingerprint", ""), autojunk=False)
+                # Cheap upper bounds first; only compute the full ratio when it can still win
+                if matcher.real_quick_ratio() < self.similarity or matcher.quick_ratio() < self.similarity:
+                    continue
+                score = matcher.ratio()
+                if score >= self.similarity and score > best_score:
+                    best, best_score, best_path = candidate, score, candidate_path
+            if best is not None:
+                self._touch(best_path)
+                return self._record_hit(best, "similar", best_score)
+
+        self.misses += 1
+        return None
+
+    def _record_hit(self, entry: Dict[str, Any], match: str, score: float) -> Dict[str, Any]:
+        self.hits += 1
+        if match == "similar":
+            self.similar_hits += 1
+        self.tokens_saved += int(entry.get("planning_tokens", 0))
+        self.cost_saved += float(entry.get("planning_cost", 0.0))
+        return {**entry, "match": match, "score": round(score, 4)}
+
+    def store(
+        self,
+        fingerprint: str,
+        scope: str,
+        plan: str,
+        model: str,
+        usage: Optional[Dict[str, float]] = None,
+        mask_values: Optional[Iterable[Any]] = None,
+    ) -> bool:
+        """Writes a plan (atomically) and evicts beyond the size bound."""
+        if not self.enabled or not plan:
+            return False
+        usage = usage or {}
+        key = self.make_key(fingerprint, scope)
+        entry = {
+            "key": key,
+            "scope": scope,
+            "fingerprint": fingerprint,
+            "plan": plan,
+            "model": model,
+            "prompt_version": plan_prompt_version(),
+            "mask_values": [str(v) if v is not None else "" for v in (mask_values or [])],
+            "created_at": time.time(),
+            "planning_calls": int(usage.get("llm_calls", 0)),
+            "planning_tokens": int(usage.get("input_tokens", 0) + usage.get("output_tokens", 0)),
+            "planning_cost": float(usage.get("cost", 0.0)),
+        }
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_dir / f".{key}.{os.getpid()}.tmp"
+            tmp_path.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Failed to store plan in cache: {e}")
+            return False
+        self.stores += 1
+        self.evict()
+        return True
+
+    def evict(self) -> int:
+        """Removes expired entries and the least recently used beyond max_entries."""
+        if not self.cache_dir.exists():
+            return 0
+        with self._lock:
+            removed = 0
+            now = time.time()
+            entries = []
+            for path in self.cache_dir.glob("*.json"):
+                try:
+                    mtime = path.stat().st_mtime
+                except OSError:
+                    continue
+                entries.append((mtime, path))
+            entries.sort(reverse=True)
+            for index, (mtime, path) in enumerate(entries):
+                # mtime >= created_at, so an entry untouched for a full TTL is certainly expired
+                if index >= self.max_entries or now - mtime > self.ttl_seconds:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+            self.evictions += removed
+        if removed:
+            logger.info(f"Evicted {removed} plan cache entries")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "planning_tokens_saved": self.tokens_saved,
+            "planning_cost_saved": round(self.cost_saved, 6),
+        }
+
+
+# Process-wide instance
+plan_cache = PlanCache()
+
+
+__all__ = ["PlanCache", "plan_cache", "normalize_request", "adapt_plan", "plan_prompt_version"]
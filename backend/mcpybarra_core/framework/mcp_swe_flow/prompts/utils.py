@@ -1,6 +1,9 @@
 from pathlib import Path
 import os
 from jinja2 import Template
+from langchain_core.messages import HumanMessage
+
+from mcp_swe_flow.config import supports_cache_control
 
 # This will be framwork/mcp_swe_flow/prompts/utils.py
 # We need to calculate the project root relative to this file's location.
@@ -32,4 +35,41 @@ def load_prompt(prompt_path: str) -> Template:
         raise
     except Exception as e:
         print(f"Error reading prompt file at: {full_path}: {e}")
-        raise IOError(f"Error reading prompt file at: {full_path}: {e}") 
\ No newline at end of file
+        raise IOError(f"Error reading prompt file at: {full_path}: {e}") 
+
+# Templates put everything that is identical across requests (instructions, MCP
+# doc, tool descriptions) before this line and per-request content after it, so
+# the prompt prefix stays byte-stable and provider prefix caching can reuse it.
+CACHE_BREAKPOINT = "<!-- cache-breakpoint -->"
+
+
+def split_cacheable(rendered: str):
+    """
+    Splits a rendered prompt at CACHE_BREAKPOINT.
+
+    Returns:
+        A ``(static_prefix, dynamic_suffix)`` tuple; the prefix is empty when
+        the template has no breakpoint.
+    """
+    if CACHE_BREAKPOINT not in rendered:
+        return "", rendered
+    prefix, suffix = rendered.split(CACHE_BREAKPOINT, 1)
+    return prefix.rstrip() + "\n\n", suffix.lstrip("\n")
+
+
+def build_prompt_message(rendered: str, llm=None) -> HumanMessage:
+    """
+    Builds the HumanMessage for a rendered prompt.
+
+    For models that accept explicit hints (see ``supports_cache_control``) the
+    static prefix becomes its own content part marked ``cache_control``;
+    otherwise the halves are joined and automatic prefix caching applies.
+    """
+    prefix, suffix = split_cacheable(rendered)
+    model_name = getattr(getattr(llm, "bound", llm), "model_name", None)
+    if prefix and supports_cache_control(model_name):
+        return HumanMessage(content=[
+            {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": suffix},
+        ])
+    return HumanMessage(content=prefix + suffix)
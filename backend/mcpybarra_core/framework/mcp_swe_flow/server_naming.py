@@ -0,0 +1,182 @@
+"""
+Local, deterministic server naming.
+
+Every generation used to start with a dedicated LLM call just to turn the
+request into an ``api_name``. The name is now built locally from:
+
+- domain keywords: a Chinese→English glossary (longest match first) plus the
+  English words of the request, ranked by how often they occur;
+- the product name, transliterated to pinyin (``pypinyin``, optional; without
+  it only glossary terms are used);
+- a slug: ``mcp_<product>_<keyword>_<keyword>``, lowercase ASCII, at most
+  MAX_NAME_LENGTH characters, always a valid module name;
+- a collision check against the existing server directories, so two products
+  with the same service type no longer write into the same
+  ``workspace/pipeline-output-servers/<model>/<api_name>`` directory.
+
+The LLM namer (``generate_server_name_from_user_input``) is only used when
+ENABLE_LLM_SERVER_NAME_FALLBACK is on and the request yields no keyword.
+"""
+import os
+import re
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:  # pragma: no cover - optional dependency
+    lazy_pinyin = None
+
+MAX_NAME_LENGTH = 40
+MAX_KEYWORDS = 3
+GENERIC_NAME = "mcp_server"
+
+# Chinese request vocabulary -> name keyword (matched longest first)
+GLOSSARY = {
+    "农产品": "product",
+    "产品": "product",
+    "商品": "product",
+    "查询": "query",
+    "检索": "search",
+    "搜索": "search",
+    "订单": "order",
+    "溯源": "traceability",
+    "追溯": "traceability",
+    "库存": "inventory",
+    "价格": "price",
+    "电商": "ecommerce",
+    "物流": "logistics",
+    "配送": "delivery",
+    "支付": "payment",
+    "客户": "customer",
+    "用户": "user",
+    "会员": "member",
+    "评价": "review",
+    "推荐": "recommendation",
+    "营销": "marketing",
+    "优惠券": "coupon",
+    "统计": "statistics",
+    "分析": "analytics",
+    "天气": "weather",
+    "二维码": "qrcode",
+    "预约": "booking",
+    "提取": "extractor",
+    "转换": "converter",
+    "文本": "text",
+    "图片": "image",
+    "文档": "document",
+}
+
+# English words that carry no meaning in a server name
+STOPWORDS = {
+    "a", "an", "the", "i", "we", "need", "want", "that", "which", "can", "could", "to", "for",
+    "of", "in", "on", "and", "or", "with", "like", "between", "from", "by", "is", "be", "it",
+    "mcp", "server", "service", "api", "create", "build", "make", "develop", "please", "tool",
+    "based", "using", "use", "some", "my", "our", "new", "json", "fastapi", "pydantic", "restful",
+    "get", "post", "put", "patch", "delete", "id", "xxx", "health", "files",
+}
+
+_GLOSSARY_PATTERN = re.compile("|".join(sorted(map(re.escape, GLOSSARY), key=len, reverse=True)))
+_PRODUCT_PATTERNS = (
+    re.compile(r"产品名称[：:]\s*([^\s（(，,。]+)"),
+    re.compile(r"产品[：:]\s*([^\s（(，,。]+)"),
+    re.compile(r"产品[\"“]([^\"”]+)[\"”]"),
+)
+
+
+def _slug(text: str) -> str:
+    text = re.sub(r"[\s\-]+", "_", text.lower())
+    return re.sub(r"_+", "_", re.sub(r"[^a-z0-9_]", "", text)).strip("_")
+
+
+def transliterate(text: str) -> str:
+    """Pinyin slug of a (Chinese) name; ASCII parts are kept, other characters dropped without pypinyin."""
+    if lazy_pinyin is not None:
+        text = "".join(lazy_pinyin(text))
+    return _slug(text)
+
+
+def extract_product_name(user_input: str) -> Optional[str]:
+    """Product name as written by PromptBuilder's product prompts, if any."""
+    for pattern in _PRODUCT_PATTERNS:
+        match = pattern.search(user_input or "")
+        if match:
+            return match.group(1).strip()
+    return None
+
+
+def extract_keywords(user_input: str, limit: int = MAX_KEYWORDS) -> List[str]:
+    """Most frequent glossary terms and English content words, ties broken by first occurrence."""
+    text = user_input or ""
+    found = [(m.start(), GLOSSARY[m.group(0)]) for m in _GLOSSARY_PATTERN.finditer(text)]
+    found += [
+        (m.start(), m.group(0).lower())
+        # Route segments and query parameters (/orders, ?status=) describe the API, not its purpose
+        for m in re.finditer(r"(?<![/?&={A-Za-z0-9_])[A-Za-z][A-Za-z0-9]+", text)
+        if m.group(0).lower() not in STOPWORDS
+    ]
+    found.sort()
+    counts = Counter(word for _, word in found)
+    first_seen = {}
+    for position, word in found:
+        first_seen.setdefault(word, position)
+    ranked = sorted(counts, key=lambda word: (-counts[word], first_seen[word]))
+    return ranked[:limit]
+
+
+def generate_server_name(user_input: str, product_name: Optional[str] = None) -> str:
+    """
+    Builds ``mcp_<product>_<keywords>`` from the request.
+
+    Returns:
+        The name, or ``GENERIC_NAME`` when nothing meaningful was found.
+    """
+    product_name = product_name or extract_product_name(user_input)
+    parts = ["mcp"]
+    product_slug = transliterate(product_name) if product_name else ""
+    if product_slug:
+        parts.append(product_slug)
+    parts += [k for k in extract_keywords(user_input) if k not in parts]
+
+    name = ""
+    for part in parts:
+        candidate = f"{name}_{part}" if name else part
+        if len(candidate) > MAX_NAME_LENGTH:
+            break
+        name = candidate
+    return name if name != "mcp" else GENERIC_NAME
+
+
+def unique_server_name(name: str, parent_dir: Path) -> str:
+    """
+    Returns ``name`` or ``name_2``, ``name_3``... whichever does not exist yet
+    under ``parent_dir``, and reserves it by creating the directory (so two
+    concurrent runs can never pick the same one).
+    """
+    parent_dir = Path(parent_dir)
+    parent_dir.mkdir(parents=True, exist_ok=True)
+    candidate, index = name, 1
+    while True:
+        try:
+            (parent_dir / candidate).mkdir()
+            return candidate
+        except FileExistsError:
+            index += 1
+            suffix = f"_{index}"
+            candidate = f"{name[:MAX_NAME_LENGTH - len(suffix)]}{suffix}"
+
+
+def llm_fallback_enabled() -> bool:
+    return os.getenv("ENABLE_LLM_SERVER_NAME_FALLBACK", "false").strip().lower() in ("1", "true", "yes", "on")
+
+
+__all__ = [
+    "GENERIC_NAME",
+    "generate_server_name",
+    "unique_server_name",
+    "extract_keywords",
+    "extract_product_name",
+    "transliterate",
+    "llm_fallback_enabled",
+]
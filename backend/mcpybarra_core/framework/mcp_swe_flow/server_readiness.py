@@ -0,0 +1,129 @@
+"""
+Readiness probe for MCP servers spawned over stdio.
+
+The server is started once and its stderr goes to a pipe drained by a
+background thread (``StderrCapture``), so the server never blocks on a full
+pipe. EOF on that pipe means the process exited. ``await_handshake`` races the
+MCP initialize handshake against that exit signal:
+
+- the handshake completes: the server is ready;
+- the process exits first: fail at once instead of waiting for the timeout;
+- neither happens within the timeout: the server is considered hung.
+
+Failures raise ``RuntimeError`` carrying the tail of the server's stderr, so
+the code refiner sees why the server did not start.
+
+Environment:
+    MCP_SERVER_READY_TIMEOUT_SECONDS  handshake timeout (default 30)
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Awaitable, Optional
+
+from logger import logger
+from mcp_swe_flow.config import get_env_int
+
+
+class StderrCapture:
+    """
+    stderr pipe of an MCP server subprocess.
+
+    A background thread keeps reading the pipe (keeping only the tail, so the
+    child never blocks on a full pipe); EOF means the child exited.
+    """
+
+    def __init__(self, keep_chars: int = 8000):
+        self.keep_chars = keep_chars
+        self._read_fd, write_fd = os.pipe()
+        self.errlog = os.fdopen(write_fd, "w")
+        self.exited = asyncio.Event()
+        self._buffer = b""
+
+    def start(self) -> None:
+        """The child has been spawned: close our write end and start reading."""
+        self.errlog.close()
+        loop = asyncio.get_running_loop()
+        threading.Thread(target=self._drain, args=(loop,), name="mcp-server-stderr", daemon=True).start()
+
+    def close(self) -> None:
+        """Releases the pipe when the child could not be spawned."""
+        self.errlog.close()
+        os.close(self._read_fd)
+
+    def _drain(self, loop: asyncio.AbstractEventLoop) -> None:
+        try:
+            while True:
+                data = os.read(self._read_fd, 65536)
+                if not data:
+                    break
+                self._buffer = (self._buffer + data)[-self.keep_chars:]
+        finally:
+            os.close(self._read_fd)
+            try:
+                loop.call_soon_threadsafe(self.exited.set)
+            except RuntimeError:
+                pass  # event loop already closed
+
+    def tail(self, max_chars: int) -> str:
+        return self._buffer.decode("utf-8", errors="ignore")[-max_chars:]
+
+
+async def await_handshake(
+    handshake: Awaitable[Any],
+    stderr: StderrCapture,
+    max_output_length: int = 1200,
+    timeout: Optional[float] = None,
+) -> Any:
+    """
+    Waits for the MCP initialize handshake, failing fast if the server exits.
+
+    Args:
+        handshake: The ``session.initialize()`` awaitable.
+        stderr: The started stderr capture of the server process.
+        max_output_length: Characters of stderr included in the error.
+        timeout: Seconds to wait; defaults to MCP_SERVER_READY_TIMEOUT_SECONDS.
+
+    Returns:
+        The handshake result.
+
+    Raises:
+        RuntimeError: The server exited, the handshake failed or timed out.
+    """
+    timeout = get_env_int("MCP_SERVER_READY_TIMEOUT_SECONDS", 30) if timeout is None else timeout
+    started = time.monotonic()
+    handshake = asyncio.ensure_future(handshake)
+    exited = asyncio.ensure_future(stderr.exited.wait())
+    try:
+        await asyncio.wait({handshake, exited}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    except BaseException:
+        handshake.cancel()
+        raise
+    finally:
+        exited.cancel()
+
+    if handshake.done() and handshake.exception() is None:
+        logger.info(f"✅ MCP会话初始化成功 ({time.monotonic() - started:.2f}s)")
+        return handshake.result()
+
+    if handshake.done():
+        reason = f"MCP server 握手失败: {handshake.exception()}"
+        # The handshake usually fails because the process exited; let the stderr reader finish
+        try:
+            await asyncio.wait_for(stderr.exited.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+    else:
+        handshake.cancel()
+        reason = "MCP server 进程启动后立刻退出" if stderr.exited.is_set() else f"MCP server 在 {timeout} 秒内未完成握手"
+    logger.error("❌ {}", reason)
+    err = stderr.tail(max_output_length)
+    message = f"{reason}：请根据 stderr 修复生成代码/依赖/环境变量后重试"
+    if err.strip():
+        logger.error("---- server stderr ----\n{}", err)
+        message += f"\n---- server stderr ----\n{err}"
+    raise RuntimeError(message)
+
+
+__all__ = ["StderrCapture", "await_handshake"]
@@ -0,0 +1,114 @@
+"""
+Per-service cache of server-test plans.
+
+Every pass through ``server_test_node`` used to ask the ServerTest-Agent for a
+new test plan, although a refinement loop usually only changes function
+bodies. A plan depends on the tool surface the server exposes, so it is now
+cached per service, in the service's output directory
+(``<server dir>/.test_plan_cache.json``), keyed by:
+
+- the tool surface hash: sha256 of the tool names and their input schemas as
+  listed by ``mcp_adapter.tools``, so descriptions and implementations may
+  change freely;
+- the version of ``generate_test_plan.prompt``: editing it invalidates the entry.
+
+On a hit the cached plan is executed as-is and the planning LLM call is
+skipped. The plan is regenerated (and the entry replaced) as soon as a tool is
+added, removed, renamed or changes its parameters. Each entry remembers the
+tokens and cost of the call that produced it, so hits report what they saved.
+
+Environment:
+    TEST_PLAN_CACHE_ENABLED  "true"/"false" (default true)
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from logger import logger
+
+TEST_PLAN_PROMPT_PATH = Path(__file__).parent / "prompts" / "server_tester" / "generate_test_plan.prompt"
+CACHE_FILE_NAME = ".test_plan_cache.json"
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def cache_enabled() -> bool:
+    return os.getenv("TEST_PLAN_CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+
+
+def prompt_version() -> str:
+    """Hash of the test-planning prompt template."""
+    try:
+        return _sha256(TEST_PLAN_PROMPT_PATH.read_text(encoding="utf-8"))[:16]
+    except OSError:
+        return "unknown"
+
+
+def tool_surface_hash(tools: Iterable[Any]) -> str:
+    """Hash of the tool names and input schemas (order-independent)."""
+    surface = sorted(
+        [tool.name, getattr(tool, "args_schema", None) or {}]
+        for tool in tools
+    )
+    return _sha256(json.dumps(surface, sort_keys=True, ensure_ascii=False, default=str))
+
+
+def load_test_plan(service_dir: Path, surface_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns the cached entry (``test_plan``, ``planning_tokens``, ``planning_cost``...)
+    when it was made for the same tool surface and prompt version, otherwise ``None``.
+    """
+    if not cache_enabled():
+        return None
+    try:
+        entry = json.loads((Path(service_dir) / CACHE_FILE_NAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if entry.get("tool_surface") != surface_hash or entry.get("prompt_version") != prompt_version():
+        return None
+    if not isinstance(entry.get("test_plan"), list) or not entry["test_plan"]:
+        return None
+    return entry
+
+
+def store_test_plan(
+    service_dir: Path,
+    surface_hash: str,
+    test_plan: List[Dict[str, Any]],
+    usage: Optional[Dict[str, float]] = None,
+) -> bool:
+    """Writes the plan for this tool surface (atomically), replacing any previous entry."""
+    if not cache_enabled() or not test_plan:
+        return False
+    usage = usage or {}
+    entry = {
+        "tool_surface": surface_hash,
+        "prompt_version": prompt_version(),
+        "test_plan": test_plan,
+        "created_at": time.time(),
+        "planning_tokens": int(usage.get("input_tokens", 0) + usage.get("output_tokens", 0)),
+        "planning_cost": float(usage.get("cost", 0.0)),
+    }
+    path = Path(service_dir) / CACHE_FILE_NAME
+    try:
+        tmp_path = path.with_name(f"{CACHE_FILE_NAME}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(entry, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Failed to store test plan in cache: {e}")
+        return False
+    return True
+
+
+__all__ = [
+    "load_test_plan",
+    "store_test_plan",
+    "cache_enabled",
+    "prompt_version",
+    "tool_surface_hash",
+]
@@ -0,0 +1,303 @@
+"""
+Execution of server-test plans.
+
+A test plan is the list of tool calls the ServerTest-Agent asks for (see
+``server_test_node``). Steps can reference earlier outputs through
+``$outputs.<step_id>...`` placeholders. ``execute_test_plan`` runs the plan
+against the server's MCP session without any LLM call.
+
+This module only needs an object with a ``tools`` list of tools exposing
+``name`` and ``ainvoke``, so it does not import the MCP client or the agent
+tools.
+
+Environment:
+    TEST_PLAN_MAX_CONCURRENCY  steps run at the same time (default 4, 1 = sequential)
+"""
+import asyncio
+import json
+import re
+import time
+from typing import TYPE_CHECKING, Any, Dict, List
+
+from logger import logger
+from mcp_swe_flow.config import get_env_int
+
+if TYPE_CHECKING:
+    from mcp_swe_flow.adapters import MCPClientAdapter
+
+
+def substitute_parameters(params: Dict[str, Any], outputs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Recursively substitutes placeholders in a parameter dictionary.
+    This version uses a robust greedy traversal logic to handle keys containing dots.
+    Placeholder format: "$outputs.step_id.json_path" or "$outputs.step_id[index].json_path"
+    """
+    substituted_params = {}
+    for key, value in params.items():
+        if isinstance(value, str) and value.startswith("$outputs."):
+            try:
+                placeholder = value.replace("$outputs.", "")
+                
+                # Extract step_id using regex, stopping at the first '[' or '.'
+                match = re.match(r'^([a-zA-Z0-9_]+)', placeholder)
+                if not match:
+                    raise ValueError(f"Invalid placeholder format: could not extract step_id from '{placeholder}'")
+                
+                step_id = match.group(1)
+                path_to_process = placeholder[len(step_id):]
+                
+                if step_id not in outputs:
+                    raise KeyError(f"Step ID '{step_id}' not found in outputs")
+
+                current_value = outputs[step_id]['result']
+                
+                # --- Robust JSON parsing ---
+                if isinstance(current_value, str):
+                    json_match = re.search(r'```json\s*([\s\S]*?)\s*```', current_value, re.DOTALL)
+                    str_to_parse = json_match.group(1).strip() if json_match else current_value
+                    try:
+                        current_value = json.loads(str_to_parse)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Could not parse output from step '{step_id}' as JSON. Proceeding with raw string.")
+                
+                # --- Greedy Traversal Logic ---
+                while path_to_process:
+                    # Check for index access first
+                    match_index = re.match(r'\[(\d+)\]', path_to_process)
+                    if match_index:
+                        index = int(match_index.group(1))
+                        if not isinstance(current_value, list):
+                            raise TypeError(f"Cannot apply index [{index}] to non-list value (type: {type(current_value).__name__}).")
+                        current_value = current_value[index]
+                        path_to_process = path_to_process[match_index.end():]
+                        continue
+
+                    # If not an index, it must be a dot-prefixed key
+                    if not path_to_process.startswith('.'):
+                        raise ValueError(f"Invalid path segment in placeholder: '{path_to_process}'")
+                    
+                    path_to_process = path_to_process[1:] # Consume the dot
+                    
+                    # Find the end of the current key segment (before next '[' or end of string)
+                    key_segment_match = re.match(r'[^\[\]]+', path_to_process)
+                    key_segment = key_segment_match.group(0)
+                    
+                    # Process this segment using greedy key matching
+                    sub_keys_to_process = key_segment.split('.')
+                    while sub_keys_to_process:
+                        matched = False
+                        # Try to match the longest possible key from the remaining parts
+                        for i in range(len(sub_keys_to_process), 0, -1):
+                            potential_key = ".".join(sub_keys_to_process[0:i])
+                            if isinstance(current_value, dict) and potential_key in current_value:
+                                current_value = current_value[potential_key]
+                                # Consume the matched parts
+                                sub_keys_to_process = sub_keys_to_process[i:]
+                                matched = True
+                                break # Restart the while loop with remaining sub_keys
+                        
+                        if not matched:
+                            unresolved_key = ".".join(sub_keys_to_process)
+                            raise KeyError(f"Could not resolve key '{unresolved_key}' in placeholder '{value}'")
+                    
+                    # Consume the processed segment from the main path
+                    path_to_process = path_to_process[len(key_segment):]
+
+                substituted_params[key] = current_value
+
+            except (KeyError, TypeError, IndexError, ValueError) as e:
+                logger.error(f"❌ Failed to resolve placeholder '{value}': {e}")
+                substituted_params[key] = None # Mark as failed
+        elif isinstance(value, dict):
+            substituted_params[key] = substitute_parameters(value, outputs)
+        elif isinstance(value, list):
+            substituted_params[key] = [
+                substitute_parameters(item, outputs) if isinstance(item, dict) else item
+                for item in value
+            ]
+        else:
+            substituted_params[key] = value
+    return substituted_params
+
+def step_dependencies(step: Dict[str, Any]) -> List[str]:
+    """Step ids referenced by a step's ``$outputs.<step_id>`` placeholders."""
+    params_str = json.dumps(step.get("parameters", {}))
+    return re.findall(r'"\$outputs\.([^.\["]+)', params_str)
+
+
+def _resource_values(params: Any) -> set:
+    """Literal string arguments of a step (file paths, ids, names...), used to detect shared resources."""
+    values = set()
+    if isinstance(params, dict):
+        for value in params.values():
+            values |= _resource_values(value)
+    elif isinstance(params, list):
+        for item in params:
+            values |= _resource_values(item)
+    elif isinstance(params, str) and len(params) >= 3 and not params.startswith("$outputs."):
+        values.add(params)
+    return values
+
+
+def build_step_graph(test_plan: List[Dict[str, Any]]) -> List[set]:
+    """
+    Turns the test plan into a DAG: for each step, the indices of the earlier
+    steps it must wait for.
+
+    A step waits for the steps whose outputs it references and, because steps
+    can also depend on each other through side effects (create a file, then
+    read it), for every earlier step sharing a literal argument with it.
+    """
+    index_by_id = {}
+    resources = [_resource_values(step.get("parameters", {})) for step in test_plan]
+    graph = []
+    for i, step in enumerate(test_plan):
+        deps = {index_by_id[dep_id] for dep_id in step_dependencies(step) if dep_id in index_by_id}
+        deps |= {j for j in range(i) if resources[i] & resources[j]}
+        graph.append(deps)
+        index_by_id.setdefault(step.get("step_id"), i)
+    return graph
+
+
+def validate_test_plan(test_plan: List[Dict[str, Any]]):
+    """Validates the structure and logic of the test plan."""
+    defined_step_ids = set()
+    for i, step in enumerate(test_plan):
+        if not all(k in step for k in ["step_id", "tool_name", "parameters", "description"]):
+            raise ValueError(f"Test plan step {i+1} is missing required fields ('step_id', 'tool_name', 'parameters', 'description').")
+        
+        step_id = step["step_id"]
+        if step_id in defined_step_ids:
+            raise ValueError(f"Found duplicate step_id in test plan: '{step_id}'")
+        
+        for dep_id in step_dependencies(step):
+            if dep_id not in defined_step_ids:
+                raise ValueError(f"Step '{step_id}' depends on an undefined step '{dep_id}'.")
+        
+        defined_step_ids.add(step_id)
+    logger.info("✅ Test plan validation passed.")
+
+
+async def _execute_step(
+    mcp_adapter: "MCPClientAdapter",
+    step: Dict[str, Any],
+    position: str,
+    step_outputs: Dict[str, Any],
+    agent_logger
+) -> Dict[str, Any]:
+    """Executes one test step (its dependencies have completed) and returns its execution-log entry."""
+    step_id = step.get("step_id")
+    tool_name = step.get("tool_name")
+    params = step.get("parameters", {})
+    description = step.get("description", "No description")
+
+    logger.info(f"🔄 (Step {position}) Preparing to execute: {step_id} - {tool_name}")
+    agent_logger.log(event_type="test_step_start", step_id=step_id, tool_name=tool_name, description=description)
+
+    substituted_params = substitute_parameters(params, step_outputs)
+    
+    try:
+        # Propagate failure: if any substituted parameter is None due to a previous step's failure, this step should also fail.
+        if any(v is None for v in substituted_params.values()):
+            # Find the first placeholder that resolved to None
+            failed_placeholder = next((p_val for p_key, p_val in params.items() if substituted_params.get(p_key) is None), "unknown")
+            raise ValueError(f"A required parameter resolved to None, likely due to a failure in a dependency. Failed placeholder: '{failed_placeholder}'")
+
+        tool_to_invoke = next((t for t in mcp_adapter.tools if t.name == tool_name), None)
+        if not tool_to_invoke:
+            raise ValueError(f"Tool '{tool_name}' not found in adapter")
+
+        # Enhanced robustness: add a 60-second timeout for the tool call
+        result = await asyncio.wait_for(
+            tool_to_invoke.ainvoke(substituted_params),
+            timeout=60.0
+        )
+
+        # 检查结果是否包含错误信息，但排除适配器截断标记
+        is_error_in_result = isinstance(result, str) and (
+            ("error" in result.lower() 
+            or "failed" in result.lower() 
+            or "invalid" in result.lower()
+            or "exception" in result.lower())
+            # 排除适配器截断标记导致的误判
+            and not ("adapter_truncation_note" in result.lower() or "__adapter_truncation_note__" in result.lower())
+        )
+
+        if is_error_in_result:
+            logger.warning(f"    - ⚠️  Tool '{tool_name}' returned a potential error message: {result}")
+            step_result = {"status": "error", "result": result}
+            agent_logger.log(event_type="test_step_error", step_id=step_id, error=f"Tool returned an error message: {result}")
+        else:
+            # 检查是否存在适配器截断标记
+            has_adapter_truncation = isinstance(result, str) and ("adapter_truncation_note" in result.lower() or "__adapter_truncation_note__" in result.lower())
+            if has_adapter_truncation:
+                logger.info(f"    - ℹ️ Execution successful with adapter truncation (not a tool error): {result[:200]}...")
+            else:
+                logger.info(f"    - ✅ Execution successful: {result}")
+                
+            step_result = {"status": "success", "result": result}
+            agent_logger.log(event_type="test_step_success", step_id=step_id, result=result)
+    
+    except asyncio.TimeoutError:
+        error_msg = f"Tool '{tool_name}' execution timed out (exceeded 60 seconds)."
+        logger.error(f"    - ❌ {error_msg}")
+        step_result = {"status": "error", "result": error_msg}
+        agent_logger.log(event_type="test_step_timeout", step_id=step_id, error=error_msg)
+
+    except Exception as e:
+        error_msg = f"Tool '{tool_name}' call failed: {e}"
+        logger.error(f"    - ❌ {error_msg}")
+        step_result = {"status": "error", "result": str(e)}
+        agent_logger.log(event_type="test_step_error", step_id=step_id, error=str(e))
+    
+    step_outputs[step_id] = step_result
+    return {
+        "step": step,
+        "substituted_params": substituted_params,
+        "result": step_result
+    }
+
+
+async def execute_test_plan(mcp_adapter: "MCPClientAdapter", test_plan: List[Dict[str, Any]], agent_logger) -> List[Dict[str, Any]]:
+    """
+    Executes the test plan, handling dependencies and logging results.
+    This function does not interact with an LLM.
+
+    The plan is run as a DAG (see ``build_step_graph``): a step starts as soon
+    as the steps it depends on have finished, and independent steps run
+    concurrently over the MCP session, at most TEST_PLAN_MAX_CONCURRENCY at a
+    time (1 restores strictly sequential execution). The returned execution
+    log is always in plan order.
+    """
+    logger.info("🚀 Starting test plan execution...")
+    started = time.monotonic()
+    graph = build_step_graph(test_plan)
+    semaphore = asyncio.Semaphore(max(1, get_env_int("TEST_PLAN_MAX_CONCURRENCY", 4)))
+    finished = [asyncio.Event() for _ in test_plan]
+    execution_log: List[Dict[str, Any]] = [None] * len(test_plan)
+    step_outputs = {}
+
+    async def run_step(i: int, step: Dict[str, Any]):
+        try:
+            for dep in sorted(graph[i]):
+                await finished[dep].wait()
+            async with semaphore:
+                execution_log[i] = await _execute_step(
+                    mcp_adapter, step, f"{i+1}/{len(test_plan)}", step_outputs, agent_logger
+                )
+        finally:
+            finished[i].set()
+
+    await asyncio.gather(*(run_step(i, step) for i, step in enumerate(test_plan)))
+
+    logger.info(f"✅ Test plan execution completed in {time.monotonic() - started:.2f}s ({len(test_plan)} steps).")
+    return execution_log
+
+
+__all__ = [
+    "build_step_graph",
+    "execute_test_plan",
+    "step_dependencies",
+    "substitute_parameters",
+    "validate_test_plan",
+]
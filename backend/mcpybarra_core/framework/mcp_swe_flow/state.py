@@ -15,6 +15,11 @@ class MCPWorkflowState(TypedDict, total=False):
     test_report_dir: str
     user_input: str
     model_name: str # The name of the LLM model to use for the run
+    swe_model: Optional[str] # Model of the SWE agent; falls back to SWE_AGENT_MODEL when unset
+    shared_plan: Optional[str] # Pre-computed plan shared by a batch group; skips the planning phase
+    plan_mask_values: Optional[List[str]] # Product fields masked out of the plan cache fingerprint (fixed order)
+    race_models: Optional[List[str]] # Models to race in code generation; the first candidate passing the gates wins
+    race_candidate: Optional[str] # Set while generating as a race candidate; gives the candidate its own agent logs
     
     # Loaded content
     api_spec: Dict[str, Any]
@@ -23,6 +28,14 @@ class MCPWorkflowState(TypedDict, total=False):
     api_doc: Optional[str]
     project_dir: str # Base directory for all outputs of a single run
     refinement_loop_count: int
+    max_refine_loops: int # Per-run limits; each falls back to the env var of the same name when unset
+    max_planning_turns: int
+    max_codegen_turns: int
+    max_planning_tool_calls: int
+    max_codegen_tool_calls: int
+    planning_turns: int
+    codegen_turns: int
+    refine_loops: int
     
     # Generated content
     server_code: str
@@ -30,9 +43,12 @@ class MCPWorkflowState(TypedDict, total=False):
     test_report: Union[str, Dict[str, Any]]
     test_report_path: str
     test_report_content: Union[str, Dict[str, Any]]
+    static_gate_issues: List[str] # Issues found by the static pre-test gate; non-empty means the server was not started
+    deliverability_assessment: Optional[str] # Refiner decision for the last tested code: "DELIVERABLE" or "NEEDS_REFINEMENT"
     refined_code: str
     refined_code_path: str
     refined_report: Dict[str, Any]
+    race_report: Dict[str, Any] # Per-candidate latency, cost and outcome of a model race
     log_files: List[str] # List of paths to agent log files for the current run
     
     # Flow control
@@ -0,0 +1,266 @@
+"""
+Static pre-test gate for generated servers.
+
+``server_test_node`` used to start every generated server and ask the
+ServerTest-Agent for a test plan, even when the file could not even be
+imported. The gate runs first, locally and in milliseconds:
+
+1. syntax: ``ast.parse`` and ``compile`` of the whole file;
+2. imports: every absolute import must resolve, either to a module next to the
+   server / in the project root, or in the installed environment (the server
+   is spawned with the same interpreter). Imports guarded by
+   ``try: ... except ImportError`` and ``if TYPE_CHECKING:`` are optional and
+   skipped. Only top-level package names are looked up, so nothing is imported;
+3. FastMCP tools: the ``@<server>.tool`` functions are extracted with their
+   signatures. At least one tool must be registered, tool names must be unique
+   and FastMCP must be able to build a schema for them (no ``*args`` /
+   ``**kwargs``, no parameter starting with ``_``);
+4. entry point: the server must call ``<server>.run(...)``, otherwise the
+   spawned process exits at once.
+
+When the gate fails, its report replaces the test report and the workflow
+goes straight to ``refine_code_node``. No process is spawned and no LLM call is
+made for test planning.
+
+Environment:
+    ENABLE_STATIC_TEST_GATE  "true"/"false" (default true)
+"""
+import ast
+import importlib.util
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from mcp_swe_flow.config import PROJECT_ROOT
+
+
+@dataclass
+class StaticGateResult:
+    """Outcome of the static gate for one server file."""
+    server_file: str
+    issues: List[str] = field(default_factory=list)
+    tools: List[Dict[str, Any]] = field(default_factory=list)
+    elapsed_ms: float = 0.0
+
+    @property
+    def passed(self) -> bool:
+        return not self.issues
+
+    def to_report(self, api_name: Optional[str] = None) -> str:
+        """Markdown report handed to the code refiner in place of a test report."""
+        lines = [
+            f"# Static Pre-Test Gate Report: {api_name or Path(self.server_file).stem}",
+            "",
+            "The server was NOT started and no tool was executed: the generated file fails the "
+            "static checks below. Fix every issue; the full server test runs once they pass.",
+            "",
+            "## Issues",
+            *[f"- {issue}" for issue in self.issues],
+        ]
+        if self.tools:
+            lines += ["", "## Registered tools", *[f"- `{tool['signature']}`" for tool in self.tools]]
+        return "\n".join(lines) + "\n"
+
+
+def static_gate_enabled() -> bool:
+    return os.getenv("ENABLE_STATIC_TEST_GATE", "true").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _is_import_error_guard(node: ast.Try) -> bool:
+    for handler in node.handlers:
+        names = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+        for name in names:
+            if name is None or (isinstance(name, ast.Name) and name.id in ("ImportError", "ModuleNotFoundError", "Exception")):
+                return True
+    return False
+
+
+def _is_type_checking_guard(node: ast.If) -> bool:
+    test = node.test
+    return (isinstance(test, ast.Name) and test.id == "TYPE_CHECKING") or (
+        isinstance(test, ast.Attribute) and test.attr == "TYPE_CHECKING"
+    )
+
+
+def _required_imports(tree: ast.AST) -> Iterable[ast.AST]:
+    """Absolute import statements that are not optional (guarded)."""
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ast.Try) and _is_import_error_guard(node):
+            stack.extend(node.handlers + node.orelse + node.finalbody)
+            continue
+        if isinstance(node, ast.If) and _is_type_checking_guard(node):
+            stack.extend(node.orelse)
+            continue
+        if isinstance(node, ast.Import) or (isinstance(node, ast.ImportFrom) and not node.level):
+            yield node
+        stack.extend(ast.iter_child_nodes(node))
+
+
+def _module_resolves(name: str, search_dirs: List[Path]) -> bool:
+    if name in sys.builtin_module_names or name in sys.stdlib_module_names:
+        return True
+    for directory in search_dirs:
+        if (directory / f"{name}.py").exists() or (directory / name).is_dir():
+            return True
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def unresolved_imports(tree: ast.AST, search_dirs: List[Path]) -> List[str]:
+    """Required imports whose top-level package cannot be found; one issue per missing package."""
+    issues, seen = [], set()
+    for node in sorted(_required_imports(tree), key=lambda n: n.lineno):
+        modules = [alias.name for alias in node.names] if isinstance(node, ast.Import) else [node.module]
+        for module in modules:
+            top = module.split(".")[0]
+            if top in seen or _module_resolves(top, search_dirs):
+                continue
+            seen.add(top)
+            issues.append(
+                f"line {node.lineno}: import of `{module}` cannot be resolved: package `{top}` "
+                f"is not installed (remove the dependency or use an installed package)"
+            )
+    return issues
+
+
+def _server_instances(tree: ast.AST) -> set:
+    """Names bound to ``FastMCP(...)`` at any level."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Call):
+            func = node.value.func
+            func_name = func.id if isinstance(func, ast.Name) else getattr(func, "attr", None)
+            if func_name == "FastMCP":
+                names |= {target.id for target in node.targets if isinstance(target, ast.Name)}
+    return names
+
+
+def _tool_decorator(decorator: ast.AST, servers: set) -> Optional[ast.AST]:
+    target = decorator.func if isinstance(decorator, ast.Call) else decorator
+    if not (isinstance(target, ast.Attribute) and target.attr == "tool"):
+        return None
+    if servers and not (isinstance(target.value, ast.Name) and target.value.id in servers):
+        return None
+    return decorator
+
+
+def _tool_name(function: ast.AST, decorator: ast.AST) -> str:
+    if isinstance(decorator, ast.Call):
+        for keyword in decorator.keywords:
+            if keyword.arg == "name" and isinstance(keyword.value, ast.Constant):
+                return str(keyword.value.value)
+        if decorator.args and isinstance(decorator.args[0], ast.Constant) and isinstance(decorator.args[0].value, str):
+            return decorator.args[0].value
+    return function.name
+
+
+def extract_tools(tree: ast.AST) -> List[Dict[str, Any]]:
+    """Signatures of the FastMCP tool functions (any ``@<x>.tool`` if no FastMCP instance is found)."""
+    servers = _server_instances(tree)
+    tools = []
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        decorator = next((d for d in node.decorator_list if _tool_decorator(d, servers) is not None), None)
+        if decorator is None:
+            continue
+        args = node.args
+        positional = args.posonlyargs + args.args
+        defaults = [None] * (len(positional) - len(args.defaults)) + list(args.defaults)
+        params = [
+            {
+                "name": arg.arg,
+                "annotation": ast.unparse(arg.annotation) if arg.annotation else None,
+                "required": default is None,
+            }
+            for arg, default in list(zip(positional, defaults)) + list(zip(args.kwonlyargs, args.kw_defaults))
+        ]
+        rendered = ", ".join(
+            f"{p['name']}{': ' + p['annotation'] if p['annotation'] else ''}{'' if p['required'] else ' = ...'}"
+            for p in params
+        )
+        tools.append({
+            "name": _tool_name(node, decorator),
+            "function": node.name,
+            "lineno": node.lineno,
+            "params": params,
+            "varargs": [a.arg for a in (args.vararg, args.kwarg) if a is not None],
+            "has_docstring": ast.get_docstring(node) is not None,
+            "signature": f"{_tool_name(node, decorator)}({rendered})",
+        })
+    return tools
+
+
+def _tool_issues(tools: List[Dict[str, Any]]) -> List[str]:
+    if not tools:
+        return ["no MCP tool is registered (no @<server>.tool decorated function found)"]
+    issues, names = [], set()
+    for tool in tools:
+        where = f"line {tool['lineno']}: tool `{tool['name']}`"
+        if tool["name"] in names:
+            issues.append(f"{where} is registered more than once (tool names must be unique)")
+        names.add(tool["name"])
+        if tool["varargs"]:
+            issues.append(f"{where} uses *args/**kwargs ({', '.join(tool['varargs'])}); FastMCP cannot build a schema for them")
+        for param in tool["params"]:
+            if param["name"].startswith("_"):
+                issues.append(f"{where} has parameter `{param['name']}`; FastMCP rejects parameter names starting with '_'")
+    return issues
+
+
+def _calls_run(tree: ast.AST) -> bool:
+    servers = _server_instances(tree)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "run":
+            value = node.func.value
+            if not servers or (isinstance(value, ast.Name) and value.id in servers):
+                return True
+    return False
+
+
+def check_server_code(code: str, server_file: Path) -> StaticGateResult:
+    """Runs the static gate on ``code`` (the content of ``server_file``)."""
+    started = time.perf_counter()
+    result = StaticGateResult(server_file=str(server_file))
+    try:
+        tree = ast.parse(code, filename=str(server_file))
+        compile(tree, str(server_file), "exec")
+    except SyntaxError as e:
+        line = (e.text or "").rstrip()
+        result.issues.append(f"line {e.lineno}: SyntaxError: {e.msg}" + (f": `{line.strip()}`" if line.strip() else ""))
+    except ValueError as e:
+        result.issues.append(f"compile error: {e}")
+    else:
+        result.issues += unresolved_imports(tree, [Path(server_file).parent, PROJECT_ROOT])
+        result.tools = extract_tools(tree)
+        result.issues += _tool_issues(result.tools)
+        if not _calls_run(tree):
+            result.issues.append("the server never calls `<server>.run(...)`, so the process exits immediately when started")
+    result.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def check_server_file(server_file: Path) -> StaticGateResult:
+    """Runs the static gate on a server file."""
+    try:
+        code = Path(server_file).read_text(encoding="utf-8")
+    except (OSError, UnicodeDecodeError) as e:
+        return StaticGateResult(server_file=str(server_file), issues=[f"cannot read server file: {e}"])
+    return check_server_code(code, Path(server_file))
+
+
+__all__ = [
+    "StaticGateResult",
+    "check_server_code",
+    "check_server_file",
+    "extract_tools",
+    "static_gate_enabled",
+    "unresolved_imports",
+]
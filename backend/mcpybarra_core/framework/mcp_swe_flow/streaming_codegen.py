@@ -0,0 +1,194 @@
+"""
+Streamed code generation with incremental syntax validation.
+
+Codegen used to wait for the whole completion (up to LLM_MAX_TOKENS) before
+looking at it, so an answer that was broken from its first lines, e.g. code
+wrapped in a markdown fence or a stray prose paragraph, still cost a full
+generation. Here the codegen turn is streamed. The arguments of the
+save-file tool call are parsed as they arrive, and the code received so far is
+compiled every CODEGEN_STREAM_CHECK_CHARS characters:
+
+- only the complete top-level statements are compiled: the stream is cut before
+  the last line that starts at column 0, so a half-written function is never
+  judged;
+- errors that only mean "the input stopped here" (unterminated string, unclosed
+  bracket, unexpected EOF) are ignored;
+- any other error must be reported at the same line in two consecutive checks
+  (the code having grown in between) before the stream is declared malformed.
+
+On a malformed stream the HTTP stream is closed at once, so no more tokens are
+generated, and the caller re-prompts with the error.
+
+Environment:
+    ENABLE_STREAMING_CODEGEN    "true"/"false" (default true)
+    CODEGEN_STREAM_CHECK_CHARS  characters between checks (default 1500)
+    MAX_CODEGEN_STREAM_ABORTS   early aborts per node before validation is turned off (default 2)
+"""
+import ast
+import os
+import re
+from contextlib import aclosing
+from typing import Any, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, message_chunk_to_message
+from langchain_core.utils.json import parse_partial_json
+
+from logger import logger
+from mcp_swe_flow.config import get_env_int
+
+# SyntaxError messages that only mean the code was cut off mid-statement
+TRUNCATION_HINTS = (
+    "unterminated",
+    "was never closed",
+    "unexpected eof",
+    "eof while",
+    "expected an indented block",
+)
+
+# Column-0 lines that continue the previous statement rather than start a new one
+CONTINUATION_PREFIXES = ("else", "elif", "except", "finally", "case", ")", "]", "}", "#")
+
+
+def streaming_enabled() -> bool:
+    return os.getenv("ENABLE_STREAMING_CODEGEN", "true").strip().lower() in ("1", "true", "yes", "on")
+
+
+def complete_prefix(code: str) -> str:
+    """
+    Returns the part of ``code`` made of complete top-level statements:
+    everything before the last column-0 line that starts a new statement.
+    The final line is always treated as unfinished.
+    """
+    lines = code.split("\n")[:-1]
+    for index in range(len(lines) - 1, 0, -1):
+        line = lines[index]
+        if not line or line[0].isspace() or line.startswith(CONTINUATION_PREFIXES):
+            continue
+        previous = next((l for l in reversed(lines[:index]) if l.strip()), "")
+        if previous.lstrip().startswith("@") or previous.rstrip().endswith(("\\", ",", "(", "[", "{")):
+            continue
+        return "\n".join(lines[:index])
+    return ""
+
+
+class IncrementalCodeValidator:
+    """Decides, from growing prefixes of a Python file, whether it is clearly malformed."""
+
+    def __init__(self, check_every_chars: Optional[int] = None, confirmations: int = 2):
+        self.check_every_chars = check_every_chars or get_env_int("CODEGEN_STREAM_CHECK_CHARS", 1500)
+        self.confirmations = confirmations
+        self._checked_len = 0
+        self._prefix_len = 0
+        self._last_error: Optional[Tuple[int, str]] = None
+        self._strikes = 0
+
+    def feed(self, code: str) -> Optional[str]:
+        """
+        Checks the code received so far.
+
+        Returns:
+            A description of the syntax error once the stream is clearly
+            malformed, otherwise ``None``.
+        """
+        if len(code) - self._checked_len < self.check_every_chars:
+            return None
+        self._checked_len = len(code)
+
+        stripped = code.lstrip()
+        if stripped.startswith("```"):
+            return "line 1: the content starts with a markdown code fence instead of Python source"
+
+        prefix = complete_prefix(code)
+        if len(prefix) <= self._prefix_len:
+            return None
+        self._prefix_len = len(prefix)
+
+        try:
+            ast.parse(prefix)
+        except SyntaxError as e:
+            message = e.msg or "invalid syntax"
+            if any(hint in message.lower() for hint in TRUNCATION_HINTS):
+                return None
+            error = (e.lineno or 0, message)
+            self._strikes = self._strikes + 1 if error == self._last_error else 1
+            self._last_error = error
+            if self._strikes >= self.confirmations:
+                return f"line {error[0]}: {message}"
+            return None
+        self._last_error, self._strikes = None, 0
+        return None
+
+
+def _strip_thought(code: str) -> Optional[str]:
+    """Drops a leading Gemini <thought> block; ``None`` while it is still open."""
+    if not code.lstrip().startswith("<thought>"):
+        return code
+    match = re.search(r"</thought>(.*)", code, re.DOTALL)
+    return match.group(1).lstrip("\n") if match else None
+
+
+def _streamed_code(message_chunk, tool_name: str) -> Optional[str]:
+    for call in getattr(message_chunk, "tool_call_chunks", None) or []:
+        if call.get("name") == tool_name and call.get("args"):
+            args = parse_partial_json(call["args"])
+            content = args.get("content") if isinstance(args, dict) else None
+            return content if isinstance(content, str) else None
+    return None
+
+
+async def stream_with_validation(
+    llm,
+    messages: List[Any],
+    tool_name: str,
+    agent_logger,
+    validator: Optional[IncrementalCodeValidator] = None,
+) -> Tuple[Optional[AIMessage], Optional[str], str]:
+    """
+    Streams one LLM turn and validates the ``content`` argument of calls to
+    ``tool_name`` while it is being generated.
+
+    Args:
+        llm: The tool-bound chat model.
+        messages: The conversation so far.
+        tool_name: Name of the save-file tool whose ``content`` is Python source.
+        agent_logger: The agent logger.
+        validator: Validator to use; ``None`` streams without validation.
+
+    Returns:
+        ``(message, abort_reason, partial_code)``: the complete AI message and
+        ``None`` when the stream finished, or ``None``, the syntax error and
+        the code received so far when it was aborted.
+    """
+    full = None
+    checked_args_len = 0
+    async with aclosing(llm.astream(messages, stream_usage=True)) as stream:
+        async for chunk in stream:
+            full = chunk if full is None else full + chunk
+            if validator is None:
+                continue
+            # Parsing the partial JSON is linear in its size, so only do it when a check is due
+            args_len = sum(len(c.get("args") or "") for c in full.tool_call_chunks or [])
+            if args_len - checked_args_len < validator.check_every_chars:
+                continue
+            checked_args_len = args_len
+            code = _streamed_code(full, tool_name)
+            code = _strip_thought(code) if code else None
+            if not code:
+                continue
+            reason = validator.feed(code)
+            if reason:
+                logger.warning(f"Aborting code generation stream after {len(code)} chars: {reason}")
+                agent_logger.log(event_type="codegen_stream_aborted", reason=reason, streamed_chars=len(code))
+                return None, reason, code
+
+    if full is None:
+        return AIMessage(content=""), None, ""
+    return message_chunk_to_message(full), None, ""
+
+
+__all__ = [
+    "IncrementalCodeValidator",
+    "complete_prefix",
+    "stream_with_validation",
+    "streaming_enabled",
+]
@@ -1,4 +1,5 @@
 import os
+import asyncio
 from typing import Type, Any, Literal, List, Optional
 
 from pydantic import BaseModel, Field
@@ -100,6 +101,8 @@ class TavilySearchTool(BaseTool):
         """Asynchronously perform a Tavily search."""
         logger.info(f"Performing asynchronous Tavily search for: '{query}'")
         # The Tavily Python SDK v0.3.3 does not have a native async client.
-        # We will call the synchronous method here, which is a common practice in LangChain tools
-        # for libraries that do not provide an async interface.
-        return self._run(query, search_depth, max_results, include_domains, exclude_domains, **kwargs) 
\ No newline at end of file
+        # Run the blocking HTTP call in a worker thread so it does not stall the event loop
+        # (and so a cancelled run is not held up waiting on it).
+        return await asyncio.to_thread(
+            self._run, query, search_depth, max_results, include_domains, exclude_domains, **kwargs
+        ) 
\ No newline at end of file
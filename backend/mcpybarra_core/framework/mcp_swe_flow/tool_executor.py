@@ -0,0 +1,125 @@
+"""
+Concurrent execution of the tool calls returned in one LLM turn.
+
+When a model returns several ``tool_calls`` in one message (Tavily searches,
+Context7 fetches, file saves), they are independent of each other, so they are
+run concurrently with ``asyncio.gather`` instead of one after another. Each
+call gets its own timeout, failures and timeouts are reported per call instead
+of aborting the turn, and results always come back in the order the model
+issued the calls so the resulting ``ToolMessage`` sequence is deterministic.
+
+Calls to tools in ``sequential_tools`` (by default the file saver, whose
+writes to the same path must not interleave) are serialized among themselves
+in call order while still overlapping with the other calls.
+
+Environment:
+    TOOL_CALL_TIMEOUT_SECONDS        default timeout per call (default 60)
+    TOOL_TIMEOUT_<TOOL_NAME>         per-tool override, e.g. TOOL_TIMEOUT_TAVILY_TECHNICAL_SEARCH=30
+    MAX_PARALLEL_TOOL_CALLS          concurrent calls per turn (default 4, 1 = sequential)
+"""
+import asyncio
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+from logger import logger
+from mcp_swe_flow.config import get_env_int
+
+SAVE_FILE_TOOL_NAME = "save_content_to_file"
+
+
+@dataclass
+class ToolCallResult:
+    """Outcome of one tool call; exactly one of ``output`` / ``error`` is meaningful."""
+    name: str
+    args: Dict[str, Any] = field(default_factory=dict)
+    call_id: Optional[str] = None
+    output: Any = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def get_tool_timeout(tool_name: str) -> int:
+    """Timeout in seconds for one call of ``tool_name``."""
+    default = get_env_int("TOOL_CALL_TIMEOUT_SECONDS", 60)
+    return get_env_int(f"TOOL_TIMEOUT_{(tool_name or '').upper()}", default)
+
+
+async def execute_tool_calls(
+    tool_calls: List[Dict[str, Any]],
+    tools: Iterable[Any],
+    agent_logger,
+    error_event: str = "tool_error",
+    sequential_tools: Iterable[str] = (SAVE_FILE_TOOL_NAME,),
+) -> List[ToolCallResult]:
+    """
+    Executes the tool calls of one LLM turn concurrently.
+
+    Args:
+        tool_calls: The ``tool_calls`` of the AI message (dicts with name/args/id).
+        tools: The tools available to the agent; unknown names yield an error result.
+        agent_logger: The agent logger; ``tool_call`` / ``tool_result`` and
+            ``error_event`` entries are written for every call.
+        error_event: Event type logged for failed calls.
+        sequential_tools: Tool names whose calls must not overlap each other.
+
+    Returns:
+        One ``ToolCallResult`` per call, in the order of ``tool_calls``.
+    """
+    tools_by_name = {t.name: t for t in tools}
+    semaphore = asyncio.Semaphore(max(1, get_env_int("MAX_PARALLEL_TOOL_CALLS", 4)))
+    sequential_tools = set(sequential_tools)
+    sequential_lock = asyncio.Lock()
+
+    async def run_one(tool_call: Dict[str, Any]) -> ToolCallResult:
+        result = ToolCallResult(
+            name=tool_call.get("name"),
+            args=tool_call.get("args") or {},
+            call_id=tool_call.get("id"),
+        )
+        tool = tools_by_name.get(result.name)
+        if tool is None:
+            result.error = f"Error: Tool '{result.name}' not found."
+            logger.warning(result.error)
+            agent_logger.log(event_type=error_event, tool=result.name, error=result.error, call_id=result.call_id)
+            return result
+
+        timeout = get_tool_timeout(result.name)
+        # Sequential tools wait for their turn before taking a concurrency slot
+        async with (sequential_lock if result.name in sequential_tools else nullcontext()):
+            async with semaphore:
+                logger.info(f"Executing tool '{result.name}':")
+                agent_logger.log(event_type="tool_call", tool=result.name, args=result.args, call_id=result.call_id)
+                started = time.monotonic()
+                try:
+                    result.output = await asyncio.wait_for(tool.ainvoke(result.args), timeout=timeout)
+                except asyncio.TimeoutError:
+                    result.error = f"Error: Tool '{result.name}' timed out after {timeout}s."
+                except Exception as e:
+                    result.error = f"Error executing tool '{result.name}': {e}"
+                result.elapsed = round(time.monotonic() - started, 3)
+
+        if result.ok:
+            logger.info(f"  - Execution result ({result.elapsed}s): {result.output}")
+            agent_logger.log(event_type="tool_result", tool=result.name, output=str(result.output),
+                             call_id=result.call_id, elapsed=result.elapsed)
+        else:
+            logger.error(result.error)
+            agent_logger.log(event_type=error_event, tool=result.name, error=result.error,
+                             call_id=result.call_id, elapsed=result.elapsed)
+        return result
+
+    if not tool_calls:
+        return []
+    if len(tool_calls) > 1:
+        logger.info(f"Executing {len(tool_calls)} tool calls concurrently: {[tc.get('name') for tc in tool_calls]}")
+    # gather preserves argument order, so results line up with tool_calls
+    return list(await asyncio.gather(*(run_one(tc) for tc in tool_calls)))
+
+
+__all__ = ["ToolCallResult", "execute_tool_calls", "get_tool_timeout", "SAVE_FILE_TOOL_NAME"]
@@ -8,6 +8,7 @@ from backend.models.order import Order, OrderStatus
 from backend.models.mcp_service import MCPService, ServiceStatus
 from backend.models.service_log import ServiceLog
 from backend.models.service_deployment import ServiceDeployment
+from backend.models.generation_cache import GenerationCacheEntry
 
 __all__ = [
     "Base",
@@ -20,4 +21,5 @@ __all__ = [
     "ServiceStatus",
     "ServiceLog",
     "ServiceDeployment",
+    "GenerationCacheEntry",
 ]
@@ -0,0 +1,38 @@
+"""
+生成结果缓存数据模型
+"""
+from sqlalchemy import Column, String, Integer, Float, Text, DateTime
+from datetime import datetime, timezone
+
+from backend.models.base import Base
+
+
+class GenerationCacheEntry(Base):
+    """生成结果缓存表（按 提示词+模型+文档版本+模板版本 的哈希寻址）"""
+    __tablename__ = "generation_cache"
+    
+    cache_key = Column(String(64), primary_key=True)
+    model = Column(String(100), nullable=False)
+    source_service_id = Column(String(50))
+    
+    # 生成产物
+    name = Column(String(200))
+    file_path = Column(String(500))
+    code = Column(Text, nullable=False)
+    readme = Column(Text)
+    requirements = Column(Text)
+    test_report = Column(Text)
+    
+    # 原始生成的质量与成本
+    quality_score = Column(Float)
+    test_pass_rate = Column(Float)
+    generation_cost = Column(Float)
+    generation_time = Column(Integer)
+    
+    # 命中统计（用于淘汰）
+    hit_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc).replace(tzinfo=None), nullable=False)
+    last_hit_at = Column(DateTime, index=True)
+    
+    def __repr__(self):
+        return f"<GenerationCacheEntry(key={self.cache_key[:12]}, model={self.model}, hits={self.hit_count})>"
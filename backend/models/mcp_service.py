@@ -5,7 +5,7 @@ from sqlalchemy import Column, String, Integer, Float, JSON, ForeignKey, Text, E
 from sqlalchemy.orm import relationship
 from backend.models.base import Base, TimestampMixin
 import enum
-from sqlalchemy import Column, String, Integer, Float, Text, Boolean, DateTime, Enum, JSON
+from sqlalchemy import Column, String, Integer, Float, Text, Boolean, DateTime, Enum, JSON, Index
 from datetime import datetime, timezone
 
 from backend.models.base import Base
@@ -19,6 +19,7 @@ class ServiceStatus(str, enum.Enum):
     DEPLOYED = "deployed"       # 已部署
     FAILED = "failed"           # 失败
     ARCHIVED = "archived"       # 已归档
+    CANCELLED = "cancelled"     # 已取消
 
 
 class MCPService(Base, TimestampMixin):
@@ -42,6 +43,8 @@ class MCPService(Base, TimestampMixin):
     code = Column(Text)
     readme = Column(Text)
     requirements = Column(Text)
+    test_report = Column(Text)
+    cache_key = Column(String(64), index=True)   # 生成结果缓存键
     
     # 成本与质量
     generation_cost = Column(Float)
@@ -68,6 +71,13 @@ class MCPService(Base, TimestampMixin):
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
     updated_at = Column(DateTime, onupdate=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
     
+    # 任务队列租约（Worker 通过 SKIP LOCKED 认领任务）
+    lease_owner = Column(String(100))
+    lease_expires_at = Column(DateTime)
+    attempt_count = Column(Integer, default=0, server_default="0", nullable=False)
+    cancel_requested_at = Column(DateTime)   # 取消请求时间，持有租约的进程在心跳时感知
+    generation_plan = Column(Text)           # 批量生成时同组共享的开发计划（跳过规划阶段）
+    
     # 优化历史
     refinement_count = Column(Integer, default=0)
     parent_service_id = Column(String(50))
@@ -76,5 +86,9 @@ class MCPService(Base, TimestampMixin):
     farmer = relationship("Farmer", back_populates="services")
     logs = relationship("ServiceLog", back_populates="service", cascade="all, delete-orphan")
     
+    __table_args__ = (
+        Index("ix_mcp_services_status_lease", "status", "lease_expires_at"),
+    )
+    
     def __repr__(self):
         return f"<MCPService(id={self.id}, name={self.name}, status={self.status.value})>"
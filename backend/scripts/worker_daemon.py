@@ -11,6 +11,7 @@ os.environ["HTTPS_PROXY"] = f"http://127.0.0.1:{PROXY_PORT}"
 
 import asyncio
 import signal
+import time
 import sys
 from pathlib import Path
 import logging
@@ -24,8 +25,12 @@ from backend.models.mcp_service import MCPService, ServiceStatus
 from backend.services.quality_monitor import QualityMonitor
 from backend.config.settings import settings
 # ✅ 2. 新增：导入核心处理函数
-from backend.services.worker_service import process_pending_services
-from sqlalchemy import select, and_
+from backend.services.worker_service import process_pending_services, get_worker_pool
+from backend.services.job_queue import JobNotificationListener, reap_stale_jobs
+from backend.services.scheduler import MaintenanceScheduler
+from backend.services.generation_cache import generation_cache
+from backend.services.workflow_checkpoint import close_checkpointer
+from sqlalchemy import select, and_, update
 
 logging.basicConfig(
     level=logging.INFO,
@@ -36,67 +41,41 @@ logger = logging.getLogger("worker")
 # 全局运行标志
 running = True
 
+# 任务唤醒器（LISTEN/NOTIFY）
+listener = JobNotificationListener()
 
-def signal_handler(signum, frame):
-    """信号处理器"""
+
+def request_shutdown(signum):
+    """停机请求（在事件循环线程中执行：asyncio.Event 不是线程安全的）"""
     global running
     logger.info(f"Received signal {signum}, shutting down...")
     running = False
+    listener.wake()
+
+
+def install_signal_handlers(loop: asyncio.AbstractEventLoop):
+    """注册 SIGINT/SIGTERM 停机处理"""
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, request_shutdown, signum)
+        except (NotImplementedError, RuntimeError):
+            # Windows 事件循环不支持 add_signal_handler：信号处理器只把停机请求投递回事件循环
+            signal.signal(signum, lambda sig, frame: loop.call_soon_threadsafe(request_shutdown, sig))
 
 
 async def check_stuck_tasks():
-    """检查并处理卡住的任务"""
-    # logger.debug("Checking for stuck tasks...") # 减少日志噪音
-    
+    """回收心跳过期的任务：未超重试上限的重新入队，否则标记失败"""
     async with AsyncSessionLocal() as session:
-        # 查找超过30分钟还在生成中的任务
-        timeout = datetime.utcnow() - timedelta(minutes=30)
-        
-        result = await session.execute(
-            select(MCPService).where(
-                and_(
-                    MCPService.status == ServiceStatus.GENERATING,
-                    MCPService.created_at < timeout
-                )
-            )
-        )
-        stuck_services = result.scalars().all()
-        
-        for service in stuck_services:
-            logger.warning(f"Service {service.id} appears stuck, marking as failed")
-            service.status = ServiceStatus.FAILED
-            service.updated_at = datetime.utcnow()
-        
-        if stuck_services:
-            await session.commit()
-            logger.info(f"Marked {len(stuck_services)} stuck services as failed")
+        await reap_stale_jobs(session)
 
 
 async def run_quality_checks():
-    """运行质量检查"""
-    # logger.debug("Running quality checks...") # 减少日志噪音
-    
+    """运行质量检查（单条聚合查询覆盖所有已部署服务）"""
     monitor = QualityMonitor()
+    degraded = await monitor.find_degraded_services(window="1h")
     
-    async with AsyncSessionLocal() as session:
-        # 查找已部署的服务
-        result = await session.execute(
-            select(MCPService).where(
-                MCPService.status == ServiceStatus.DEPLOYED
-            )
-        )
-        deployed_services = result.scalars().all()
-        
-        for service in deployed_services:
-            try:
-                # 检查服务质量
-                quality_ok = await monitor.check_service_quality(service.id)
-                
-                if not quality_ok and settings.ENABLE_AUTO_REFINE:
-                    logger.info(f"Service {service.id} needs optimization")
-                    
-            except Exception as e:
-                logger.error(f"Quality check failed for {service.id}: {e}")
+    for metrics in degraded:
+        logger.info(f"Service {metrics['service_id']} needs optimization")
 
 
 async def cleanup_old_logs():
@@ -120,65 +99,90 @@ async def cleanup_old_logs():
 
 
 async def reset_daily_counters():
-    """重置每日计数器"""
-    logger.debug("Resetting daily counters...")
+    """重置每日计数器（单条 UPDATE，不加载 ORM 对象）"""
+    from backend.models.farmer import Farmer
     
     async with AsyncSessionLocal() as session:
-        from backend.models.farmer import Farmer
-        result = await session.execute(select(Farmer))
-        farmers = result.scalars().all()
-        for farmer in farmers:
-            farmer.api_calls_today = 0
+        result = await session.execute(
+            update(Farmer)
+            .where(Farmer.api_calls_today != 0)
+            .values(api_calls_today=0)
+        )
         await session.commit()
-        logger.info(f"Reset daily counters for {len(farmers)} farmers")
+        logger.info(f"Reset daily counters for {result.rowcount} farmers")
+
+
+async def evict_generation_cache():
+    """淘汰过期/超容量的生成结果缓存"""
+    async with AsyncSessionLocal() as session:
+        await generation_cache.evict(session)
+    logger.info(f"Generation cache stats: {generation_cache.stats()}")
+
+
+def build_scheduler() -> MaintenanceScheduler:
+    """注册周期性维护任务"""
+    scheduler = MaintenanceScheduler()
+    
+    # 每日 UTC 0 点（叠加抖动），仅领导者执行
+    scheduler.add_job("reset_daily_counters", reset_daily_counters,
+                      interval_seconds=86400, jitter_seconds=60, align=True)
+    # 回收心跳过期的任务，间隔与心跳一致
+    scheduler.add_job("check_stuck_tasks", check_stuck_tasks,
+                      interval_seconds=settings.WORKER_HEARTBEAT_SECONDS, jitter_seconds=5,
+                      run_on_start=True)
+    if settings.ENABLE_AUTO_REFINE:
+        scheduler.add_job("run_quality_checks", run_quality_checks,
+                          interval_seconds=300, jitter_seconds=30)
+    scheduler.add_job("evict_generation_cache", evict_generation_cache,
+                      interval_seconds=3600, jitter_seconds=300)
+    # 日志文件在本机，每个副本各自清理
+    scheduler.add_job("cleanup_old_logs", cleanup_old_logs,
+                      interval_seconds=86400, jitter_seconds=600, align=True, leader_only=False)
+    return scheduler
 
 
 async def worker_loop():
     """主工作循环"""
     logger.info("Worker daemon started - Ready to process tasks")
     
-    last_daily_reset = datetime.utcnow().date()
+    install_signal_handlers(asyncio.get_running_loop())
+    get_worker_pool().on_job_done = listener.wake
+    listener.on_cancel = get_worker_pool().cancel_job
+    scheduler = build_scheduler()
+    last_stats_log = 0.0
     
     while running:
         try:
-            current_date = datetime.utcnow().date()
-            
-            # 每日任务
-            if current_date > last_daily_reset:
-                await reset_daily_counters()
-                await cleanup_old_logs()
-                last_daily_reset = current_date
-            
             # ✅ 3. 核心修复：处理待办任务
-            # 这一步是让 Worker 干活的关键
+            # 按空闲槽位认领任务，在有界任务池中并发执行（不阻塞主循环）
             await process_pending_services()
             
-            # 定期维护
-            await check_stuck_tasks()
+            # 到期的维护任务（回收/每日重置/质量检查），仅领导者副本执行
+            await scheduler.run_pending()
             
-            # 质量检查
-            if settings.ENABLE_AUTO_REFINE:
-                await run_quality_checks()
+            if time.monotonic() - last_stats_log >= 600:
+                logger.info(f"Maintenance job stats: {scheduler.stats()}")
+                last_stats_log = time.monotonic()
             
-            # ✅ 4. 优化：缩短等待时间
-            # 从60秒改为5秒，让它响应更快，不要让用户干等
-            for _ in range(5): 
-                if not running:
-                    break
-                await asyncio.sleep(1)
+            # ✅ 4. 阻塞在 LISTEN 上等待入队通知/槽位释放，超时兜底轮询
+            if running:
+                timeout = min(settings.WORKER_POLL_INTERVAL_SECONDS, scheduler.seconds_until_next())
+                await listener.wait(timeout=timeout)
                 
         except Exception as e:
             logger.error(f"Worker loop error: {e}", exc_info=True)
             await asyncio.sleep(10)
     
+    # 取消进行中的任务并释放租约
+    await get_worker_pool().shutdown()
+    await scheduler.close()
+    await close_checkpointer()
+    await listener.close()
     logger.info("Worker daemon stopped")
 
 
 def main():
     """主入口"""
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
     logger.info("=" * 50)
     logger.info("智农链销 - Worker守护进程 (Fixed Version)")
     logger.info("=" * 50)
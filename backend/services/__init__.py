@@ -5,10 +5,13 @@ from backend.services.service_manager import ServiceManager
 from backend.services.deployment_service import DeploymentService
 from backend.services.cost_calculator import CostCalculator
 from backend.services.quality_monitor import QualityMonitor
+from backend.services.workflow_registry import workflow_registry, get_service_manager
 
 __all__ = [
     "ServiceManager",
     "DeploymentService",
     "CostCalculator",
-    "QualityMonitor"
+    "QualityMonitor",
+    "workflow_registry",
+    "get_service_manager"
 ]
@@ -23,18 +23,24 @@ class CostCalculator:
             "price": 0,
             "max_services": 3,
             "max_requests_per_day": 100,
+            "queue_weight": 1,      # 生成队列公平调度权重
+            "model_race": False,    # 是否开通多模型竞速生成
             "features": ["基础功能", "3个免费服务"]
         },
         "basic": {
             "price": 9.9,
             "max_services": 10,
             "max_requests_per_day": 1000,
+            "queue_weight": 2,
+            "model_race": False,
             "features": ["所有基础功能", "10个服务", "优先支持"]
         },
         "professional": {
             "price": 49.9,
             "max_services": 50,
             "max_requests_per_day": 10000,
+            "queue_weight": 4,
+            "model_race": True,
             "features": ["所有功能", "50个服务", "专属客服", "数据分析"]
         }
     }
@@ -14,10 +14,14 @@ import re
 import signal
 import subprocess
 import sys
+import tempfile
+import time
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
+from backend.config.settings import settings
+
 logger = logging.getLogger(__name__)
 
 
@@ -110,20 +114,10 @@ class DeploymentService:
 
         return "app"
 
-    # -------------------- precheck --------------------
-    async def _precheck_uvicorn(
-        self,
-        cwd: str,
-        module_name: str,
-        asgi_attr: str,
-        port: int,
-        env: Dict[str, str],
-        max_output_length: int = 8000,
-    ) -> None:
-        """
-        预检：启动 uvicorn 0.8s，若秒退则抓 stdout/stderr
-        """
-        cmd = [
+    # -------------------- process / readiness --------------------
+    @staticmethod
+    def _uvicorn_cmd(module_name: str, asgi_attr: str, port: int) -> List[str]:
+        return [
             sys.executable, "-m", "uvicorn",
             f"{module_name}:{asgi_attr}",
             "--host", "0.0.0.0",
@@ -132,32 +126,83 @@ class DeploymentService:
             "--log-level", "info",
         ]
 
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            cwd=cwd,
-            env=env,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-
-        await asyncio.sleep(0.8)
-        ret = proc.returncode
-        if ret is not None:
-            out = (await proc.stdout.read()).decode("utf-8", errors="ignore")
-            err = (await proc.stderr.read()).decode("utf-8", errors="ignore")
-            logger.error("❌ uvicorn 预检秒退 (returncode=%s)", ret)
-            if out.strip():
-                logger.error("---- server stdout ----\n%s", out[-max_output_length:])
-            if err.strip():
-                logger.error("---- server stderr ----\n%s", err[-max_output_length:])
-            raise RuntimeError("部署预检失败：服务启动即退出，请根据 stderr 修复生成代码/依赖/环境变量")
-
-        # 仍在运行：终止预检进程（避免占用端口），正式部署再启动一次
-        proc.terminate()
+    @staticmethod
+    def _kill_process_group(process: subprocess.Popen, timeout: float = 5) -> None:
+        """终止服务进程（POSIX 下连同整个进程组）；会阻塞等待进程退出，异步代码中经 asyncio.to_thread 调用"""
+        if process.poll() is not None:
+            return
+        if os.name != "nt":
+            os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+        else:
+            process.terminate()
+
         try:
-            await asyncio.wait_for(proc.wait(), timeout=1.0)
-        except Exception:
-            proc.kill()
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            if os.name != "nt":
+                os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+            else:
+                process.kill()
+
+    @staticmethod
+    def _read_log_tail(log_file: str, max_output_length: int) -> str:
+        try:
+            return Path(log_file).read_text(encoding="utf-8", errors="ignore")[-max_output_length:]
+        except OSError:
+            return ""
+
+    async def _wait_until_ready(
+        self,
+        process: subprocess.Popen,
+        base_url: str,
+        log_file: str,
+        timeout: Optional[float] = None,
+        max_output_length: int = 8000,
+    ) -> float:
+        """
+        就绪探测：指数退避轮询 HTTP，直到服务有响应
+
+        uvicorn 只有在应用启动完成后才开始监听端口，因此任何 HTTP 响应（包括 404）都说明服务已就绪。
+        进程提前退出时立即失败，并输出日志文件（stdout/stderr）末尾内容。
+
+        Args:
+            process: 服务进程
+            base_url: 服务根地址
+            log_file: 服务 stdout/stderr 日志文件
+            timeout: 最长等待秒数，默认 settings.DEPLOY_READY_TIMEOUT_SECONDS
+            max_output_length: 失败时输出日志的最大长度
+
+        Returns:
+            float: 就绪耗时（秒）
+        """
+        import aiohttp
+
+        timeout = settings.DEPLOY_READY_TIMEOUT_SECONDS if timeout is None else timeout
+        started = time.monotonic()
+        delay = 0.05
+        async with aiohttp.ClientSession() as session:
+            while True:
+                ret = process.poll()
+                if ret is not None:
+                    logger.error("❌ 服务启动后立刻退出 (returncode=%s)", ret)
+                    output = self._read_log_tail(log_file, max_output_length)
+                    if output.strip():
+                        logger.error("---- server output ----\n%s", output)
+                    raise RuntimeError("部署失败：服务启动即退出，请根据 stderr 修复生成代码/依赖/环境变量")
+
+                try:
+                    async with session.get(f"{base_url}/health", timeout=aiohttp.ClientTimeout(total=2)):
+                        return time.monotonic() - started
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+
+                if time.monotonic() - started > timeout:
+                    output = self._read_log_tail(log_file, max_output_length)
+                    if output.strip():
+                        logger.error("---- server output ----\n%s", output)
+                    raise RuntimeError(f"部署失败：服务在 {timeout} 秒内未就绪")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 1.0)
 
     # -------------------- public APIs --------------------
     async def deploy_service(self, service_id: str, file_path: str, mode: str = "http") -> Dict[str, Any]:
@@ -182,7 +227,7 @@ class DeploymentService:
         以 HTTP 服务方式部署（uvicorn 子进程）
         - 自动解析入口文件
         - 自动检测 ASGI 对象名（app / mcp）
-        - 预检秒退抓日志
+        - 只启动一次，就绪探测（HTTP 指数退避轮询），秒退抓日志
         - 返回 deploy_port / endpoints / deployed_at（naive UTC）
         """
         port = self._allocate_port()
@@ -197,32 +242,19 @@ class DeploymentService:
             env["MCP_PORT"] = str(port)
             env["PORT"] = str(port)
 
-            # 预检（秒退直接报 stderr）
-            await self._precheck_uvicorn(
-                cwd=service_dir,
-                module_name=module_name,
-                asgi_attr=asgi_attr,
-                port=port,
-                env=env,
-            )
-
-            cmd = [
-                sys.executable, "-m", "uvicorn",
-                f"{module_name}:{asgi_attr}",
-                "--host", "0.0.0.0",
-                "--port", str(port),
-                "--workers", "1",
-                "--log-level", "info",
-            ]
+            cmd = self._uvicorn_cmd(module_name, asgi_attr, port)
 
             logger.info("Starting service with command: %s (cwd=%s)", " ".join(cmd), service_dir)
 
+            # 只启动一次；stdout/stderr 写入日志文件，既不会因管道写满阻塞，也便于秒退时排查
+            log_fd, log_file = tempfile.mkstemp(prefix=f"mcp-deploy-{service_id}-", suffix=".log")
+
             # Windows / POSIX 分别处理子进程组，便于 stop 时整体杀掉
             popen_kwargs: Dict[str, Any] = {
                 "cwd": service_dir,
                 "env": env,
-                "stdout": subprocess.PIPE,
-                "stderr": subprocess.PIPE,
+                "stdout": log_fd,
+                "stderr": subprocess.STDOUT,
                 "text": False,
             }
             if os.name != "nt":
@@ -230,13 +262,24 @@ class DeploymentService:
             else:
                 popen_kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP  # type: ignore[attr-defined]
 
-            process = subprocess.Popen(cmd, **popen_kwargs)
+            try:
+                process = subprocess.Popen(cmd, **popen_kwargs)
+            finally:
+                os.close(log_fd)
+
+            base_url = f"http://127.0.0.1:{port}"
+            try:
+                ready_s = await self._wait_until_ready(process, base_url, log_file)
+            except BaseException:
+                await asyncio.to_thread(self._kill_process_group, process)
+                Path(log_file).unlink(missing_ok=True)
+                raise
+            logger.info("Service %s ready after %.2fs", service_id, ready_s)
 
             # 按你要求：DB 写入用 naive UTC datetime
             deployed_at_dt = datetime.now(timezone.utc).replace(tzinfo=None)
             deployed_at_iso = deployed_at_dt.isoformat()
 
-            base_url = f"http://127.0.0.1:{port}"
             endpoints = [
                 f"{base_url}/mcp",          # MCP HTTP endpoint
                 f"{base_url}/",             # root
@@ -255,6 +298,7 @@ class DeploymentService:
                 "endpoints": endpoints,
                 "entry": f"{module_name}:{asgi_attr}",
                 "cwd": service_dir,
+                "log_file": log_file,
                 "deployed_at": deployed_at_iso,
                 "deployed_at_dt": deployed_at_dt,
             }
@@ -300,19 +344,9 @@ class DeploymentService:
             if deployment_info["mode"] == "http":
                 process: subprocess.Popen = deployment_info["process"]
 
-                if process.poll() is None:
-                    if os.name != "nt":
-                        os.killpg(os.getpgid(process.pid), signal.SIGTERM)
-                    else:
-                        process.terminate()
-
-                    try:
-                        process.wait(timeout=5)
-                    except subprocess.TimeoutExpired:
-                        if os.name != "nt":
-                            os.killpg(os.getpgid(process.pid), signal.SIGKILL)
-                        else:
-                            process.kill()
+                await asyncio.to_thread(self._kill_process_group, process)
+                if deployment_info.get("log_file"):
+                    Path(deployment_info["log_file"]).unlink(missing_ok=True)
 
                 self._release_port(int(deployment_info.get("port") or 0))
 
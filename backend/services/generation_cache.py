@@ -0,0 +1,266 @@
+"""
+生成结果缓存
+按内容寻址复用已生成的MCP服务产物
+
+缓存键 = sha256(提示词, 模型, MCP文档哈希, 提示词模板版本)：
+- PromptBuilder 对相同产品/服务类型生成的提示词是确定的，相同输入无需重复跑完整工作流
+- MCP文档或任一提示词模板变化都会产生新键，旧条目自然失效并由淘汰任务清理
+- 只缓存测试评估为 DELIVERABLE 的真实工作流产物；命中时文件复制到新服务自己的目录
+"""
+import json
+import shutil
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.models.generation_cache import GenerationCacheEntry
+from backend.models.mcp_service import MCPService
+from backend.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_DIR = Path(__file__).parent.parent / "mcpybarra_core" / "framework" / "mcp_swe_flow" / "prompts"
+
+# 从缓存条目克隆到 MCPService 的字段（file_path 单独处理：命中时复制文件而非共用目录）
+CLONED_FIELDS = (
+    "code", "readme", "requirements", "test_report",
+    "quality_score", "test_pass_rate",
+)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _copy_artifacts(entry: GenerationCacheEntry, output_dir: Path) -> str:
+    """
+    将缓存条目的服务文件复制到新服务的输出目录
+
+    源目录仍存在时整体复制（忽略 __pycache__），否则按缓存的代码重建服务文件
+
+    Returns:
+        str: 新服务文件路径
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    source = Path(entry.file_path) if entry.file_path else None
+    if source is not None and source.is_file():
+        shutil.copytree(
+            source.parent, output_dir, dirs_exist_ok=True,
+            ignore=shutil.ignore_patterns("__pycache__"),
+        )
+        return str(output_dir / source.name)
+
+    target = output_dir / (source.name if source is not None else "server.py")
+    target.write_text(entry.code, encoding="utf-8")
+    if entry.readme:
+        (output_dir / "README.md").write_text(entry.readme, encoding="utf-8")
+    if entry.requirements:
+        (output_dir / "requirements.txt").write_text(entry.requirements, encoding="utf-8")
+    return str(target)
+
+
+def _file_digest(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+@lru_cache(maxsize=1)
+def prompt_template_versions() -> str:
+    """所有提示词模板内容的联合哈希（进程内缓存，模板随代码发布变化）"""
+    digest = hashlib.sha256()
+    for path in sorted(PROMPTS_DIR.rglob("*.prompt")):
+        digest.update(str(path.relative_to(PROMPTS_DIR)).encode("utf-8"))
+        digest.update(_file_digest(path).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def mcp_doc_version() -> str:
+    """MCP文档哈希（与 load_input_node 的查找顺序一致）"""
+    for resources_dir in (Path(settings.WORKSPACE_DIR) / "resources", Path("workspace/resources")):
+        doc_path = resources_dir / "mcp-server-doc.md"
+        if doc_path.exists():
+            return _file_digest(doc_path)
+    return "none"
+
+
+def compute_cache_key(prompt: str, model: str) -> str:
+    """
+    计算生成结果缓存键
+
+    Args:
+        prompt: 完整的用户提示词
+        model: 生成模型
+
+    Returns:
+        str: 64位十六进制哈希
+    """
+    payload = json.dumps(
+        {
+            "prompt": prompt,
+            "model": model,
+            "mcp_doc": mcp_doc_version(),
+            "templates": prompt_template_versions(),
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """生成结果缓存（数据库持久化，进程内统计命中率）"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.ENABLE_GENERATION_CACHE
+
+    async def lookup(self, session: AsyncSession, cache_key: str) -> Optional[GenerationCacheEntry]:
+        """
+        查询缓存并记录命中（不提交事务）
+
+        Args:
+            session: 数据库会话
+            cache_key: 缓存键
+
+        Returns:
+            Optional[GenerationCacheEntry]: 命中且未过期的条目
+        """
+        if not self.enabled:
+            return None
+
+        expires_before = _utcnow() - timedelta(days=settings.GENERATION_CACHE_TTL_DAYS)
+        result = await session.execute(
+            select(GenerationCacheEntry).where(
+                GenerationCacheEntry.cache_key == cache_key,
+                GenerationCacheEntry.created_at >= expires_before,
+            )
+        )
+        entry = result.scalar_one_or_none()
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        await session.execute(
+            update(GenerationCacheEntry)
+            .where(GenerationCacheEntry.cache_key == cache_key)
+            .values(hit_count=GenerationCacheEntry.hit_count + 1, last_hit_at=_utcnow())
+        )
+        return entry
+
+    @staticmethod
+    async def apply_to_service(entry: GenerationCacheEntry, service: MCPService, output_dir: Path):
+        """
+        将缓存产物克隆到新的服务记录
+
+        Args:
+            entry: 命中的缓存条目
+            service: 新的服务记录
+            output_dir: 新服务自己的输出目录（服务文件复制到这里，不与源服务共用）
+        """
+        for field in CLONED_FIELDS:
+            setattr(service, field, getattr(entry, field))
+        service.file_path = await asyncio.to_thread(_copy_artifacts, entry, Path(output_dir))
+        service.name = entry.name or service.name
+        service.cache_key = entry.cache_key
+        service.parent_service_id = entry.source_service_id
+
+    async def store(self, session: AsyncSession, service: MCPService) -> bool:
+        """
+        将已完成服务的产物写入缓存（不提交事务）
+
+        Args:
+            session: 数据库会话
+            service: 已生成成功、测试评估为可交付且带有 cache_key 的服务（由调用方判定）
+
+        Returns:
+            bool: 是否写入
+        """
+        if not self.enabled or not service.cache_key or not service.code:
+            return False
+
+        values = {
+            "model": service.model_used or settings.DEFAULT_SWE_MODEL,
+            "source_service_id": service.id,
+            "name": service.name,
+            "generation_cost": service.generation_cost,
+            "generation_time": service.generation_time,
+            "file_path": service.file_path,
+            "created_at": _utcnow(),
+            **{field: getattr(service, field) for field in CLONED_FIELDS},
+        }
+        stmt = insert(GenerationCacheEntry).values(cache_key=service.cache_key, hit_count=0, **values)
+        await session.execute(
+            stmt.on_conflict_do_update(index_elements=[GenerationCacheEntry.cache_key], set_=values)
+        )
+        self.stores += 1
+        logger.info(f"Stored generation result of {service.id} in cache ({service.cache_key[:12]})")
+        return True
+
+    async def evict(self, session: AsyncSession) -> int:
+        """
+        淘汰过期条目与超出容量的最久未使用条目（提交事务）
+
+        Returns:
+            int: 删除的条目数
+        """
+        expires_before = _utcnow() - timedelta(days=settings.GENERATION_CACHE_TTL_DAYS)
+        expired = await session.execute(
+            delete(GenerationCacheEntry).where(GenerationCacheEntry.created_at < expires_before)
+        )
+
+        last_used = func.coalesce(GenerationCacheEntry.last_hit_at, GenerationCacheEntry.created_at)
+        overflow_keys = (
+            select(GenerationCacheEntry.cache_key)
+            .order_by(last_used.desc())
+            .offset(settings.GENERATION_CACHE_MAX_ENTRIES)
+            .scalar_subquery()
+        )
+        overflow = await session.execute(
+            delete(GenerationCacheEntry).where(GenerationCacheEntry.cache_key.in_(overflow_keys))
+        )
+        await session.commit()
+
+        removed = (expired.rowcount or 0) + (overflow.rowcount or 0)
+        self.evictions += removed
+        if removed:
+            logger.info(f"Evicted {removed} generation cache entries")
+        return removed
+
+    def stats(self) -> Dict[str, float]:
+        """命中率统计"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+
+# 进程内单例
+generation_cache = GenerationCache()
+
+
+__all__ = [
+    "GenerationCache",
+    "generation_cache",
+    "compute_cache_key",
+    "prompt_template_versions",
+    "mcp_doc_version",
+]
@@ -0,0 +1,249 @@
+"""
+生成任务执行器
+决定 MCPybarra 工作流在哪里运行，使生成负载与 API 请求处理隔离
+
+支持的后端（settings.GENERATION_EXECUTOR）：
+- inprocess:    在 API 进程的事件循环中执行（开发调试，默认）
+- process_pool: 在本机子进程池中执行，进度与事件经 multiprocessing 队列回传给 API 进程
+- worker:       仅入队（NOTIFY），由 worker_daemon 认领执行；进度需配合 redis 进度存储
+
+工作流中的同步调用（Tavily SDK、工具调用正则归一化、Jinja 渲染、文件 I/O、子进程管理）
+在 inprocess 模式下会占用 API 事件循环；process_pool / worker 模式下不再影响请求延迟。
+"""
+import copy
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+
+from backend.config.settings import settings
+from backend.services.progress_store import progress_store
+
+logger = logging.getLogger(__name__)
+
+
+class InProcessExecutor:
+    """在当前事件循环中执行工作流"""
+
+    name = "inprocess"
+    # 是否由提交方持有租约（否则留给 worker_daemon 认领）
+    leases_locally = True
+
+    async def submit(self, manager, task_id: str, initial_state: Dict[str, Any], request_id: Optional[str] = None):
+        """
+        提交生成任务
+
+        Returns:
+            Optional[asyncio.Task]: 可等待/取消的本地任务；由外部 Worker 执行时为 None
+        """
+        return asyncio.create_task(manager._execute_workflow(task_id, initial_state, request_id))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"executor": self.name}
+
+    async def close(self):
+        pass
+
+
+class WorkerQueueExecutor(InProcessExecutor):
+    """只入队，由 worker_daemon 通过 LISTEN/NOTIFY 认领执行"""
+
+    name = "worker"
+    leases_locally = False
+
+    async def submit(self, manager, task_id: str, initial_state: Dict[str, Any], request_id: Optional[str] = None):
+        logger.info(f"[{request_id}] Generation {task_id} handed to worker_daemon")
+        return None
+
+
+# ==================== 子进程侧 ====================
+
+_child_queue = None
+_child_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _relay_to_parent(kind: str, payload: Dict[str, Any]):
+    # 快照会在后续节点中继续修改，入队前复制（Queue 在后台线程中才序列化）
+    _child_queue.put((kind, copy.deepcopy(payload)))
+
+
+def _init_child(queue):
+    """子进程初始化：进度中继到父进程，复用同一个事件循环（数据库连接池与检查点连接绑定在循环上）"""
+    global _child_queue, _child_loop
+    logging.basicConfig(
+        level=getattr(logging, settings.LOG_LEVEL),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    _child_queue = queue
+    _child_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_child_loop)
+    progress_store.set_relay(_relay_to_parent)
+
+
+def _run_in_child(task_id: str, initial_state: Dict[str, Any], request_id: Optional[str], worker_id: str):
+    """在子进程中执行工作流（结果由 ServiceManager 直接写回数据库）"""
+    from backend.services.workflow_registry import get_service_manager
+    manager = get_service_manager()
+    _child_loop.run_until_complete(
+        manager._execute_workflow(task_id, initial_state, request_id, worker_id=worker_id)
+    )
+
+
+# ==================== 父进程侧 ====================
+
+class ProcessPoolGenerationExecutor(InProcessExecutor):
+    """在本机子进程池中执行工作流"""
+
+    name = "process_pool"
+    leases_locally = True
+    # 子进程崩溃导致进程池损坏后，在重建的进程池中重新执行的次数（从检查点继续）
+    max_crash_retries = 1
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or settings.GENERATION_PROCESS_POOL_SIZE
+        # spawn：子进程不继承父进程的事件循环、数据库连接与线程
+        self._ctx = multiprocessing.get_context("spawn")
+        self._queue = self._ctx.Queue()
+        self._pool = self._new_pool()
+        self._pool_lock = asyncio.Lock()
+        self._pump: Optional[asyncio.Task] = None
+        self.submitted = 0
+        self.crashed = 0
+        self.pool_rebuilds = 0
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=self._ctx,
+            initializer=_init_child,
+            initargs=(self._queue,),
+        )
+
+    async def _replace_broken_pool(self, broken: ProcessPoolExecutor):
+        """
+        重建损坏的进程池（任一子进程异常退出后，整个 ProcessPoolExecutor 不再接受任务）
+        
+        同一次崩溃会让池中所有在途任务同时失败，只有第一个发现的任务重建进程池
+        """
+        async with self._pool_lock:
+            if self._pool is not broken:
+                return
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._new_pool()
+            self.pool_rebuilds += 1
+            logger.warning(f"Generation process pool was broken, rebuilt it ({self.pool_rebuilds} rebuilds)")
+
+    async def _pump_progress(self):
+        """把子进程回传的快照/事件落地到本进程的进度存储"""
+        while True:
+            item = await asyncio.to_thread(self._queue.get)
+            if item is None:
+                return
+            kind, payload = item
+            try:
+                await progress_store.apply_relayed(kind, payload)
+            except Exception as e:
+                logger.warning(f"Failed to apply relayed progress: {e}")
+
+    async def submit(self, manager, task_id: str, initial_state: Dict[str, Any], request_id: Optional[str] = None):
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._pump_progress())
+        self.submitted += 1
+        return asyncio.create_task(self._run(manager, task_id, initial_state, request_id))
+
+    async def _run(self, manager, task_id: str, initial_state: Dict[str, Any], request_id: Optional[str]):
+        loop = asyncio.get_running_loop()
+        try:
+            for attempt in range(self.max_crash_retries + 1):
+                pool = self._pool
+                try:
+                    await loop.run_in_executor(
+                        pool, _run_in_child, task_id, initial_state, request_id, manager.worker_id
+                    )
+                    return
+                except asyncio.CancelledError:
+                    # 子进程无法直接取消：取消请求已写入数据库，子进程在下一次心跳时中断并记录 CANCELLED
+                    raise
+                except BrokenProcessPool as e:
+                    # 先重建进程池，再重新执行或释放，否则后续任务都会提交到已损坏的池
+                    self.crashed += 1
+                    logger.error(f"[{request_id}] Generation process for {task_id} crashed: {e}")
+                    await self._replace_broken_pool(pool)
+                    if attempt < self.max_crash_retries:
+                        logger.info(f"[{request_id}] Resubmitting {task_id} to the rebuilt process pool")
+                        continue
+                except Exception as e:
+                    self.crashed += 1
+                    logger.error(f"[{request_id}] Generation process for {task_id} failed: {e}", exc_info=True)
+                await self._requeue(manager, task_id)
+                return
+        finally:
+            manager.active_tasks.pop(task_id, None)
+            manager._cancel_requested.discard(task_id)
+
+    async def _requeue(self, manager, task_id: str):
+        """释放租约并重新入队，由 worker_daemon 或重试接手"""
+        from backend.database.connection import AsyncSessionLocal
+        from backend.services.job_queue import release_job, notify_job_enqueued
+        async with AsyncSessionLocal() as session:
+            if await release_job(session, task_id, manager.worker_id):
+                await notify_job_enqueued(session, task_id)
+            await session.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executor": self.name,
+            "max_workers": self.max_workers,
+            "submitted": self.submitted,
+            "crashed": self.crashed,
+            "pool_rebuilds": self.pool_rebuilds,
+        }
+
+    async def close(self):
+        # 不等待运行中的子进程：其租约过期后由回收器重新入队，并从检查点继续
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._queue.put(None)
+        if self._pump is not None:
+            await asyncio.gather(self._pump, return_exceptions=True)
+
+
+EXECUTORS = {
+    "inprocess": InProcessExecutor,
+    "process_pool": ProcessPoolGenerationExecutor,
+    "worker": WorkerQueueExecutor,
+}
+
+_executor: Optional[InProcessExecutor] = None
+
+
+def get_generation_executor() -> InProcessExecutor:
+    """获取按配置创建的执行器单例"""
+    global _executor
+    if _executor is None:
+        name = (settings.GENERATION_EXECUTOR or "inprocess").lower()
+        executor_cls = EXECUTORS.get(name)
+        if executor_cls is None:
+            logger.warning(f"Unknown GENERATION_EXECUTOR '{name}', falling back to inprocess")
+            executor_cls = InProcessExecutor
+        _executor = executor_cls()
+        logger.info(f"Generation executor: {_executor.name}")
+    return _executor
+
+
+async def close_generation_executor():
+    """关闭执行器"""
+    global _executor
+    if _executor is not None:
+        await _executor.close()
+    _executor = None
+
+
+__all__ = [
+    "InProcessExecutor",
+    "WorkerQueueExecutor",
+    "ProcessPoolGenerationExecutor",
+    "get_generation_executor",
+    "close_generation_executor",
+]
@@ -0,0 +1,604 @@
+"""
+服务生成任务队列
+基于 mcp_services 表实现的持久化租约队列
+
+设计要点：
+- 待处理任务即 status=GENERATING 且尚无代码、租约为空或已过期的记录
+- 通过 SELECT ... FOR UPDATE SKIP LOCKED 认领任务，多个 Worker 副本之间互不阻塞、不会重复认领
+- 认领时写入租约持有者、租约到期时间并累加尝试次数，进程崩溃后租约到期即可被重新认领
+- 入队时在同一事务内发送 NOTIFY，Worker 通过 LISTEN 即时唤醒，轮询仅作为兜底
+- 认领顺序按农户加权公平排队：同一农户的第 k 个任务虚拟完成时间为 k / 等级权重，
+  权重来自 CostCalculator.PRICING_TIERS，避免单个农户批量提交饿死其他农户
+- 执行期间通过心跳续约（定时 + 工作流节点边界），回收器把心跳过期的任务重新入队，
+  超过最大尝试次数才标记为 FAILED
+- 取消：排队中的任务直接标记 CANCELLED；执行中的任务写入取消请求并通过 NOTIFY 通知持有者，
+  持有者在收到通知或下一次心跳时取消本地执行
+"""
+import os
+import time
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import asyncpg
+from sqlalchemy import select, update, and_, or_, text, func, case, cast, Float
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.database.connection import AsyncSessionLocal
+from backend.models.mcp_service import MCPService, ServiceStatus
+from backend.models.farmer import Farmer, FarmerTier
+from backend.services.cost_calculator import CostCalculator
+from backend.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY 通道名
+JOB_CHANNEL = "mcp_service_jobs"
+CANCEL_CHANNEL = "mcp_service_cancel"
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def make_worker_id(prefix: str = "worker") -> str:
+    """
+    生成当前进程的租约持有者标识
+
+    Args:
+        prefix: 标识前缀（如 worker / api）
+
+    Returns:
+        str: 形如 worker-hostname-1234 的标识
+    """
+    return f"{prefix}-{socket.gethostname()}-{os.getpid()}"
+
+
+def pending_job_filter(now: Optional[datetime] = None):
+    """
+    可认领任务的过滤条件
+
+    Args:
+        now: 当前时间（naive UTC），默认取系统时间
+
+    Returns:
+        SQLAlchemy 布尔表达式
+    """
+    now = now or _utcnow()
+    return and_(
+        MCPService.status == ServiceStatus.GENERATING,
+        or_(MCPService.code.is_(None), MCPService.code == ""),
+        or_(MCPService.lease_expires_at.is_(None), MCPService.lease_expires_at < now),
+        MCPService.attempt_count < settings.WORKER_MAX_ATTEMPTS,
+        # 已请求取消的任务不再认领，由回收器标记为 CANCELLED
+        MCPService.cancel_requested_at.is_(None),
+    )
+
+
+def tier_weight(tier: Optional[str]) -> float:
+    """
+    农户等级对应的队列权重
+
+    Args:
+        tier: 等级值（free/basic/professional）
+
+    Returns:
+        float: 权重，未知等级按 free 处理
+    """
+    tiers = CostCalculator.PRICING_TIERS
+    return float(tiers.get(tier, tiers["free"]).get("queue_weight", 1))
+
+
+def fair_share_ranking(now: Optional[datetime] = None):
+    """
+    加权公平排队的排序子查询
+
+    对每个农户所有未完成的生成任务（运行中 + 排队中）按"运行中优先、创建时间"编号，
+    虚拟完成时间 = 序号 / 等级权重。运行中的任务占用前面的序号，
+    因此已有任务在跑的农户，其排队任务会自然后移。
+
+    Returns:
+        Subquery: 列 id, virtual_finish
+    """
+    now = now or _utcnow()
+    running = and_(MCPService.lease_expires_at.is_not(None), MCPService.lease_expires_at >= now)
+    weight = case(
+        *[(Farmer.tier == tier, tier_weight(tier.value)) for tier in FarmerTier],
+        else_=tier_weight(None)
+    )
+    seq = func.row_number().over(
+        partition_by=MCPService.farmer_id,
+        order_by=(case((running, 0), else_=1), MCPService.created_at)
+    )
+    return (
+        select(
+            MCPService.id.label("id"),
+            (cast(seq, Float) / weight).label("virtual_finish"),
+        )
+        .join(Farmer, Farmer.id == MCPService.farmer_id)
+        .where(
+            MCPService.status == ServiceStatus.GENERATING,
+            or_(MCPService.code.is_(None), MCPService.code == ""),
+        )
+        .subquery("fair_share")
+    )
+
+
+async def claim_jobs(
+    session: AsyncSession,
+    worker_id: str,
+    limit: int = 1,
+    lease_seconds: Optional[int] = None
+) -> List[MCPService]:
+    """
+    认领待处理的生成任务
+
+    按加权公平排队顺序选取候选行，使用 FOR UPDATE SKIP LOCKED 锁定，
+    已被其他 Worker 锁定的行会被直接跳过。
+    认领成功后立即提交事务释放行锁，后续由租约保证独占。
+
+    Args:
+        session: 数据库会话
+        worker_id: 租约持有者标识
+        limit: 本次最多认领数量
+        lease_seconds: 租约时长（秒），默认 settings.WORKER_LEASE_SECONDS
+
+    Returns:
+        List[MCPService]: 已认领的任务
+    """
+    now = _utcnow()
+    lease_seconds = lease_seconds or settings.WORKER_LEASE_SECONDS
+
+    ranking = fair_share_ranking(now)
+    result = await session.execute(
+        select(MCPService)
+        .join(ranking, ranking.c.id == MCPService.id)
+        .where(pending_job_filter(now))
+        .order_by(ranking.c.virtual_finish, MCPService.created_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True, of=MCPService)
+    )
+    jobs = list(result.scalars().all())
+
+    for job in jobs:
+        job.lease_owner = worker_id
+        job.lease_expires_at = now + timedelta(seconds=lease_seconds)
+        job.attempt_count = (job.attempt_count or 0) + 1
+        job.updated_at = now
+
+    await session.commit()
+
+    if jobs:
+        logger.info(f"Worker {worker_id} claimed {len(jobs)} job(s): {[job.id for job in jobs]}")
+    return jobs
+
+
+async def estimate_queue_position(session: AsyncSession, service_id: str) -> Optional[Dict[str, int]]:
+    """
+    估算排队任务的位置与等待时间
+
+    等待时间 = ceil(位置 / 并发容量) * 近期平均生成耗时，
+    并发容量按当前持有租约的 Worker 数 * WORKER_MAX_IN_FLIGHT 估算。
+
+    Args:
+        session: 数据库会话
+        service_id: 服务ID
+
+    Returns:
+        Optional[Dict[str, int]]: {"queue_position", "estimated_wait_seconds"}；
+            任务不在队列中时返回 None，正在执行时位置为 0
+    """
+    now = _utcnow()
+    ranking = fair_share_ranking(now)
+    ordered = (
+        select(
+            MCPService.id,
+            func.row_number().over(order_by=(ranking.c.virtual_finish, MCPService.created_at)).label("position"),
+        )
+        .join(ranking, ranking.c.id == MCPService.id)
+        .where(pending_job_filter(now))
+        .subquery("ordered")
+    )
+    position = (
+        await session.execute(select(ordered.c.position).where(ordered.c.id == service_id))
+    ).scalar_one_or_none()
+
+    if position is None:
+        running = (
+            await session.execute(
+                select(MCPService.id).where(
+                    MCPService.id == service_id,
+                    MCPService.status == ServiceStatus.GENERATING,
+                    MCPService.lease_expires_at >= now,
+                )
+            )
+        ).scalar_one_or_none()
+        return {"queue_position": 0, "estimated_wait_seconds": 0} if running else None
+
+    workers = (
+        await session.execute(
+            select(func.count(func.distinct(MCPService.lease_owner))).where(
+                MCPService.status == ServiceStatus.GENERATING,
+                MCPService.lease_owner.like("worker-%"),
+                MCPService.lease_expires_at >= now,
+            )
+        )
+    ).scalar_one()
+    capacity = max(workers, 1) * settings.WORKER_MAX_IN_FLIGHT
+
+    recent = (
+        select(MCPService.generation_time)
+        .where(MCPService.generation_time.is_not(None))
+        .order_by(MCPService.updated_at.desc())
+        .limit(50)
+        .subquery()
+    )
+    avg_time = (await session.execute(select(func.avg(recent.c.generation_time)))).scalar_one()
+    avg_time = float(avg_time or 300)
+
+    rounds = (position + capacity - 1) // capacity
+    return {"queue_position": int(position), "estimated_wait_seconds": int(rounds * avg_time)}
+
+
+async def release_job(session: AsyncSession, service_id: str, worker_id: Optional[str] = None) -> bool:
+    """
+    释放任务租约（任务结束后调用，不提交事务）
+
+    Args:
+        session: 数据库会话
+        service_id: 服务ID
+        worker_id: 仅当租约仍由该持有者持有时才释放；None 表示无条件释放
+
+    Returns:
+        bool: 是否有记录被更新
+    """
+    stmt = update(MCPService).where(MCPService.id == service_id)
+    if worker_id is not None:
+        stmt = stmt.where(MCPService.lease_owner == worker_id)
+
+    result = await session.execute(
+        stmt.values(lease_owner=None, lease_expires_at=None)
+    )
+    return result.rowcount > 0
+
+
+async def heartbeat(
+    session: AsyncSession,
+    service_id: str,
+    worker_id: str,
+    lease_seconds: Optional[int] = None
+) -> str:
+    """
+    续约任务租约（不提交事务）
+
+    仅当租约仍由 worker_id 持有且任务仍在生成中时才会续约。
+
+    Args:
+        session: 数据库会话
+        service_id: 服务ID
+        worker_id: 租约持有者标识
+        lease_seconds: 续约时长（秒），默认 settings.WORKER_LEASE_SECONDS
+
+    Returns:
+        str: "alive" 续约成功；"cancel" 续约成功但已被请求取消；
+            "lost" 租约已丢失（被回收或任务已结束）
+    """
+    now = _utcnow()
+    lease_seconds = lease_seconds or settings.WORKER_LEASE_SECONDS
+    result = await session.execute(
+        update(MCPService)
+        .where(
+            MCPService.id == service_id,
+            MCPService.lease_owner == worker_id,
+            MCPService.status == ServiceStatus.GENERATING,
+        )
+        .values(lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now)
+        .returning(MCPService.cancel_requested_at)
+    )
+    row = result.first()
+    if row is None:
+        return "lost"
+    return "cancel" if row.cancel_requested_at is not None else "alive"
+
+
+async def request_cancel(session: AsyncSession, service_id: str) -> Optional[str]:
+    """
+    请求取消生成任务（提交事务）
+
+    - 尚未被认领（无有效租约）的任务直接标记为 CANCELLED
+    - 执行中的任务写入 cancel_requested_at 并在 CANCEL_CHANNEL 上通知持有者
+
+    Args:
+        session: 数据库会话
+        service_id: 服务ID
+
+    Returns:
+        Optional[str]: "cancelled" 已直接取消；"cancelling" 已通知持有者；
+            None 表示任务不在生成中
+    """
+    now = _utcnow()
+    queued = await session.execute(
+        update(MCPService)
+        .where(
+            MCPService.id == service_id,
+            MCPService.status == ServiceStatus.GENERATING,
+            or_(MCPService.lease_expires_at.is_(None), MCPService.lease_expires_at < now),
+        )
+        .values(
+            status=ServiceStatus.CANCELLED,
+            cancel_requested_at=now,
+            lease_owner=None,
+            lease_expires_at=None,
+            updated_at=now,
+        )
+    )
+    if queued.rowcount:
+        await session.commit()
+        return "cancelled"
+
+    running = await session.execute(
+        update(MCPService)
+        .where(MCPService.id == service_id, MCPService.status == ServiceStatus.GENERATING)
+        .values(cancel_requested_at=now, updated_at=now)
+    )
+    if not running.rowcount:
+        await session.rollback()
+        return None
+
+    await session.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": CANCEL_CHANNEL, "payload": service_id}
+    )
+    await session.commit()
+    return "cancelling"
+
+
+async def reap_stale_jobs(session: AsyncSession) -> Tuple[List[str], List[str]]:
+    """
+    回收心跳过期的任务（提交事务）
+
+    - 已请求取消：持有者未能记录取消（如进程崩溃），标记为 CANCELLED
+    - 尝试次数未超限：清空租约并发送 NOTIFY，由任意 Worker 重新认领
+    - 尝试次数已用尽：标记为 FAILED
+
+    Args:
+        session: 数据库会话
+
+    Returns:
+        Tuple[List[str], List[str]]: (重新入队的ID列表, 标记失败的ID列表)；标记取消的任务只记录日志
+    """
+    now = _utcnow()
+    cancelled = MCPService.cancel_requested_at.is_not(None)
+    exhausted = and_(MCPService.attempt_count >= settings.WORKER_MAX_ATTEMPTS, MCPService.cancel_requested_at.is_(None))
+
+    # 单条 UPDATE 同时处理取消、重新入队与失败三种情况
+    result = await session.execute(
+        update(MCPService)
+        .where(
+            MCPService.status == ServiceStatus.GENERATING,
+            or_(
+                and_(MCPService.lease_expires_at.is_not(None), MCPService.lease_expires_at < now),
+                # 租约已释放但尝试次数用尽或已请求取消的任务不会再被认领，也需要收尾
+                and_(MCPService.lease_expires_at.is_(None), or_(exhausted, cancelled)),
+            ),
+        )
+        .values(
+            status=case(
+                (cancelled, ServiceStatus.CANCELLED),
+                (exhausted, ServiceStatus.FAILED),
+                else_=MCPService.status
+            ),
+            total_errors=case(
+                (exhausted, func.coalesce(MCPService.total_errors, 0) + 1),
+                else_=MCPService.total_errors
+            ),
+            lease_owner=None,
+            lease_expires_at=None,
+            updated_at=now,
+        )
+        .returning(MCPService.id, MCPService.status)
+    )
+    rows = result.all()
+    failed_ids = [row.id for row in rows if row.status == ServiceStatus.FAILED]
+    cancelled_ids = [row.id for row in rows if row.status == ServiceStatus.CANCELLED]
+    requeued_ids = [row.id for row in rows if row.status == ServiceStatus.GENERATING]
+
+    for service_id in requeued_ids:
+        await notify_job_enqueued(session, service_id)
+
+    await session.commit()
+
+    if cancelled_ids:
+        logger.info(f"Marked {len(cancelled_ids)} stale job(s) with a cancel request as cancelled: {cancelled_ids}")
+    if failed_ids:
+        logger.warning(f"Marked {len(failed_ids)} job(s) as failed after {settings.WORKER_MAX_ATTEMPTS} attempts: {failed_ids}")
+    if requeued_ids:
+        logger.warning(f"Re-queued {len(requeued_ids)} job(s) with stale heartbeat: {requeued_ids}")
+    return requeued_ids, failed_ids
+
+
+class JobHeartbeat:
+    """
+    任务心跳（异步上下文管理器）
+
+    进入上下文后每隔 interval 秒续约一次；工作流在节点边界调用 beat() 可立即续约。
+    续约发现租约已丢失时取消进入上下文的任务，避免与新的持有者重复生成；
+    发现任务已被请求取消时同样取消本地执行，并置 cancel_requested 供调用方记录 CANCELLED。
+
+    用法：
+        async with JobHeartbeat(service_id, worker_id) as hb:
+            ...
+            hb.beat()
+    """
+
+    def __init__(
+        self,
+        service_id: str,
+        worker_id: str,
+        interval: Optional[int] = None,
+        lease_seconds: Optional[int] = None
+    ):
+        self.service_id = service_id
+        self.worker_id = worker_id
+        self.interval = interval or settings.WORKER_HEARTBEAT_SECONDS
+        self.lease_seconds = lease_seconds or settings.WORKER_LEASE_SECONDS
+        self.lost = False
+        self.cancel_requested = False
+        self._owner: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._pending: Optional[asyncio.Task] = None
+        self._last_beat = time.monotonic()
+
+    async def __aenter__(self) -> "JobHeartbeat":
+        self._owner = asyncio.current_task()
+        self._loop_task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        for task in (self._loop_task, self._pending):
+            if task and not task.done():
+                task.cancel()
+        await asyncio.gather(
+            *[t for t in (self._loop_task, self._pending) if t],
+            return_exceptions=True
+        )
+        return False
+
+    def beat(self):
+        """节点边界续约：距上次续约不足 interval/2 时跳过"""
+        if self.lost or self.cancel_requested or (self._pending and not self._pending.done()):
+            return
+        if time.monotonic() - self._last_beat < self.interval / 2:
+            return
+        self._pending = asyncio.create_task(self._beat_once())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._beat_once()
+
+    async def _beat_once(self):
+        self._last_beat = time.monotonic()
+        try:
+            async with AsyncSessionLocal() as session:
+                state = await heartbeat(session, self.service_id, self.worker_id, self.lease_seconds)
+                await session.commit()
+        except Exception as e:
+            # 数据库抖动不视为租约丢失，下一次心跳重试
+            logger.warning(f"Heartbeat for {self.service_id} failed: {e}")
+            return
+
+        if state == "lost" and not self.lost:
+            self.lost = True
+            logger.warning(f"Lease on {self.service_id} lost by {self.worker_id}, cancelling local run")
+            self._cancel_owner()
+        elif state == "cancel" and not self.cancel_requested:
+            self.cancel_requested = True
+            logger.info(f"Cancellation requested for {self.service_id}, cancelling local run")
+            self._cancel_owner()
+
+    def _cancel_owner(self):
+        if self._owner and not self._owner.done():
+            self._owner.cancel()
+
+
+async def notify_job_enqueued(session: AsyncSession, service_id: str):
+    """
+    在当前事务内发送入队通知（事务提交时才会真正投递，不提交事务）
+
+    Args:
+        session: 数据库会话
+        service_id: 服务ID
+    """
+    await session.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": JOB_CHANNEL, "payload": service_id}
+    )
+
+
+class JobNotificationListener:
+    """
+    基于 LISTEN 的任务唤醒器
+
+    Worker 主循环调用 wait() 阻塞，直到收到入队通知、本地 wake() 或兜底超时。
+    同一连接还监听取消通道，收到取消通知时调用 on_cancel(service_id)。
+    监听连接断开时会在下一次 wait() 中自动重连，重连失败则退化为定时轮询。
+    """
+
+    def __init__(self, channel: str = JOB_CHANNEL, dsn: Optional[str] = None):
+        self.channel = channel
+        self.dsn = dsn or settings.DATABASE_URL
+        self.on_cancel: Optional[Callable[[str], None]] = None
+        self._conn: Optional[asyncpg.Connection] = None
+        self._event = asyncio.Event()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        logger.debug(f"Received NOTIFY on {channel}: {payload}")
+        self._event.set()
+
+    def _on_cancel_notify(self, connection, pid, channel, payload):
+        if self.on_cancel:
+            self.on_cancel(payload)
+
+    def wake(self):
+        """本地唤醒（如任务池释放了槽位、收到退出信号）"""
+        self._event.set()
+
+    async def _ensure_connected(self):
+        if self._conn is not None and not self._conn.is_closed():
+            return
+        try:
+            self._conn = await asyncpg.connect(self.dsn)
+            await self._conn.add_listener(self.channel, self._on_notify)
+            await self._conn.add_listener(CANCEL_CHANNEL, self._on_cancel_notify)
+            logger.info(f"Listening on channel '{self.channel}'")
+            # 重连期间可能错过通知，立即触发一次扫描
+            self._event.set()
+        except Exception as e:
+            self._conn = None
+            logger.warning(f"LISTEN unavailable, falling back to polling: {e}")
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        等待下一次唤醒
+
+        Args:
+            timeout: 兜底超时（秒）
+
+        Returns:
+            bool: True 表示被通知唤醒，False 表示超时
+        """
+        await self._ensure_connected()
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._event.clear()
+
+    async def close(self):
+        if self._conn is not None and not self._conn.is_closed():
+            await self._conn.close()
+        self._conn = None
+
+
+__all__ = [
+    "JOB_CHANNEL",
+    "CANCEL_CHANNEL",
+    "make_worker_id",
+    "pending_job_filter",
+    "tier_weight",
+    "fair_share_ranking",
+    "claim_jobs",
+    "estimate_queue_position",
+    "release_job",
+    "heartbeat",
+    "request_cancel",
+    "reap_stale_jobs",
+    "JobHeartbeat",
+    "notify_job_enqueued",
+    "JobNotificationListener",
+]
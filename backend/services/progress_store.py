@@ -0,0 +1,270 @@
+"""
+生成进度存储
+记录工作流真实的节点级进度，并向前端推送进度事件
+
+ServiceManager 以 astream(stream_mode="updates") 驱动工作流，每个节点完成时：
+- 更新进度快照（当前阶段、已完成节点及耗时），状态查询直接读取快照，不再访问数据库
+- 通过 publish() 推送事件到 WebSocket 订阅者
+
+支持的后端（settings.PROGRESS_STORE_BACKEND）：
+- memory: 进程内字典，仅本进程执行的任务可见（单进程部署）
+- redis:  快照写入 Redis 并通过 PUBLISH 广播，API 进程订阅后转发到 WebSocket，
+          worker_daemon 执行的任务同样可以实时推送
+
+进程池执行器的子进程通过 set_relay() 把快照与事件交给父进程，由父进程的 apply_relayed() 落地。
+"""
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from backend.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Redis 频道与键前缀
+PROGRESS_CHANNEL = "mcp_service_progress"
+PROGRESS_KEY_PREFIX = "mcp_service_progress:"
+
+# 节点所属阶段
+NODE_STAGES = {
+    "load_input": "planning",
+    "swe_generate": "coding",
+    "human_confirmation": "coding",
+    "server_test": "testing",
+    "refine_code": "refining",
+    "error_handler": "refining",
+    "error_recovery": "refining",
+    "statistics_logger": "finalizing",
+}
+
+# 节点完成时至少达到的进度（测试/优化循环不会回退进度）
+NODE_MILESTONES = {
+    "load_input": 5,
+    "swe_generate": 55,
+    "human_confirmation": 55,
+    "server_test": 75,
+    "refine_code": 90,
+    "error_handler": 90,
+    "error_recovery": 90,
+    "statistics_logger": 99,
+}
+
+STAGE_MESSAGES = {
+    "planning": "MCPybarra正在分析需求并规划工具...",
+    "coding": "MCPybarra正在生成服务代码...",
+    "testing": "MCPybarra正在测试服务...",
+    "refining": "MCPybarra正在根据测试结果优化代码...",
+    "finalizing": "MCPybarra正在汇总生成报告...",
+}
+
+
+def _next_stage(node: str, update: Optional[Dict[str, Any]]) -> str:
+    """根据节点输出的 next_step 推断下一阶段"""
+    next_step = (update or {}).get("next_step")
+    if next_step in NODE_STAGES:
+        return NODE_STAGES[next_step]
+    if next_step in ("end", "__end__"):
+        return "finalizing"
+    return NODE_STAGES.get(node, "coding")
+
+
+class ProgressStore:
+    """节点级进度快照与事件推送"""
+
+    def __init__(self, backend: Optional[str] = None, ttl_seconds: Optional[int] = None):
+        self.backend = (backend or settings.PROGRESS_STORE_BACKEND or "memory").lower()
+        self.ttl_seconds = ttl_seconds or settings.PROGRESS_TTL_SECONDS
+        self._snapshots: Dict[str, Dict[str, Any]] = {}
+        self._redis = None
+        self._relay: Optional[Callable[[str, Dict[str, Any]], None]] = None
+
+    def set_relay(self, relay: Optional[Callable[[str, Dict[str, Any]], None]]):
+        """设置中继（子进程中使用）：快照、事件与清理都交给 relay(kind, payload)"""
+        self._relay = relay
+
+    @property
+    def distributed(self) -> bool:
+        return self.backend == "redis"
+
+    def _get_redis(self):
+        if self._redis is None:
+            import redis.asyncio as aioredis
+            self._redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+        return self._redis
+
+    async def _save(self, snapshot: Dict[str, Any]):
+        service_id = snapshot["service_id"]
+        self._snapshots[service_id] = snapshot
+        if self._relay is not None:
+            self._relay("snapshot", snapshot)
+        elif self.distributed:
+            try:
+                await self._get_redis().set(
+                    PROGRESS_KEY_PREFIX + service_id,
+                    json.dumps(snapshot, ensure_ascii=False),
+                    ex=self.ttl_seconds,
+                )
+            except Exception as e:
+                logger.warning(f"Failed to save progress of {service_id}: {e}")
+
+    async def start(self, service_id: str) -> Dict[str, Any]:
+        """
+        开始记录任务进度
+
+        Returns:
+            Dict: 初始快照
+        """
+        now = time.time()
+        snapshot = {
+            "service_id": service_id,
+            "progress": 1,
+            "current_stage": "planning",
+            "current_node": None,
+            "message": STAGE_MESSAGES["planning"],
+            "nodes": [],
+            "started_at": now,
+            "updated_at": now,
+        }
+        await self._save(snapshot)
+        return snapshot
+
+    async def record_node(
+        self,
+        service_id: str,
+        node: str,
+        update: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        记录一个节点完成
+
+        Args:
+            service_id: 服务ID
+            node: 完成的节点名
+            update: 节点输出的状态更新
+
+        Returns:
+            Dict: 更新后的快照
+        """
+        snapshot = self._snapshots.get(service_id) or await self.start(service_id)
+        now = time.time()
+        nodes: List[Dict[str, Any]] = snapshot["nodes"]
+        previous_end = nodes[-1]["finished_at"] if nodes else snapshot["started_at"]
+
+        nodes.append({
+            "node": node,
+            "stage": NODE_STAGES.get(node, "coding"),
+            "finished_at": now,
+            "duration_ms": round((now - previous_end) * 1000, 1),
+        })
+        stage = _next_stage(node, update)
+        snapshot.update({
+            "progress": max(snapshot["progress"], NODE_MILESTONES.get(node, snapshot["progress"])),
+            "current_stage": stage,
+            "current_node": node,
+            "message": STAGE_MESSAGES.get(stage, snapshot["message"]),
+            "updated_at": now,
+        })
+        await self._save(snapshot)
+        return snapshot
+
+    async def get(self, service_id: str) -> Optional[Dict[str, Any]]:
+        """读取进度快照（本进程优先，其次 Redis）"""
+        snapshot = self._snapshots.get(service_id)
+        if snapshot is not None or not self.distributed:
+            return snapshot
+        try:
+            raw = await self._get_redis().get(PROGRESS_KEY_PREFIX + service_id)
+        except Exception as e:
+            logger.warning(f"Failed to read progress of {service_id}: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    async def finish(self, service_id: str):
+        """任务结束，清理快照"""
+        self._snapshots.pop(service_id, None)
+        if self._relay is not None:
+            self._relay("finish", {"service_id": service_id})
+        elif self.distributed:
+            try:
+                await self._get_redis().delete(PROGRESS_KEY_PREFIX + service_id)
+            except Exception as e:
+                logger.warning(f"Failed to clear progress of {service_id}: {e}")
+
+    async def publish(self, service_id: str, event: Dict[str, Any]):
+        """
+        推送进度事件
+
+        memory 后端直接推送到本进程的 WebSocket；redis 后端广播到订阅的 API 进程。
+        """
+        if self._relay is not None:
+            self._relay("event", {"service_id": service_id, "event": event})
+            return
+
+        if self.distributed:
+            try:
+                message = json.dumps({"service_id": service_id, "event": event}, ensure_ascii=False)
+                await self._get_redis().publish(PROGRESS_CHANNEL, message)
+                return
+            except Exception as e:
+                logger.warning(f"Failed to publish progress of {service_id}: {e}")
+
+        try:
+            from backend.api.main import notify_service_progress
+            await notify_service_progress(service_id, event)
+        except Exception as e:
+            logger.warning(f"Failed to send WebSocket notification: {e}")
+
+    async def apply_relayed(self, kind: str, payload: Dict[str, Any]):
+        """在父进程中落地子进程中继过来的快照/事件/清理"""
+        if kind == "snapshot":
+            await self._save(payload)
+        elif kind == "event":
+            await self.publish(payload["service_id"], payload["event"])
+        elif kind == "finish":
+            await self.finish(payload["service_id"])
+
+    async def forward(self, callback: Callable[[str, Dict[str, Any]], Awaitable[None]]):
+        """
+        订阅 Redis 进度频道并转发到 callback（API 进程后台任务，仅 redis 后端）
+
+        连接断开时等待后重新订阅。
+        """
+        if not self.distributed:
+            return
+        while True:
+            pubsub = self._get_redis().pubsub()
+            try:
+                await pubsub.subscribe(PROGRESS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    payload = json.loads(message["data"])
+                    await callback(payload["service_id"], payload["event"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Progress subscription lost: {e}, retrying")
+                await asyncio.sleep(5)
+            finally:
+                await pubsub.aclose()
+
+    async def close(self):
+        """关闭 Redis 连接"""
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+# 进程内单例
+progress_store = ProgressStore()
+
+
+__all__ = [
+    "ProgressStore",
+    "progress_store",
+    "NODE_STAGES",
+    "NODE_MILESTONES",
+    "PROGRESS_CHANNEL",
+]
@@ -164,14 +164,15 @@ class QualityMonitor:
 """
             
             # 启动新的生成任务
-            from backend.services.service_manager import ServiceManager
-            service_manager = ServiceManager()
+            from backend.services.workflow_registry import get_service_manager
+            service_manager = get_service_manager()
             
             new_task_id = await service_manager.start_generation(
                 user_input=enhanced_requirement,
                 farmer_id=service.farmer_id,
                 model=service.model_used,
-                request_id=f"auto_refine_{service_id}"
+                request_id=f"auto_refine_{service_id}",
+                force_regenerate=True
             )
             
             # 标记新服务为优化版本
@@ -381,6 +382,72 @@ class QualityMonitor:
             metrics['p99_latency'] <= self.THRESHOLDS['p99_latency']
         )
 
+    async def find_degraded_services(self, window: str = "1h", min_requests: int = 5) -> List[dict]:
+        """
+        批量找出质量不达标的已部署服务
+
+        单条聚合查询完成所有已部署服务的错误率/P99延迟计算，
+        开销与服务数量无关（不逐个加载日志）。
+        
+        Args:
+            window: 时间窗口(1h, 6h, 24h, 7d)
+            min_requests: 请求量低于该值的服务不参与判断
+            
+        Returns:
+            List[dict]: 不达标服务的指标列表
+        """
+        from sqlalchemy import select, func, case, or_
+        
+        start_time = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(
+            seconds=self._parse_time_window(window)
+        )
+        total = func.count(ServiceLog.id)
+        error_rate = func.avg(case((ServiceLog.status == "error", 1.0), else_=0.0))
+        p99_latency = func.percentile_cont(0.99).within_group(ServiceLog.latency)
+        
+        stmt = (
+            select(
+                ServiceLog.service_id,
+                total.label("total_requests"),
+                error_rate.label("error_rate"),
+                p99_latency.label("p99_latency"),
+            )
+            .join(MCPService, MCPService.id == ServiceLog.service_id)
+            .where(
+                MCPService.status == ServiceStatus.DEPLOYED,
+                ServiceLog.created_at >= start_time
+            )
+            .group_by(ServiceLog.service_id)
+            .having(
+                total >= min_requests,
+                or_(
+                    error_rate > self.THRESHOLDS["error_rate"],
+                    p99_latency > self.THRESHOLDS["p99_latency"]
+                )
+            )
+        )
+        
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(stmt)
+            degraded = [
+                {
+                    "service_id": row.service_id,
+                    "window": window,
+                    "total_requests": row.total_requests,
+                    "error_rate": round(float(row.error_rate or 0), 4),
+                    "p99_latency": round(float(row.p99_latency or 0), 2),
+                }
+                for row in result.all()
+            ]
+        
+        for metrics in degraded:
+            logger.warning(
+                f"Service {metrics['service_id']} quality check failed. "
+                f"Error rate: {metrics['error_rate']*100:.1f}%, "
+                f"P99 latency: {metrics['p99_latency']:.0f}ms"
+            )
+        return degraded
+    
     async def check_service_quality(self, service_id: str) -> bool:
         """
         检查服务质量是否达标
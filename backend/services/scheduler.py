@@ -0,0 +1,187 @@
+"""
+Worker维护任务调度器
+在 worker_daemon 主循环中驱动周期性维护任务
+
+设计要点：
+- 类 cron 调度：固定间隔或对齐到间隔整数倍（如每日 UTC 0 点），叠加随机抖动避免多副本同时触发
+- 领导者选举：通过 Postgres 会话级 advisory lock，只有持锁副本执行 leader_only 任务
+- 每个任务记录执行次数、失败次数与耗时指标
+"""
+import time
+import random
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import asyncpg
+
+from backend.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# advisory lock 键（任意固定的 64 位整数，所有 Worker 副本一致）
+MAINTENANCE_LOCK_KEY = 0x5A4E_4D43_5000_0001
+
+
+@dataclass
+class ScheduledJob:
+    """周期性任务定义与运行指标"""
+    name: str
+    func: Callable[[], Awaitable[Any]]
+    interval_seconds: float
+    jitter_seconds: float = 0.0
+    align: bool = False          # 对齐到 interval 的整数倍（基于 UTC 时间戳）
+    leader_only: bool = True     # 仅领导者副本执行
+    run_on_start: bool = False   # 启动后立即执行一次
+
+    next_run: float = 0.0
+    runs: int = 0
+    failures: int = 0
+    last_duration: float = 0.0
+    max_duration: float = 0.0
+    total_duration: float = 0.0
+    last_error: Optional[str] = field(default=None, repr=False)
+
+    def schedule_next(self, now: float):
+        """计算下一次执行时间（wall clock 秒）"""
+        if self.align:
+            base = (now // self.interval_seconds + 1) * self.interval_seconds
+        else:
+            base = now + self.interval_seconds
+        self.next_run = base + random.uniform(0, self.jitter_seconds)
+
+    def record(self, duration: float, error: Optional[Exception] = None):
+        """记录一次执行结果"""
+        self.runs += 1
+        self.last_duration = duration
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        if error is not None:
+            self.failures += 1
+            self.last_error = str(error)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_duration_ms": round(self.last_duration * 1000, 2),
+            "avg_duration_ms": round(self.total_duration / self.runs * 1000, 2) if self.runs else 0.0,
+            "max_duration_ms": round(self.max_duration * 1000, 2),
+            "next_run_in": round(max(self.next_run - time.time(), 0), 1),
+        }
+
+
+class MaintenanceScheduler:
+    """
+    维护任务调度器
+
+    用法：
+        scheduler = MaintenanceScheduler()
+        scheduler.add_job("reap", reap_func, interval_seconds=15, jitter_seconds=5)
+        while running:
+            await scheduler.run_pending()
+            await wait(min(poll, scheduler.seconds_until_next()))
+    """
+
+    def __init__(self, lock_key: int = MAINTENANCE_LOCK_KEY, dsn: Optional[str] = None):
+        self.lock_key = lock_key
+        self.dsn = dsn or settings.DATABASE_URL
+        self.jobs: List[ScheduledJob] = []
+        self.is_leader = False
+        self._lock_conn: Optional[asyncpg.Connection] = None
+
+    def add_job(self, name: str, func: Callable[[], Awaitable[Any]], interval_seconds: float, **kwargs) -> ScheduledJob:
+        """注册周期性任务"""
+        job = ScheduledJob(name=name, func=func, interval_seconds=interval_seconds, **kwargs)
+        now = time.time()
+        if job.run_on_start:
+            job.next_run = now + random.uniform(0, job.jitter_seconds)
+        else:
+            job.schedule_next(now)
+        self.jobs.append(job)
+        return job
+
+    async def _ensure_leadership(self) -> bool:
+        """
+        尝试获取/确认领导权
+
+        advisory lock 绑定在专用连接上，连接断开即自动释放，其他副本可接管。
+        """
+        if self._lock_conn is not None and not self._lock_conn.is_closed():
+            return self.is_leader
+
+        self.is_leader = False
+        try:
+            if self._lock_conn is None or self._lock_conn.is_closed():
+                self._lock_conn = await asyncpg.connect(self.dsn)
+            self.is_leader = await self._lock_conn.fetchval(
+                "SELECT pg_try_advisory_lock($1)", self.lock_key
+            )
+            if self.is_leader:
+                logger.info("Acquired maintenance leadership")
+            else:
+                # 未拿到锁则释放连接，下次到期再重试
+                await self._lock_conn.close()
+                self._lock_conn = None
+        except Exception as e:
+            logger.warning(f"Leader election failed: {e}")
+            self._lock_conn = None
+        return self.is_leader
+
+    def seconds_until_next(self) -> float:
+        """距离最近一个到期任务的秒数"""
+        if not self.jobs:
+            return float("inf")
+        return max(min(job.next_run for job in self.jobs) - time.time(), 0.0)
+
+    async def run_pending(self) -> int:
+        """
+        执行所有到期任务
+
+        Returns:
+            int: 本次执行的任务数
+        """
+        now = time.time()
+        due = [job for job in self.jobs if job.next_run <= now]
+        if not due:
+            return 0
+
+        if any(job.leader_only for job in due):
+            await self._ensure_leadership()
+
+        executed = 0
+        for job in due:
+            job.schedule_next(now)
+            if job.leader_only and not self.is_leader:
+                continue
+
+            started = time.perf_counter()
+            error = None
+            try:
+                await job.func()
+            except Exception as e:
+                error = e
+                logger.error(f"Scheduled job '{job.name}' failed: {e}", exc_info=True)
+            duration = time.perf_counter() - started
+            job.record(duration, error)
+            executed += 1
+            logger.debug(f"Scheduled job '{job.name}' finished in {duration * 1000:.1f}ms")
+
+        return executed
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """所有任务的指标快照"""
+        return {job.name: job.stats() for job in self.jobs}
+
+    async def close(self):
+        """释放领导权"""
+        if self._lock_conn is not None and not self._lock_conn.is_closed():
+            try:
+                await self._lock_conn.execute("SELECT pg_advisory_unlock($1)", self.lock_key)
+            finally:
+                await self._lock_conn.close()
+        self._lock_conn = None
+        self.is_leader = False
+
+
+__all__ = ["ScheduledJob", "MaintenanceScheduler", "MAINTENANCE_LOCK_KEY"]
@@ -13,13 +13,29 @@ import logging
 import sys
 import importlib
 from typing import Optional, Dict, Any, List
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 from backend.models.mcp_service import MCPService, ServiceStatus
 from backend.models.farmer import Farmer
 from backend.database.connection import AsyncSessionLocal
 from backend.config.settings import settings
+from backend.services.job_queue import (
+    make_worker_id,
+    heartbeat,
+    release_job,
+    notify_job_enqueued,
+    estimate_queue_position,
+    request_cancel,
+    JobHeartbeat,
+)
+from backend.services.generation_cache import generation_cache, compute_cache_key
+from backend.services.workflow_checkpoint import get_checkpointer, delete_thread
+from backend.services.progress_store import progress_store
+from backend.services.generation_executor import get_generation_executor
+from backend.services import service_templates
+from backend.services.cost_calculator import CostCalculator
+from langchain_core.callbacks import AsyncCallbackHandler
 
 logger = logging.getLogger(__name__)
 
@@ -157,6 +173,25 @@ class PromptBuilder:
         
         return f"为{farmer_name}的{product_name}创建电商服务接口。"
     
+    @staticmethod
+    def product_mask_values(product_info: Dict[str, Any], farmer_name: str) -> List[str]:
+        """
+        提示词中的产品字段（固定顺序），规划缓存据此屏蔽产品差异并在命中时替换回当前产品
+        
+        Returns:
+            List[str]: 产品名、单价、库存、描述、产地、认证、农户名
+        """
+        certifications = product_info.get("certifications")
+        return [
+            str(product_info.get("name") or ""),
+            str(product_info.get("price") if product_info.get("price") is not None else ""),
+            str(product_info.get("stock") if product_info.get("stock") is not None else ""),
+            product_info.get("description") or "",
+            product_info.get("origin") or "",
+            ", ".join(certifications) if certifications else "",
+            farmer_name or "",
+        ]
+    
     @staticmethod
     def build_custom_service_prompt(user_input: str, farmer_name: str) -> str:
         """构造自定义服务提示词"""
@@ -263,6 +298,7 @@ class MockCompiledWorkflow:
             "requirements_content": "fastapi>=0.100.0\nuvicorn>=0.23.0",
             "test_report_content": "All tests passed (mock)",
             "deliverability_assessment": "DELIVERABLE",
+            "mock_output": True,
             "statistics_summary": {
                 "total_cost": 0.05,
                 "total_tokens": 1000,
@@ -272,6 +308,10 @@ class MockCompiledWorkflow:
             "next_step": "end"
         }
     
+    async def astream(self, state: Dict[str, Any], config: Optional[Dict] = None, stream_mode: str = "updates"):
+        """流式执行（模拟，整个流程作为单个节点输出）"""
+        yield {"mock_workflow": await self.ainvoke(state, config)}
+    
     def invoke(self, state: Dict[str, Any], config: Optional[Dict] = None) -> Dict[str, Any]:
         """同步执行"""
         return asyncio.get_event_loop().run_until_complete(self.ainvoke(state, config))
@@ -460,6 +500,14 @@ if __name__ == "__main__":
 '''
 
 
+def _track_run_usage() -> Dict[str, float]:
+    """开始统计当前任务的LLM用量（MCPybarra不可用时返回空统计）"""
+    try:
+        return importlib.import_module("mcp_swe_flow.config").track_run_usage()
+    except Exception:
+        return {"llm_calls": 0, "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+
+
 def _create_workflow():
     """创建工作流实例"""
     if MCPYBARRA_AVAILABLE and create_mcp_swe_workflow:
@@ -471,6 +519,16 @@ def _create_workflow():
     return MockCompiledWorkflow()
 
 
+class NodeHeartbeatHandler(AsyncCallbackHandler):
+    """在LangGraph节点边界续约任务租约"""
+    
+    def __init__(self, heartbeat: JobHeartbeat):
+        self.heartbeat = heartbeat
+    
+    async def on_chain_start(self, serialized, inputs, **kwargs):
+        self.heartbeat.beat()
+
+
 # ============================================
 # 服务管理器
 # ============================================
@@ -478,9 +536,15 @@ def _create_workflow():
 class ServiceManager:
     """MCP服务管理器"""
     
-    def __init__(self):
-        self.workflow = _create_workflow()
+    def __init__(self, workflow=None):
+        # 通常由 workflow_registry 传入进程共享的已编译工作流
+        self.workflow = workflow if workflow is not None else _create_workflow()
         self.active_tasks: Dict[str, asyncio.Task] = {}
+        self.worker_id = make_worker_id("api")
+        self._runnable = None
+        self._cancel_requested: set = set()
+        self._batch_tasks: set = set()
+        self._batch_slots: Optional[asyncio.Semaphore] = None
         logger.info(f"ServiceManager initialized with {type(self.workflow).__name__}")
     
     async def generate_product_service(
@@ -489,7 +553,8 @@ class ServiceManager:
         product_info: Dict[str, Any],
         service_type: str = "full",
         model: Optional[str] = None,
-        request_id: Optional[str] = None
+        request_id: Optional[str] = None,
+        force_regenerate: bool = False
     ) -> str:
         """
         为产品生成MCP服务（核心入口方法）
@@ -500,6 +565,7 @@ class ServiceManager:
             service_type: 服务类型 (full/query/order/traceability)
             model: LLM模型
             request_id: 请求追踪ID
+            force_regenerate: 跳过生成结果缓存，强制执行完整工作流
         
         Returns:
             str: 任务ID
@@ -526,34 +592,128 @@ class ServiceManager:
         
         logger.info(f"Built prompt for product '{product_info.get('name')}': {prompt[:100]}...")
         
+        # 标准服务优先走模板快速通道，失败时回退到工作流
+        task_id = await self._try_template_fast_path(
+            farmer_id, farmer_name, product_info, service_type, prompt, request_id
+        )
+        if task_id:
+            return task_id
+        
         return await self.start_generation(
             user_input=prompt,
             farmer_id=farmer_id,
             product_category=product_info.get("category"),
             model=model,
-            request_id=request_id
+            request_id=request_id,
+            plan_mask_values=PromptBuilder.product_mask_values(product_info, farmer_name),
+            force_regenerate=force_regenerate
         )
     
-    async def start_generation(
+    async def _try_template_fast_path(
         self,
-        user_input: str,
         farmer_id: str,
-        product_category: Optional[str] = None,
-        model: Optional[str] = None,
+        farmer_name: str,
+        product_info: Dict[str, Any],
+        service_type: str,
+        prompt: str,
         request_id: Optional[str] = None
-    ) -> str:
-        """启动异步服务生成任务"""
+    ) -> Optional[str]:
+        """
+        由服务模板直接生成 query/order/traceability 服务（不调用LLM）
+        
+        Returns:
+            Optional[str]: 任务ID；未启用、不支持该服务类型或检查未通过时返回 None
+        """
+        if not settings.ENABLE_TEMPLATE_FAST_PATH or not service_templates.supports(service_type):
+            return None
+        
+        started = datetime.now(timezone.utc).replace(tzinfo=None)
         task_id = f"service_{farmer_id}_{uuid.uuid4().hex[:8]}"
+        output_dir = (
+            Path(settings.WORKSPACE_DIR) / "pipeline-output-servers"
+            / service_templates.TEMPLATE_MODEL / task_id
+        )
+        try:
+            result = await service_templates.synthesize(service_type, product_info, farmer_name, output_dir)
+        except Exception as e:
+            logger.warning(f"[{request_id}] Template fast path failed for '{product_info.get('name')}': {e}", exc_info=True)
+            return None
+        if not result["passed"]:
+            logger.warning(
+                f"[{request_id}] Template checks failed for '{product_info.get('name')}', falling back to workflow:\n"
+                f"{result['test_report']}"
+            )
+            return None
         
-        model_name = model or settings.DEFAULT_SWE_MODEL
-        output_base = Path(settings.WORKSPACE_DIR) / "pipeline-output-servers" / model_name / task_id
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        async with AsyncSessionLocal() as db:
+            service = MCPService(
+                id=task_id,
+                farmer_id=farmer_id,
+                name=result["api_name"],
+                description=prompt[:200],
+                original_requirement=prompt,
+                model_used=service_templates.TEMPLATE_MODEL,
+                status=ServiceStatus.READY,
+                file_path=result["file_path"],
+                code=result["code"],
+                readme=result["readme"],
+                requirements=result["requirements"],
+                test_report=result["test_report"],
+                test_pass_rate=result["test_pass_rate"],
+                quality_score=85.0,
+                generation_cost=0.0,
+                generation_time=int((now - started).total_seconds()),
+                attempt_count=0,
+                created_at=now
+            )
+            db.add(service)
+            
+            from sqlalchemy import select
+            farmer_result = await db.execute(select(Farmer).where(Farmer.id == farmer_id))
+            farmer_result.scalar_one().services_count += 1
+            await db.commit()
+        
+        logger.info(f"[{request_id}] Generated {task_id} from {service_type} template {service_templates.template_version()}")
+        await self._notify_completion(task_id, success=True, cost=0.0)
+        return task_id
+
+    @staticmethod
+    def _output_dir(model_name: str, task_id: str) -> Path:
+        """服务产物输出目录（每个服务独立）"""
+        return Path(settings.WORKSPACE_DIR) / "pipeline-output-servers" / model_name / task_id
+
+    def build_initial_state(
+        self,
+        user_input: str,
+        model_name: str,
+        task_id: str,
+        shared_plan: Optional[str] = None,
+        plan_mask_values: Optional[List[str]] = None,
+        race_models: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        构造工作流初始状态（严格按照MCPybarra的state.py）
         
-        # 准备初始状态（严格按照MCPybarra的state.py）
-        initial_state = {
+        Args:
+            user_input: 用户需求/提示词
+            model_name: 生成模型
+            task_id: 任务ID（同时作为检查点 thread_id）
+            shared_plan: 批量生成时同组共享的开发计划（跳过规划阶段）
+            plan_mask_values: 产品字段，规划缓存键中屏蔽这些值
+            race_models: 参与竞速生成的模型（含 model_name），None 表示不竞速
+        """
+        output_base = self._output_dir(model_name, task_id)
+        
+        return {
             "user_input": user_input,
             "api_name": None,
             "interactive_mode": False,
             "model_name": model_name,
+            "swe_model": model_name,
+            "shared_plan": shared_plan,
+            "plan_mask_values": plan_mask_values,
+            "race_models": race_models,
             "resources_dir": str(Path(settings.WORKSPACE_DIR) / "resources"),
             "output_dir": str(output_base),
             "refinement_dir": str(Path(settings.WORKSPACE_DIR) / "refinement"),
@@ -569,8 +729,33 @@ class ServiceManager:
             "error": None,
             "next_step": "input_loader"
         }
+    
+    async def _create_service_record(
+        self,
+        user_input: str,
+        farmer_id: str,
+        product_category: Optional[str],
+        model_name: str,
+        lease: bool,
+        enqueue: bool = True,
+        request_id: Optional[str] = None,
+        force_regenerate: bool = False
+    ):
+        """
+        创建服务记录（命中生成结果缓存时直接置为 READY）
         
-        # 创建数据库记录
+        Args:
+            lease: 是否由本进程持有租约（否则留给 worker_daemon 认领）
+            enqueue: 是否为未持有租约的任务发送入队通知
+            force_regenerate: 跳过缓存查询
+        
+        Returns:
+            Tuple[str, Optional[GenerationCacheEntry]]: 任务ID与命中的缓存条目
+        """
+        task_id = f"service_{farmer_id}_{uuid.uuid4().hex[:8]}"
+        cache_key = compute_cache_key(user_input, model_name)
+        
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
         async with AsyncSessionLocal() as db:
             service = MCPService(
                 id=task_id,
@@ -580,8 +765,25 @@ class ServiceManager:
                 original_requirement=user_input,
                 model_used=model_name,
                 status=ServiceStatus.GENERATING,
-                created_at=datetime.now(timezone.utc).replace(tzinfo=None)
+                cache_key=cache_key,
+                attempt_count=0,
+                created_at=now
             )
+            if lease:
+                # 由本机直接执行，先持有租约，避免 worker_daemon 重复认领
+                service.lease_owner = self.worker_id
+                service.lease_expires_at = now + timedelta(seconds=settings.WORKER_LEASE_SECONDS)
+                service.attempt_count = 1
+            
+            # 命中生成结果缓存：直接克隆产物，不再执行工作流
+            cached = None if force_regenerate else await generation_cache.lookup(db, cache_key)
+            if cached:
+                await generation_cache.apply_to_service(cached, service, self._output_dir(model_name, task_id))
+                service.status = ServiceStatus.READY
+                service.generation_cost = 0.0
+                service.generation_time = 0
+                service.lease_owner = None
+                service.lease_expires_at = None
             db.add(service)
             
             from sqlalchemy import select
@@ -589,36 +791,395 @@ class ServiceManager:
             farmer = result.scalar_one()
             farmer.services_count += 1
             
+            # 本进程持有租约的任务不需要唤醒 worker_daemon（它也认领不到）
+            if enqueue and not cached and not lease:
+                await notify_job_enqueued(db, task_id)
             await db.commit()
             logger.info(f"Created service record: {task_id}")
         
-        # 后台启动工作流
-        task = asyncio.create_task(self._execute_workflow(task_id, initial_state, request_id))
-        self.active_tasks[task_id] = task
+        if cached:
+            logger.info(f"[{request_id}] Generation cache hit for {task_id} (source: {cached.source_service_id})")
+            await self._notify_completion(task_id, success=True, cost=0.0)
+        return task_id, cached
+    
+    async def start_generation(
+        self,
+        user_input: str,
+        farmer_id: str,
+        product_category: Optional[str] = None,
+        model: Optional[str] = None,
+        request_id: Optional[str] = None,
+        plan_mask_values: Optional[List[str]] = None,
+        force_regenerate: bool = False
+    ) -> str:
+        """启动异步服务生成任务（force_regenerate 为 True 时不查询生成结果缓存）"""
+        model_name = model or settings.DEFAULT_SWE_MODEL
+        executor = get_generation_executor()
+        
+        task_id, cached = await self._create_service_record(
+            user_input, farmer_id, product_category, model_name,
+            lease=executor.leases_locally, request_id=request_id,
+            force_regenerate=force_regenerate
+        )
+        if cached:
+            return task_id
+        
+        # 按配置的执行器启动工作流（进程内 / 子进程池 / 外部 Worker）
+        initial_state = self.build_initial_state(
+            user_input, model_name, task_id, plan_mask_values=plan_mask_values,
+            race_models=await self._race_models_for(farmer_id, model_name)
+        )
+        task = await executor.submit(self, task_id, initial_state, request_id)
+        if task is not None:
+            self.active_tasks[task_id] = task
         
         return task_id
     
+    async def start_batch_generation(
+        self,
+        farmer_id: str,
+        products: List[Dict[str, Any]],
+        service_type: str = "full",
+        model: Optional[str] = None,
+        request_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        批量为产品生成MCP服务
+        
+        按 (品类, 服务类型, 模型) 分组，每组只执行一次规划阶段，
+        组内各产品复用同一份开发计划并发生成代码；
+        query/order/traceability 产品先尝试模板快速通道，不需要规划。
+        
+        Args:
+            farmer_id: 农户ID
+            products: 产品信息字典列表（可单独指定 service_type / model）
+            service_type: 默认服务类型
+            model: 默认LLM模型
+            request_id: 请求追踪ID
+        
+        Returns:
+            List[Dict]: 每个产品的 service_id、产品名、分组与初始状态
+        """
+        async with AsyncSessionLocal() as db:
+            from sqlalchemy import select
+            result = await db.execute(select(Farmer).where(Farmer.id == farmer_id))
+            farmer_name = result.scalar_one().name
+        
+        groups: Dict[tuple, List[tuple]] = {}
+        for product in products:
+            group_key = (
+                product.get("category", "其他"),
+                product.get("service_type") or service_type,
+                product.get("model") or model or settings.DEFAULT_SWE_MODEL,
+            )
+            prompt = PromptBuilder.build_product_service_prompt(
+                product_name=product.get("name", "未命名产品"),
+                product_category=group_key[0],
+                price=product.get("price", 0),
+                stock=product.get("stock", 0),
+                description=product.get("description", ""),
+                farmer_name=farmer_name,
+                orchard_location=product.get("origin"),
+                certifications=product.get("certifications"),
+                service_type=group_key[1]
+            )
+            groups.setdefault(group_key, []).append((product, prompt))
+        
+        items = []
+        for group_key, members in list(groups.items()):
+            if not service_templates.supports(group_key[1]):
+                continue
+            remaining = []
+            for product, prompt in members:
+                task_id = await self._try_template_fast_path(
+                    farmer_id, farmer_name, product, group_key[1], prompt, request_id
+                )
+                if task_id:
+                    items.append({
+                        "service_id": task_id,
+                        "product_name": product.get("name"),
+                        "group": "/".join(group_key),
+                        "status": ServiceStatus.READY.value,
+                    })
+                else:
+                    remaining.append((product, prompt))
+            if remaining:
+                groups[group_key] = remaining
+            else:
+                del groups[group_key]
+        
+        for group_key, members in groups.items():
+            category, _, model_name = group_key
+            group_label = "/".join(group_key)
+            pending = []
+            for product, prompt in members:
+                # 规划期间由本进程持有租约，规划完成后再交给执行器或 Worker
+                task_id, cached = await self._create_service_record(
+                    prompt, farmer_id, category, model_name,
+                    lease=True, enqueue=False, request_id=request_id
+                )
+                items.append({
+                    "service_id": task_id,
+                    "product_name": product.get("name"),
+                    "group": group_label,
+                    "status": ServiceStatus.READY.value if cached else ServiceStatus.GENERATING.value,
+                })
+                if not cached:
+                    pending.append((task_id, prompt, PromptBuilder.product_mask_values(product, farmer_name)))
+            
+            if pending:
+                task = asyncio.create_task(self._run_batch_group(group_key, pending, request_id))
+                self._batch_tasks.add(task)
+                task.add_done_callback(self._batch_tasks.discard)
+        
+        logger.info(f"[{request_id}] Batch generation: {len(items)} products in {len(groups)} groups")
+        return items
+    
+    @property
+    def batch_slots(self) -> asyncio.Semaphore:
+        """批量生成的并发槽位（进程内所有分组共享，首次使用时创建）"""
+        if self._batch_slots is None:
+            self._batch_slots = asyncio.Semaphore(max(settings.BATCH_MAX_CONCURRENCY, 1))
+        return self._batch_slots
+    
+    async def _run_batch_group(self, group_key: tuple, pending: List[tuple], request_id: Optional[str]):
+        """
+        为一个分组执行一次规划，然后提交组内生成任务
+        
+        规划与每个生成任务各占用一个批量并发槽位（BATCH_MAX_CONCURRENCY），
+        等待槽位期间持续为尚未提交的任务续约，避免被回收器重新入队
+        """
+        waiting = [task_id for task_id, _, _ in pending]
+        
+        keeper = asyncio.create_task(self._hold_leases(waiting))
+        try:
+            await self._run_batch_members(group_key, pending, waiting, request_id)
+        finally:
+            keeper.cancel()
+            await asyncio.gather(keeper, return_exceptions=True)
+    
+    async def _run_batch_members(self, group_key: tuple, pending: List[tuple], waiting: List[str], request_id: Optional[str]):
+        """规划并逐个占用槽位提交生成任务，提交后的任务从 waiting 中移除"""
+        _, _, model_name = group_key
+        service_ids = [task_id for task_id, _, _ in pending]
+        
+        async with self.batch_slots:
+            _, prompt, mask_values = pending[0]
+            plan = await self._plan_for_group(prompt, model_name, mask_values)
+        
+        if plan:
+            logger.info(f"[{request_id}] Shared plan ready for group {group_key} ({len(pending)} services)")
+            async with AsyncSessionLocal() as db:
+                from sqlalchemy import update
+                await db.execute(
+                    update(MCPService).where(MCPService.id.in_(service_ids)).values(generation_plan=plan)
+                )
+                await db.commit()
+        else:
+            logger.warning(f"[{request_id}] Shared planning unavailable for group {group_key}, each service plans itself")
+        
+        executor = get_generation_executor()
+        if not executor.leases_locally:
+            # 交给 worker_daemon：释放租约并通知，Worker 从 generation_plan 读取共享计划
+            async with AsyncSessionLocal() as db:
+                for task_id in service_ids:
+                    if await release_job(db, task_id, self.worker_id):
+                        await notify_job_enqueued(db, task_id)
+                await db.commit()
+            waiting.clear()
+            return
+        
+        for task_id, prompt, mask_values in pending:
+            await self.batch_slots.acquire()
+            try:
+                initial_state = self.build_initial_state(
+                    prompt, model_name, task_id, shared_plan=plan, plan_mask_values=mask_values
+                )
+                task = await executor.submit(self, task_id, initial_state, request_id)
+            except BaseException:
+                self.batch_slots.release()
+                raise
+            # 任务开始执行后由其自身心跳续约
+            waiting.remove(task_id)
+            if task is None:
+                self.batch_slots.release()
+                continue
+            self.active_tasks[task_id] = task
+            task.add_done_callback(lambda _: self.batch_slots.release())
+    
+    async def _hold_leases(self, service_ids: List[str]):
+        """规划及等待并发槽位期间为组内尚未提交的任务续约（取消请求在任务开始执行后由心跳处理）"""
+        while True:
+            await asyncio.sleep(settings.WORKER_HEARTBEAT_SECONDS)
+            try:
+                async with AsyncSessionLocal() as db:
+                    for task_id in list(service_ids):
+                        await heartbeat(db, task_id, self.worker_id)
+                    await db.commit()
+            except Exception as e:
+                logger.warning(f"Failed to renew batch leases: {e}")
+    
+    async def _plan_for_group(self, prompt: str, model_name: str, mask_values: Optional[List[str]] = None) -> Optional[str]:
+        """执行一次规划阶段，MCPybarra不可用或规划失败时返回 None"""
+        if not MCPYBARRA_AVAILABLE:
+            return None
+        try:
+            utils = importlib.import_module("mcp_swe_flow.utils")
+            swe_generator = importlib.import_module("mcp_swe_flow.nodes.swe_generator")
+            mcp_doc = (
+                utils.load_mcp_doc(Path(settings.WORKSPACE_DIR) / "resources")
+                or utils.load_mcp_doc(Path("workspace/resources"))
+            )
+            if not mcp_doc:
+                return None
+            return await swe_generator.generate_shared_plan(prompt, model_name, mcp_doc, mask_values)
+        except Exception as e:
+            logger.warning(f"Shared planning failed: {e}", exc_info=True)
+            return None
+    
+    async def run_job(self, service: MCPService, worker_id: str, request_id: Optional[str] = None) -> bool:
+        """
+        执行由 worker_daemon 认领的任务（与进程内执行共用同一工作流与检查点）
+        
+        Args:
+            service: 已认领的服务记录
+            worker_id: 租约持有者标识
+            request_id: 请求追踪ID
+        
+        Returns:
+            bool: 服务是否生成成功（READY）
+        """
+        model_name = service.model_used or settings.DEFAULT_SWE_MODEL
+        initial_state = self.build_initial_state(
+            service.original_requirement, model_name, service.id, shared_plan=service.generation_plan,
+            race_models=await self._race_models_for(service.farmer_id, model_name)
+        )
+        return await self._execute_workflow(service.id, initial_state, request_id, worker_id=worker_id)
+    
+    async def _race_models_for(self, farmer_id: str, model_name: str) -> Optional[List[str]]:
+        """
+        农户等级开通竞速时返回参赛模型（请求模型 + MODEL_RACE_MODELS）
+        
+        Returns:
+            Optional[List[str]]: 至少两个不同模型，否则 None（不竞速）
+        """
+        if not settings.ENABLE_MODEL_RACE:
+            return None
+        models = [model_name] + [m.strip() for m in settings.MODEL_RACE_MODELS.split(",") if m.strip()]
+        models = list(dict.fromkeys(models))
+        if len(models) < 2:
+            return None
+        
+        from sqlalchemy import select
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(Farmer.tier).where(Farmer.id == farmer_id))
+            tier = result.scalar_one_or_none()
+        tier_info = CostCalculator.PRICING_TIERS.get(tier.value if tier else "free", {})
+        return models if tier_info.get("model_race") else None
+    
+    async def _get_runnable(self):
+        """获取挂载了检查点存储的工作流（首次调用时绑定）"""
+        if self._runnable is None:
+            checkpointer = await get_checkpointer()
+            if checkpointer is not None and hasattr(self.workflow, "copy"):
+                self._runnable = self.workflow.copy(update={"checkpointer": checkpointer})
+            else:
+                self._runnable = self.workflow
+        return self._runnable
+    
+    async def _resume_input(self, workflow, task_id: str, initial_state: dict, config: dict):
+        """存在未完成的检查点时从断点继续（输入为 None），否则从头执行"""
+        if getattr(workflow, "checkpointer", None) is None:
+            return initial_state
+        try:
+            snapshot = await workflow.aget_state(config)
+        except Exception as e:
+            logger.warning(f"Failed to read checkpoint for {task_id}: {e}")
+            return initial_state
+        if snapshot and snapshot.next:
+            logger.info(f"Resuming {task_id} from checkpoint, next nodes: {list(snapshot.next)}")
+            return None
+        return initial_state
+    
+    async def _stream_workflow(
+        self,
+        workflow,
+        task_id: str,
+        workflow_input: Optional[dict],
+        config: dict,
+        hb: JobHeartbeat
+    ) -> dict:
+        """
+        以节点更新流执行工作流，记录真实的节点进度并推送
+        
+        Returns:
+            dict: 最终状态（节点更新依次合并；从检查点恢复时以检查点状态为准）
+        """
+        state = dict(workflow_input or {})
+        snapshot = await progress_store.start(task_id)
+        await progress_store.publish(task_id, {"type": "progress", **snapshot})
+        
+        async for chunk in workflow.astream(workflow_input, config=config, stream_mode="updates"):
+            for node, update in chunk.items():
+                hb.beat()
+                if isinstance(update, dict):
+                    state.update(update)
+                snapshot = await progress_store.record_node(task_id, node, update)
+                logger.info(
+                    f"Workflow {task_id}: node '{node}' finished in "
+                    f"{snapshot['nodes'][-1]['duration_ms']}ms, next stage {snapshot['current_stage']}"
+                )
+                await progress_store.publish(task_id, {"type": "progress", **snapshot})
+        
+        if workflow_input is None or getattr(workflow, "checkpointer", None) is not None:
+            final = await workflow.aget_state(config)
+            return dict(final.values)
+        return state
+    
     async def _execute_workflow(
         self,
         task_id: str,
         initial_state: dict,
-        request_id: Optional[str] = None
-    ):
-        """执行MCPybarra工作流并更新状态"""
+        request_id: Optional[str] = None,
+        worker_id: Optional[str] = None
+    ) -> bool:
+        """
+        执行MCPybarra工作流并更新状态
+        
+        Returns:
+            bool: 服务是否进入 READY（失败时为 False，取消时抛出 CancelledError）
+        """
         start_time = datetime.now(timezone.utc).replace(tzinfo=None)
         logger.info(f"[{request_id}] Starting workflow for {task_id}")
+        usage = _track_run_usage()
+        hb = None
         
         try:
-            # 调用工作流（MCPybarra或Mock）
-            result = await self.workflow.ainvoke(initial_state)
+            # 调用工作流（MCPybarra或Mock），执行期间持续续约租约
+            # 以 task_id 作为检查点 thread_id，中断后重新执行会从最后完成的节点继续
+            workflow = await self._get_runnable()
+            async with JobHeartbeat(task_id, worker_id or self.worker_id) as hb:
+                config = {
+                    "configurable": {"thread_id": task_id},
+                    "callbacks": [NodeHeartbeatHandler(hb)]
+                }
+                workflow_input = await self._resume_input(workflow, task_id, initial_state, config)
+                result = await self._stream_workflow(workflow, task_id, workflow_input, config, hb)
             
             server_code = result.get("server_code")
             file_path = result.get("server_file_path")
             api_name = result.get("api_name")
             readme = result.get("readme_content")
             requirements = result.get("requirements_content")
+            test_report = result.get("test_report_content")
             
             cost = self._calculate_cost_from_result(result)
+            race_report = result.get("race_report")
+            if race_report:
+                logger.info(
+                    f"[{request_id}] Model race for {task_id}: winner={race_report.get('winner')}, "
+                    f"wall {race_report.get('wall_time_s')}s, total cost ${race_report.get('total_cost', 0):.4f}"
+                )
             generation_time = int((datetime.now(timezone.utc).replace(tzinfo=None) - start_time).total_seconds())
             quality_score = self._extract_quality_score(result)
             
@@ -629,20 +1190,36 @@ class ServiceManager:
                 service = svc_result.scalar_one()
                 
                 service.name = api_name or service.name
+                if race_report and race_report.get("chosen"):
+                    service.model_used = race_report["chosen"]
                 service.status = ServiceStatus.READY
                 service.code = server_code
                 service.file_path = file_path
                 service.readme = readme
                 service.requirements = requirements
+                service.test_report = test_report
                 service.generation_cost = cost
                 service.generation_time = generation_time
                 service.quality_score = quality_score
+                service.lease_owner = None
+                service.lease_expires_at = None
                 service.updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
                 
+                if self._is_cacheable_result(result):
+                    await generation_cache.store(db, service)
                 await db.commit()
                 logger.info(f"[{request_id}] Workflow completed for {task_id}")
             
+            await self._discard_checkpoints(task_id)
+            
             await self._notify_completion(task_id, success=True, cost=cost)
+            return True
+        
+        except asyncio.CancelledError:
+            # 用户取消：记录 CANCELLED 与已消耗的部分成本；其他取消（租约丢失、停机）保持原状
+            if task_id in self._cancel_requested or (hb is not None and hb.cancel_requested):
+                await asyncio.shield(self._record_cancelled(task_id, start_time, usage))
+            raise
             
         except Exception as e:
             logger.error(f"[{request_id}] Workflow failed for {task_id}: {e}", exc_info=True)
@@ -653,15 +1230,81 @@ class ServiceManager:
                 svc_result = await db.execute(stmt)
                 service = svc_result.scalar_one()
                 service.status = ServiceStatus.FAILED
+                service.lease_owner = None
+                service.lease_expires_at = None
                 service.updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
                 await db.commit()
             
+            await self._discard_checkpoints(task_id)
             await self._notify_completion(task_id, success=False, error=str(e))
+            return False
         
         finally:
+            await progress_store.finish(task_id)
+            self._cancel_requested.discard(task_id)
             if task_id in self.active_tasks:
                 del self.active_tasks[task_id]
     
+    async def _discard_checkpoints(self, task_id: str):
+        """任务进入终态后删除其检查点（清理失败不影响任务结果）"""
+        try:
+            if await delete_thread(task_id):
+                logger.debug(f"Deleted workflow checkpoints of {task_id}")
+        except Exception as e:
+            logger.warning(f"Failed to delete checkpoints of {task_id}: {e}")
+    
+    def mark_cancel_requested(self, task_id: str):
+        """标记任务为用户取消，工作流中断时据此记录 CANCELLED 而非保持排队"""
+        self._cancel_requested.add(task_id)
+    
+    async def cancel_generation(self, task_id: str) -> Optional[str]:
+        """
+        取消生成任务
+        
+        排队中的任务直接标记为 CANCELLED；执行中的任务写入取消请求并通知持有者，
+        持有者中断工作流后按已消耗的 token 记录部分成本。
+        
+        Args:
+            task_id: 任务ID
+        
+        Returns:
+            Optional[str]: "cancelled" 已取消；"cancelling" 正在取消；None 任务不在生成中
+        """
+        async with AsyncSessionLocal() as db:
+            outcome = await request_cancel(db, task_id)
+        
+        task = self.active_tasks.get(task_id)
+        if outcome == "cancelling" and task is not None and not task.done():
+            logger.info(f"Cancelling local generation {task_id}")
+            self.mark_cancel_requested(task_id)
+            task.cancel()
+        elif outcome == "cancelled":
+            logger.info(f"Cancelled queued generation {task_id}")
+            await self._notify_cancelled(task_id, cost=0.0)
+        return outcome
+    
+    async def _record_cancelled(self, task_id: str, start_time: datetime, usage: Dict[str, float]):
+        """记录已取消任务的部分成本与耗时"""
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        cost = round(usage.get("cost", 0.0), 4)
+        async with AsyncSessionLocal() as db:
+            from sqlalchemy import select
+            result = await db.execute(select(MCPService).where(MCPService.id == task_id))
+            service = result.scalar_one()
+            service.status = ServiceStatus.CANCELLED
+            service.generation_cost = cost
+            service.generation_time = int((now - start_time).total_seconds())
+            service.lease_owner = None
+            service.lease_expires_at = None
+            service.updated_at = now
+            await db.commit()
+        
+        logger.info(
+            f"Generation {task_id} cancelled after {usage.get('llm_calls', 0)} LLM calls, "
+            f"partial cost ${cost}"
+        )
+        await self._notify_cancelled(task_id, cost=cost)
+    
     async def get_status(self, task_id: str) -> dict:
         """查询任务状态"""
         async with AsyncSessionLocal() as db:
@@ -681,7 +1324,17 @@ class ServiceManager:
             }
     
     async def get_current_progress(self, task_id: str) -> dict:
-        """获取实时进度"""
+        """获取实时进度（优先读取节点级进度快照，不访问数据库）"""
+        snapshot = await progress_store.get(task_id)
+        if snapshot:
+            return {
+                "progress": snapshot["progress"],
+                "current_stage": snapshot["current_stage"],
+                "current_node": snapshot["current_node"],
+                "message": snapshot["message"],
+                "nodes": snapshot["nodes"],
+            }
+        
         async with AsyncSessionLocal() as db:
             from sqlalchemy import select
             result = await db.execute(select(MCPService).where(MCPService.id == task_id))
@@ -690,28 +1343,44 @@ class ServiceManager:
             if not service or service.status != ServiceStatus.GENERATING:
                 return {"progress": 0, "current_stage": "unknown", "message": "Not generating"}
             
-            elapsed = (datetime.now(timezone.utc).replace(tzinfo=None) - service.created_at).total_seconds()
-            estimated_total = 300
-            progress = min(int((elapsed / estimated_total) * 100), 95)
-            
-            if elapsed < 60:
-                stage = "planning"
-            elif elapsed < 180:
-                stage = "coding"
-            elif elapsed < 240:
-                stage = "testing"
-            else:
-                stage = "refining"
-            
-            return {
-                "progress": progress,
-                "current_stage": stage,
-                "message": f"MCPybarra正在执行{stage}阶段..."
-            }
+            # 仍在队列中：返回排队位置与预计等待时间
+            queue_info = await estimate_queue_position(db, task_id)
+            if queue_info and queue_info["queue_position"] > 0:
+                return {
+                    "progress": 0,
+                    "current_stage": "queued",
+                    "message": f"排队中，前方还有{queue_info['queue_position'] - 1}个任务",
+                    **queue_info
+                }
+        
+        # 由其他进程执行且未启用共享进度存储
+        return {
+            "progress": self._calculate_progress(ServiceStatus.GENERATING),
+            "current_stage": "generating",
+            "message": "MCPybarra正在生成服务..."
+        }
     
     def _calculate_cost_from_result(self, result: dict) -> float:
         stats = result.get("statistics_summary", {})
-        return round(stats.get("total_cost", 0.0), 4)
+        # 统计节点只汇总胜出模型的日志，竞速中其余模型的花费另行计入
+        race = result.get("race_report") or {}
+        race_extra = sum(
+            c.get("cost", 0.0) for c in race.get("candidates", []) if c.get("model") != race.get("chosen")
+        )
+        return round(stats.get("total_cost", 0.0) + race_extra, 4)
+    
+    def _is_cacheable_result(self, result: dict) -> bool:
+        """
+        工作流结果是否可写入生成结果缓存
+        
+        只缓存真实工作流中测试评估为 DELIVERABLE 的结果；达到最大优化轮次后
+        强制交付（NEEDS_REFINEMENT）、静态门禁未通过或 Mock 工作流的产物都不缓存
+        """
+        if result.get("mock_output") or isinstance(self.workflow, MockCompiledWorkflow):
+            return False
+        if result.get("error") or result.get("static_gate_issues"):
+            return False
+        return result.get("deliverability_assessment") == "DELIVERABLE" and bool(result.get("test_report_content"))
     
     def _extract_quality_score(self, result: dict) -> float:
         deliverability = result.get("deliverability_assessment", "")
@@ -728,7 +1397,8 @@ class ServiceManager:
             ServiceStatus.READY: 100,
             ServiceStatus.DEPLOYED: 100,
             ServiceStatus.FAILED: 0,
-            ServiceStatus.ARCHIVED: 100
+            ServiceStatus.ARCHIVED: 100,
+            ServiceStatus.CANCELLED: 0
         }
         return progress_map.get(status, 0)
     
@@ -740,21 +1410,18 @@ class ServiceManager:
         error: Optional[str] = None
     ):
         """通过WebSocket通知前端"""
-        try:
-            from backend.api.main import notify_service_progress
-            
-            if success:
-                await notify_service_progress(task_id, {
-                    "type": "completed",
-                    "result": {"service_id": task_id, "cost": cost}
-                })
-            else:
-                await notify_service_progress(task_id, {
-                    "type": "error",
-                    "error": error
-                })
-        except Exception as e:
-            logger.warning(f"Failed to send WebSocket notification: {e}")
+        if success:
+            event = {"type": "completed", "result": {"service_id": task_id, "cost": cost}}
+        else:
+            event = {"type": "error", "error": error}
+        await progress_store.publish(task_id, event)
+    
+    async def _notify_cancelled(self, task_id: str, cost: float):
+        """通过WebSocket通知前端任务已取消"""
+        await progress_store.publish(task_id, {
+            "type": "cancelled",
+            "result": {"service_id": task_id, "cost": cost}
+        })
 
 
 # 导出供其他模块使用
@@ -0,0 +1,323 @@
+"""
+服务模板快速通道
+query / order / traceability 三类标准服务由审核过的模板直接生成，不调用LLM
+
+PromptBuilder 对这三类服务的需求是固定的，LLM 每次产出的服务结构都相同。
+快速通道用产品信息填充 templates/ 下的 Jinja 模板，然后：
+- 静态检查：语法、编译、FastAPI 应用与需求中的全部接口
+- 冒烟测试：按固定测试计划逐个调用接口（TestClient，进程内执行）
+任一检查失败则返回失败结果，由调用方回退到完整的 MCPybarra 工作流；
+full 与自定义需求始终走工作流。
+"""
+import ast
+import re
+import sys
+import uuid
+import asyncio
+import hashlib
+import logging
+import importlib.util
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from jinja2 import Environment, FileSystemLoader, StrictUndefined
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = Path(__file__).parent / "templates"
+
+TEMPLATE_MODEL = "template"
+
+TEMPLATE_REQUIREMENTS = "fastapi>=0.100.0\nuvicorn>=0.23.0\npydantic>=2.0"
+
+SAMPLE_BATCH_NO = "BATCH-0001"
+
+# 每类服务：模板文件、需求中的接口、冒烟测试计划 (方法, 路径, 请求体, 期望状态码)
+TEMPLATE_SPECS: Dict[str, Dict[str, Any]] = {
+    "query": {
+        "template": "query_service.py.j2",
+        "routes": [
+            ("GET", "/health"),
+            ("GET", "/products"),
+            ("GET", "/products/{product_id}"),
+            ("GET", "/products/search"),
+        ],
+        "smoke_tests": [
+            ("GET", "/health", None, 200),
+            ("GET", "/products", None, 200),
+            ("GET", "/products/1", None, 200),
+            ("GET", "/products/999", None, 404),
+            ("GET", "/products/search?keyword={name}", None, 200),
+        ],
+    },
+    "order": {
+        "template": "order_service.py.j2",
+        "routes": [
+            ("GET", "/health"),
+            ("POST", "/orders"),
+            ("GET", "/orders/{order_id}"),
+            ("GET", "/orders"),
+            ("PUT", "/orders/{order_id}/status"),
+        ],
+        "smoke_tests": [
+            ("GET", "/health", None, 200),
+            ("POST", "/orders", {"product_id": 1, "quantity": 1, "address": "测试地址", "phone": "13800000000"}, 201),
+            ("GET", "/orders/ORD000001", None, 200),
+            ("GET", "/orders?status=pending", None, 200),
+            ("PUT", "/orders/ORD000001/status", {"status": "paid"}, 200),
+            ("PUT", "/orders/ORD000001/status", {"status": "pending"}, 400),
+            ("GET", "/orders/ORD999999", None, 404),
+        ],
+    },
+    "traceability": {
+        "template": "traceability_service.py.j2",
+        "routes": [
+            ("GET", "/health"),
+            ("GET", "/trace/{batch_no}"),
+            ("GET", "/trace/qrcode/{batch_no}"),
+            ("POST", "/trace/record"),
+        ],
+        "smoke_tests": [
+            ("GET", "/health", None, 200),
+            ("GET", f"/trace/{SAMPLE_BATCH_NO}", None, 200),
+            ("GET", f"/trace/qrcode/{SAMPLE_BATCH_NO}", None, 200),
+            ("POST", "/trace/record", {"batch_no": "BATCH-0002", "record_type": "harvesting", "description": "采摘"}, 201),
+            ("GET", "/trace/BATCH-0002", None, 200),
+            ("GET", "/trace/UNKNOWN", None, 404),
+        ],
+    },
+}
+
+TEMPLATE_SERVICE_TYPES = tuple(TEMPLATE_SPECS)
+
+
+def supports(service_type: Optional[str]) -> bool:
+    """该服务类型是否有对应模板"""
+    return service_type in TEMPLATE_SPECS
+
+
+@lru_cache(maxsize=1)
+def _environment() -> Environment:
+    env = Environment(
+        loader=FileSystemLoader(str(TEMPLATE_DIR)),
+        undefined=StrictUndefined,
+        keep_trailing_newline=True,
+    )
+    # 产品字段以 Python 字面量写入代码，避免引号或换行破坏生成的源码
+    env.filters["py"] = repr
+    return env
+
+
+@lru_cache(maxsize=1)
+def template_version() -> str:
+    """全部模板内容的联合哈希（前12位）"""
+    digest = hashlib.sha256()
+    for path in sorted(TEMPLATE_DIR.glob("*.j2")):
+        digest.update(path.name.encode("utf-8"))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+def _normalize_product(product_info: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "name": str(product_info.get("name") or "未命名产品"),
+        "category": str(product_info.get("category") or "其他"),
+        "price": float(product_info.get("price") or 0),
+        "stock": int(product_info.get("stock") or 0),
+        "description": str(product_info.get("description") or ""),
+        "origin": product_info.get("origin"),
+        "certifications": [str(c) for c in (product_info.get("certifications") or [])],
+    }
+
+
+def render_service(service_type: str, product_info: Dict[str, Any], farmer_name: str) -> Tuple[str, str]:
+    """
+    用产品信息填充服务模板
+
+    Args:
+        service_type: query / order / traceability
+        product_info: 产品信息字典
+        farmer_name: 农户名称
+
+    Returns:
+        Tuple[str, str]: (api_name, 服务代码)
+    """
+    spec = TEMPLATE_SPECS[service_type]
+    api_name = f"{service_type}_service"
+    code = _environment().get_template(spec["template"]).render(
+        api_name=api_name,
+        farmer_name=farmer_name,
+        product=_normalize_product(product_info),
+        sample_batch_no=SAMPLE_BATCH_NO,
+        template_version=template_version(),
+    )
+    return api_name, code
+
+
+def static_check(code: str, service_type: str) -> List[str]:
+    """
+    静态检查生成的服务代码
+
+    Returns:
+        List[str]: 问题列表，为空表示通过
+    """
+    try:
+        tree = ast.parse(code)
+        compile(tree, f"<{service_type}_service>", "exec")
+    except SyntaxError as e:
+        return [f"语法错误: {e}"]
+
+    issues = []
+    if not re.search(r"^app\s*=\s*FastAPI\s*\(", code, re.M):
+        issues.append("缺少模块级 app = FastAPI(...)")
+
+    declared = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for decorator in node.decorator_list:
+            if (
+                isinstance(decorator, ast.Call)
+                and isinstance(decorator.func, ast.Attribute)
+                and isinstance(decorator.func.value, ast.Name)
+                and decorator.func.value.id == "app"
+                and decorator.args
+                and isinstance(decorator.args[0], ast.Constant)
+            ):
+                declared.add((decorator.func.attr.upper(), decorator.args[0].value))
+
+    for method, path in TEMPLATE_SPECS[service_type]["routes"]:
+        if (method, path) not in declared:
+            issues.append(f"缺少接口 {method} {path}")
+    return issues
+
+
+def run_smoke_tests(server_file: Path, service_type: str, product_name: str) -> List[Dict[str, Any]]:
+    """
+    加载服务并按固定测试计划调用全部接口（同步，调用方放到线程中执行）
+
+    Returns:
+        List[Dict]: 每一步的方法、路径、期望/实际状态码与是否通过
+    """
+    from fastapi.testclient import TestClient
+
+    module_name = f"_template_service_{uuid.uuid4().hex[:8]}"
+    spec = importlib.util.spec_from_file_location(module_name, server_file)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+        results = []
+        with TestClient(module.app) as client:
+            for method, path, body, expected in TEMPLATE_SPECS[service_type]["smoke_tests"]:
+                path = path.format(name=quote(product_name))
+                try:
+                    response = client.request(method, path, json=body)
+                    actual = response.status_code
+                except Exception as e:
+                    actual = None
+                    logger.warning(f"Smoke test {method} {path} raised: {e}")
+                results.append({
+                    "method": method,
+                    "path": path,
+                    "expected": expected,
+                    "actual": actual,
+                    "passed": actual == expected,
+                })
+        return results
+    finally:
+        sys.modules.pop(module_name, None)
+
+
+def _build_readme(api_name: str, service_type: str, product: Dict[str, Any], farmer_name: str) -> str:
+    lines = [
+        f"# {api_name}",
+        "",
+        f"{farmer_name} 的{product.get('name') or '产品'}服务（模板 {template_version()} 生成）。",
+        "",
+        "## 接口",
+        "",
+    ]
+    lines += [f"- `{method} {path}`" for method, path in TEMPLATE_SPECS[service_type]["routes"]]
+    lines += ["", "## 运行", "", "```bash", f"uvicorn {api_name}:app --port 8000", "```", ""]
+    return "\n".join(lines)
+
+
+def _build_test_report(api_name: str, issues: List[str], results: List[Dict[str, Any]]) -> str:
+    passed = sum(1 for r in results if r["passed"])
+    lines = [
+        f"# Test Report: {api_name}",
+        "",
+        f"- 模板版本: {template_version()}",
+        f"- 静态检查: {'通过' if not issues else '未通过'}",
+        f"- 冒烟测试: {passed}/{len(results)} 通过",
+        "",
+    ]
+    if issues:
+        lines += ["## 静态检查问题", ""] + [f"- {issue}" for issue in issues] + [""]
+    if results:
+        lines += ["## 冒烟测试", "", "| 接口 | 期望 | 实际 | 结果 |", "| --- | --- | --- | --- |"]
+        lines += [
+            f"| `{r['method']} {r['path']}` | {r['expected']} | {r['actual']} | {'✅' if r['passed'] else '❌'} |"
+            for r in results
+        ]
+    return "\n".join(lines) + "\n"
+
+
+async def synthesize(
+    service_type: str,
+    product_info: Dict[str, Any],
+    farmer_name: str,
+    output_dir: Path
+) -> Dict[str, Any]:
+    """
+    由模板生成服务并完成静态检查与冒烟测试
+
+    Args:
+        service_type: query / order / traceability
+        product_info: 产品信息字典
+        farmer_name: 农户名称
+        output_dir: 服务文件输出目录
+
+    Returns:
+        Dict: api_name, code, file_path, readme, requirements, test_report,
+              test_pass_rate, passed（False 时调用方应回退到工作流）
+    """
+    api_name, code = render_service(service_type, product_info, farmer_name)
+    issues = static_check(code, service_type)
+
+    server_file = Path(output_dir) / f"{api_name}.py"
+    results: List[Dict[str, Any]] = []
+    if not issues:
+        server_file.parent.mkdir(parents=True, exist_ok=True)
+        server_file.write_text(code, encoding="utf-8")
+        results = await asyncio.to_thread(
+            run_smoke_tests, server_file, service_type, _normalize_product(product_info)["name"]
+        )
+
+    passed_count = sum(1 for r in results if r["passed"])
+    passed = not issues and bool(results) and passed_count == len(results)
+    return {
+        "api_name": api_name,
+        "code": code,
+        "file_path": str(server_file),
+        "readme": _build_readme(api_name, service_type, product_info, farmer_name),
+        "requirements": TEMPLATE_REQUIREMENTS,
+        "test_report": _build_test_report(api_name, issues, results),
+        "test_pass_rate": round(passed_count / len(results), 4) if results else 0.0,
+        "passed": passed,
+    }
+
+
+__all__ = [
+    "TEMPLATE_SERVICE_TYPES",
+    "TEMPLATE_MODEL",
+    "supports",
+    "render_service",
+    "static_check",
+    "run_smoke_tests",
+    "synthesize",
+    "template_version",
+]
@@ -1,178 +1,220 @@
-import os
 import asyncio
 import logging
 from datetime import datetime,timezone
-from pathlib import Path
-from sqlalchemy import select, and_
-from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Callable, Dict, Optional
+from sqlalchemy import select, func
 
 # 导入项目模块
 from backend.database.connection import AsyncSessionLocal
 from backend.models.mcp_service import MCPService, ServiceStatus
-from backend.mcpybarra_core.framework.mcp_swe_flow.nodes.swe_generator import swe_generate_node
+from backend.services.job_queue import (
+    make_worker_id,
+    claim_jobs,
+    release_job,
+    pending_job_filter,
+    notify_job_enqueued,
+)
+from backend.services.workflow_registry import get_service_manager
 from backend.config.settings import settings
-from backend.mcpybarra_core.framework.mcp_swe_flow.nodes.input_loader import load_input_node
 
 # 配置日志
 logger = logging.getLogger("worker.service")
 
-async def process_pending_services():
+WORKER_ID = make_worker_id("worker")
+
+
+class GenerationWorkerPool:
     """
-    核心工作函数：
-    1. 查找所有状态为 GENERATING 且 代码为空 的任务
-    2. 逐个处理
+    有界并发的生成任务池
+
+    - 每个任务使用独立的 AsyncSession，互不共享事务
+    - max_in_flight 限制同时执行的任务数，空闲槽位才会继续认领
+    - 每个任务有独立超时，超时后标记为 FAILED 并释放租约
+    - 暴露 queue_depth / in_flight / succeeded / failed 等指标供守护进程输出
     """
-    async with AsyncSessionLocal() as session:
-        try:
-            # 1. 查找待处理任务
-            # 修正：根据你的模型定义，新任务默认是 GENERATING
-            # 我们增加一个条件：code 为空，确保只处理新任务，不重复处理正在跑的任务
+
+    def __init__(
+        self,
+        worker_id: str = WORKER_ID,
+        max_in_flight: Optional[int] = None,
+        job_timeout: Optional[int] = None,
+        on_job_done: Optional[Callable[[], None]] = None
+    ):
+        self.worker_id = worker_id
+        # 任务结束释放槽位时的回调（用于唤醒主循环继续认领）
+        self.on_job_done = on_job_done
+        self.max_in_flight = max_in_flight or settings.WORKER_MAX_IN_FLIGHT
+        self.job_timeout = job_timeout or settings.WORKER_JOB_TIMEOUT_SECONDS
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+        # 指标
+        self.queue_depth = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.timed_out = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    @property
+    def free_slots(self) -> int:
+        return max(self.max_in_flight - self.in_flight, 0)
+
+    def stats(self) -> Dict[str, int]:
+        """当前指标快照"""
+        return {
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+        }
+
+    async def fill(self) -> int:
+        """
+        按空闲槽位认领任务并在后台启动
+
+        Returns:
+            int: 本次新启动的任务数
+        """
+        async with AsyncSessionLocal() as session:
+            if self.free_slots > 0:
+                # 租约较短，执行期间由 JobHeartbeat 续约
+                jobs = await claim_jobs(session, self.worker_id, limit=self.free_slots)
+            else:
+                jobs = []
+
             result = await session.execute(
-                select(MCPService).where(
-                    and_(
-                        MCPService.status == ServiceStatus.GENERATING,
-                        (MCPService.code == None) | (MCPService.code == "")
-                    )
-                )
+                select(func.count()).select_from(MCPService).where(pending_job_filter())
             )
-            pending_services = result.scalars().all()
-            
-            if not pending_services:
-                return 
+            self.queue_depth = result.scalar_one()
+
+        for job in jobs:
+            task = asyncio.create_task(self._run_job(job.id), name=f"generate:{job.id}")
+            self._tasks[job.id] = task
 
-            logger.info(f"🚀 Found {len(pending_services)} new services to process")
+        if jobs:
+            logger.info(f"📊 Worker pool: {self.stats()}")
+        return len(jobs)
 
-            # 2. 逐个处理任务
-            for service in pending_services:
-                await process_single_service(session, service)
-                
+    async def _run_job(self, service_id: str):
+        """在独立会话中执行单个任务（超时计入 failed 与 timed_out，取消不计数）"""
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(select(MCPService).where(MCPService.id == service_id))
+                service = result.scalar_one()
+            succeeded = await asyncio.wait_for(
+                process_single_service(service, self.worker_id),
+                timeout=self.job_timeout
+            )
+            if succeeded:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            self.failed += 1
+            logger.error(f"⏱️ Service {service_id} timed out after {self.job_timeout}s")
+            await _mark_service_failed(service_id, f"Generation timed out after {self.job_timeout}s")
         except Exception as e:
-            logger.error(f"❌ Error in process_pending_services: {e}", exc_info=True)
+            self.failed += 1
+            logger.error(f"❌ Worker pool job {service_id} crashed: {e}", exc_info=True)
+        finally:
+            self._tasks.pop(service_id, None)
+            if self.on_job_done:
+                self.on_job_done()
+
+    def cancel_job(self, service_id: str) -> bool:
+        """
+        取消本池内正在执行的任务（由取消通知触发）
+
+        ServiceManager 在工作流中断时记录 CANCELLED 与部分成本。
+
+        Returns:
+            bool: 任务是否在本池内执行
+        """
+        task = self._tasks.get(service_id)
+        if task is None or task.done():
+            return False
+        get_service_manager().mark_cancel_requested(service_id)
+        task.cancel()
+        logger.info(f"🛑 Cancelling service {service_id} on request")
+        return True
+
+    async def shutdown(self):
+        """取消所有进行中的任务并释放租约，使其可被其他副本立即认领"""
+        if not self._tasks:
+            return
+
+        service_ids = list(self._tasks.keys())
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+        async with AsyncSessionLocal() as session:
+            for service_id in service_ids:
+                if await release_job(session, service_id, self.worker_id):
+                    await notify_job_enqueued(session, service_id)
+            await session.commit()
+        logger.info(f"Released {len(service_ids)} in-flight job(s) on shutdown")
+
+
+_worker_pool: Optional[GenerationWorkerPool] = None
+
 
+def get_worker_pool() -> GenerationWorkerPool:
+    """获取进程内的 Worker 任务池单例"""
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = GenerationWorkerPool()
+    return _worker_pool
 
-async def process_single_service(session: AsyncSession, service: MCPService):
-    """处理单个服务生成流程"""
-    service_id = service.id
-    logger.info(f"👉 Starting processing for service: {service.name} ({service_id})")
 
+async def process_pending_services():
+    """
+    核心工作函数：
+    1. 通过 SKIP LOCKED 租约按空闲槽位认领待处理任务（多副本安全）
+    2. 在有界任务池中并发处理，每个任务独立会话
+    """
     try:
-        # Step 1: 更新时间戳，表示 Worker 正在活跃处理
-        service.updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
-        await session.commit()
-        
-        # Step 2: 准备生成参数
-        state = {
-            "user_input": service.original_requirement,
-            "project_path": service.file_path or "",  
-            "demo_mode": False,
-            "verbose": True,
-            "swe_model": service.model_used or "openrouter/anthropic/claude-3.5-sonnet"
-        }
-        
-        logger.info(f"🤖 Generating code with LLM for {service_id}...")
-
-        # Step 3: 先通过 load_input_node 加载 MCP 文档
-        state = load_input_node(state)
-        if state.get("error"):
-            raise Exception(f"Input loading failed: {state.get('error')}")
-        
-        # Step 4: 调用生成逻辑
-        result_state = await swe_generate_node(state)
-        
-        generated_code = (
-            result_state.get("server_code")
-            or result_state.get("code")
-            or result_state.get("implementation_code")
-            or ""
-        )
-
-        test_code = (
-            result_state.get("test_code")
-            or result_state.get("tests_code")
-            or ""
-        )
-        if not generated_code.strip():
-            server_file_path = result_state.get("server_file_path")
-            if server_file_path and os.path.exists(server_file_path):
-                with open(server_file_path, "r", encoding="utf-8") as f:
-                    generated_code = f.read()
-
-        if not generated_code.strip():
-            raise Exception("LLM returned empty code")
-
-
-        error = result_state.get("error")
-
-        if error:
-            raise Exception(f"LLM Generation failed: {error}")
-
-        if not generated_code:
-            raise Exception("LLM returned empty code")
-
-        logger.info(f"✅ Code generated successfully for {service_id}")
-
-        # Step 4: 不再另存为 main.py，直接使用 generator 输出路径
-        server_file_path = result_state.get("server_file_path")
-        project_dir = result_state.get("project_dir")
-
-        if project_dir:
-            service_dir = Path(project_dir)
-        elif server_file_path:
-            service_dir = Path(server_file_path).parent
-        elif service.file_path:
-            service_dir = Path(service.file_path)
-        else:
-            # 兜底目录（不依赖 settings.SERVICES_DIR）
-            service_dir = Path("workspace") / "generated-services" / service_id
-
-        service_dir.mkdir(parents=True, exist_ok=True)
-
-        # 主文件：优先 server_file_path（与 python -m workspace... 一致）
-        if server_file_path:
-            main_file = Path(server_file_path)
-        else:
-            # 兜底：不要叫 main.py，至少用服务名，避免后续模块路径错位
-            main_file = service_dir / f"{service.name}.py"
-
-        # 如果 generator 没写入（极少情况），才补写
-        if (not main_file.exists()) or main_file.stat().st_size == 0:
-            with open(main_file, "w", encoding="utf-8") as f:
-                f.write(generated_code)
-
-        # README（可保留）
-        readme_file = service_dir / "README.md"
-        with open(readme_file, "w", encoding="utf-8") as f:
-            f.write(f"# {service.name}\n\n{service.description}\n\nGenerated by MCP-SWE-Agent")
-
-
-        # Step 5: 更新数据库状态
-        # 重新获取对象防止 Session 冲突
-        result = await session.execute(select(MCPService).where(MCPService.id == service_id))
-        service = result.scalar_one()
+        await get_worker_pool().fill()
+    except Exception as e:
+        logger.error(f"❌ Error in process_pending_services: {e}", exc_info=True)
 
-        service.code = generated_code
-        # 修正：模型里没有 COMPLETED，改为 READY
-        service.status = ServiceStatus.READY 
-        service.file_path = str(service_dir)
+
+async def _mark_service_failed(service_id: str, reason: str):
+    """在独立会话中将任务标记为失败并释放租约"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(MCPService).where(MCPService.id == service_id))
+        service = result.scalar_one_or_none()
+        if not service:
+            return
+        service.status = ServiceStatus.FAILED
+        service.total_errors = (service.total_errors or 0) + 1
+        service.lease_owner = None
+        service.lease_expires_at = None
         service.updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
-        
+        if service.description:
+            service.description += f"\n\n[Error Log]: {reason}"
         await session.commit()
-        logger.info(f"🎉 Service {service_id} processing COMPLETED (Status: READY)!")
 
-    except Exception as e:
-        logger.error(f"❌ Failed to process service {service_id}: {e}", exc_info=True)
-        
-        try:
-            result = await session.execute(select(MCPService).where(MCPService.id == service_id))
-            service = result.scalar_one()
-            
-            service.status = ServiceStatus.FAILED
-            service.total_errors += 1
-            service.updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
-            if service.description:
-                service.description += f"\n\n[Error Log]: {str(e)}"
-            
-            await session.commit()
-            logger.info(f"⚠️ Marked service {service_id} as FAILED")
-        except Exception as db_e:
-            logger.critical(f"🔥 Critical DB error: {db_e}")
+
+async def process_single_service(service: MCPService, worker_id: str = WORKER_ID):
+    """
+    处理单个服务生成流程
+
+    与 API 进程内执行共用同一个 LangGraph 工作流：以服务ID作为检查点 thread_id，
+    任务被回收后由任意 Worker 重新认领时会从最后完成的节点继续，而不是从头重跑。
+    租约心跳、结果写回、生成结果缓存均由 ServiceManager 统一处理。
+
+    Args:
+        service: 已认领的服务记录
+        worker_id: 租约持有者标识
+    
+    Returns:
+        bool: 服务是否生成成功（READY）
+    """
+    logger.info(f"👉 Starting processing for service: {service.name} ({service.id}), attempt {service.attempt_count}")
+    return await get_service_manager().run_job(service, worker_id)
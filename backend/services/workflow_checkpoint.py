@@ -0,0 +1,119 @@
+"""
+工作流检查点存储
+为 MCPybarra LangGraph 工作流提供持久化检查点，使中断的生成任务从最后完成的节点继续
+
+支持的后端（settings.WORKFLOW_CHECKPOINTER）：
+- none:     不使用检查点
+- memory:   进程内存（仅用于开发调试，进程退出即丢失）
+- sqlite:   本地 SQLite 文件（单机部署，需要 langgraph-checkpoint-sqlite）
+- postgres: 业务数据库（多副本部署，需要 langgraph-checkpoint-postgres）
+"""
+import asyncio
+import logging
+from contextlib import AsyncExitStack
+from pathlib import Path
+from typing import Any, Optional
+
+from backend.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_checkpointer: Optional[Any] = None
+_exit_stack: Optional[AsyncExitStack] = None
+_lock = asyncio.Lock()
+
+
+async def _open_checkpointer(backend: str, stack: AsyncExitStack) -> Optional[Any]:
+    """按配置创建检查点存储，依赖缺失时返回 None"""
+    if backend == "memory":
+        from langgraph.checkpoint.memory import MemorySaver
+        return MemorySaver()
+
+    if backend == "sqlite":
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        db_path = Path(settings.WORKFLOW_CHECKPOINT_SQLITE_PATH)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        return await stack.enter_async_context(AsyncSqliteSaver.from_conn_string(str(db_path)))
+
+    if backend == "postgres":
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+        saver = await stack.enter_async_context(AsyncPostgresSaver.from_conn_string(settings.DATABASE_URL))
+        await saver.setup()
+        return saver
+
+    if backend != "none":
+        logger.warning(f"Unknown WORKFLOW_CHECKPOINTER '{backend}', checkpointing disabled")
+    return None
+
+
+async def get_checkpointer() -> Optional[Any]:
+    """
+    获取进程级检查点存储（首次调用时创建）
+
+    Returns:
+        Optional[BaseCheckpointSaver]: 检查点存储；未启用或依赖缺失时为 None
+    """
+    global _checkpointer, _exit_stack
+
+    if _exit_stack is not None:
+        return _checkpointer
+
+    async with _lock:
+        if _exit_stack is not None:
+            return _checkpointer
+
+        backend = (settings.WORKFLOW_CHECKPOINTER or "none").lower()
+        stack = AsyncExitStack()
+        try:
+            _checkpointer = await _open_checkpointer(backend, stack)
+        except ImportError as e:
+            logger.warning(f"Checkpointer backend '{backend}' unavailable ({e}), checkpointing disabled")
+            _checkpointer = None
+        except Exception as e:
+            logger.error(f"Failed to initialize '{backend}' checkpointer: {e}", exc_info=True)
+            _checkpointer = None
+        _exit_stack = stack
+
+        if _checkpointer is not None:
+            logger.info(f"Workflow checkpointer enabled: {type(_checkpointer).__name__}")
+        return _checkpointer
+
+
+async def delete_thread(thread_id: str) -> bool:
+    """
+    删除任务的全部检查点（任务结束后不再需要恢复，避免检查点存储无限增长）
+
+    Args:
+        thread_id: 检查点 thread_id（即任务ID）
+
+    Returns:
+        bool: 是否已删除
+    """
+    checkpointer = _checkpointer
+    if checkpointer is None:
+        return False
+    try:
+        await checkpointer.adelete_thread(thread_id)
+    except NotImplementedError:
+        # langgraph-checkpoint-sqlite 2.0.x 未实现 adelete_thread，直接清理两张表
+        conn = getattr(checkpointer, "conn", None)
+        if conn is None:
+            return False
+        await checkpointer.setup()
+        async with checkpointer.lock:
+            await conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            await conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+            await conn.commit()
+    return True
+
+
+async def close_checkpointer():
+    """关闭检查点存储持有的连接"""
+    global _checkpointer, _exit_stack
+    if _exit_stack is not None:
+        await _exit_stack.aclose()
+    _checkpointer = None
+    _exit_stack = None
+
+
+__all__ = ["get_checkpointer", "delete_thread", "close_checkpointer"]
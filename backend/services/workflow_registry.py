@@ -0,0 +1,102 @@
+"""
+工作流注册表
+进程级共享的 MCPybarra 工作流与 ServiceManager
+
+LangGraph 图的构建与编译（以及 MCPybarra 的模块导入）开销较大，
+API 路由、自动优化、Worker 均通过本模块获取同一个实例：
+- 首次调用时才导入并编译，之后复用
+- 记录编译耗时与复用次数、规划缓存命中情况，便于观察
+"""
+import sys
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WorkflowRegistry:
+    """进程内的工作流与 ServiceManager 注册表"""
+
+    def __init__(self):
+        self._workflow: Optional[Any] = None
+        self._service_manager = None
+        self._lock = threading.Lock()
+
+        # 指标
+        self.compile_seconds = 0.0
+        self.compiled_at: Optional[float] = None
+        self.workflow_requests = 0
+        self.manager_requests = 0
+
+    def get_workflow(self):
+        """
+        获取编译好的工作流（首次调用时编译）
+
+        Returns:
+            CompiledGraph 或 MockCompiledWorkflow
+        """
+        self.workflow_requests += 1
+        if self._workflow is None:
+            with self._lock:
+                if self._workflow is None:
+                    started = time.perf_counter()
+                    from backend.services.service_manager import _create_workflow
+                    self._workflow = _create_workflow()
+                    self.compile_seconds = time.perf_counter() - started
+                    self.compiled_at = time.time()
+                    logger.info(
+                        f"Compiled {type(self._workflow).__name__} in {self.compile_seconds:.2f}s"
+                    )
+        return self._workflow
+
+    def get_service_manager(self):
+        """
+        获取共享的 ServiceManager（首次调用时创建）
+
+        Returns:
+            ServiceManager
+        """
+        self.manager_requests += 1
+        if self._service_manager is None:
+            workflow = self.get_workflow()
+            with self._lock:
+                if self._service_manager is None:
+                    from backend.services.service_manager import ServiceManager
+                    self._service_manager = ServiceManager(workflow=workflow)
+        return self._service_manager
+
+    def stats(self) -> Dict[str, Any]:
+        """编译耗时与复用次数"""
+        return {
+            "workflow": type(self._workflow).__name__ if self._workflow is not None else None,
+            "compile_seconds": round(self.compile_seconds, 3),
+            "workflow_requests": self.workflow_requests,
+            "workflow_reuses": max(self.workflow_requests - 1, 0) if self._workflow is not None else 0,
+            "manager_requests": self.manager_requests,
+            "plan_cache": self._plan_cache_stats(),
+        }
+
+    @staticmethod
+    def _plan_cache_stats() -> Optional[Dict[str, Any]]:
+        """规划缓存命中与节省的规划 token（仅当本进程已加载 MCPybarra 时）"""
+        module = sys.modules.get("mcp_swe_flow.plan_cache")
+        return module.plan_cache.stats() if module is not None else None
+
+
+# 进程内单例
+workflow_registry = WorkflowRegistry()
+
+
+def get_workflow():
+    """获取进程共享的编译后工作流"""
+    return workflow_registry.get_workflow()
+
+
+def get_service_manager():
+    """获取进程共享的 ServiceManager"""
+    return workflow_registry.get_service_manager()
+
+
+__all__ = ["WorkflowRegistry", "workflow_registry", "get_workflow", "get_service_manager"]
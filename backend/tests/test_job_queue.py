@@ -0,0 +1,489 @@
+"""
+生成任务队列测试
+"""
+import pytest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from backend.models.mcp_service import MCPService
+from backend.services.job_queue import pending_job_filter, make_worker_id
+
+
+class FakeSession:
+    """记录执行语句的数据库会话替身，按顺序返回预设结果"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    async def execute(self, statement, params=None):
+        self.statements.append((statement, params))
+        return self.results.pop(0) if self.results else MagicMock(rowcount=0)
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+    def sql(self, index: int) -> str:
+        return str(self.statements[index][0].compile(dialect=postgresql.dialect()))
+
+
+def session_factory(session):
+    """替代 AsyncSessionLocal：每次 async with 都返回同一个会话替身"""
+
+    class SessionFactory:
+        async def __aenter__(self):
+            return session
+
+        async def __aexit__(self, *exc):
+            return False
+
+    return SessionFactory
+
+
+@pytest.mark.asyncio
+async def test_claim_query_uses_skip_locked():
+    """测试 claim_jobs 实际执行的认领查询使用 FOR UPDATE SKIP LOCKED，并为认领的任务写入租约"""
+    from backend.services.job_queue import claim_jobs
+
+    job = MCPService(id="svc_claim", attempt_count=0)
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = [job]
+    session = FakeSession(result)
+
+    jobs = await claim_jobs(session, "worker-test", limit=2, lease_seconds=60)
+    sql = session.sql(0)
+
+    assert "FOR UPDATE OF mcp_services SKIP LOCKED" in sql
+    assert "lease_expires_at" in sql
+    assert "attempt_count" in sql
+    assert "virtual_finish" in sql
+    assert jobs == [job]
+    assert job.lease_owner == "worker-test" and job.attempt_count == 1
+    assert session.commits == 1
+
+
+def test_make_worker_id():
+    """测试租约持有者标识"""
+    assert make_worker_id("worker").startswith("worker-")
+    assert make_worker_id("api") != make_worker_id("worker")
+
+
+def test_scheduled_job_alignment():
+    """测试对齐调度：每日任务落在下一个 UTC 0 点之后的抖动窗口内"""
+    from backend.services.scheduler import ScheduledJob
+
+    async def noop():
+        return None
+
+    job = ScheduledJob(name="daily", func=noop, interval_seconds=86400, jitter_seconds=60, align=True)
+    now = 86400 * 100 + 3600
+    job.schedule_next(now)
+
+    assert 86400 * 101 <= job.next_run <= 86400 * 101 + 60
+
+
+@pytest.mark.asyncio
+async def test_scheduler_runs_due_jobs_and_records_metrics():
+    """测试调度器执行到期任务并记录耗时指标"""
+    from backend.services.scheduler import MaintenanceScheduler
+
+    calls = []
+
+    async def local_job():
+        calls.append(1)
+
+    scheduler = MaintenanceScheduler()
+    scheduler.add_job("local", local_job, interval_seconds=60, leader_only=False, run_on_start=True)
+
+    assert await scheduler.run_pending() == 1
+    assert calls == [1]
+    # 已重新排期，不会立即再次执行
+    assert await scheduler.run_pending() == 0
+    assert scheduler.stats()["local"]["runs"] == 1
+    assert scheduler.seconds_until_next() > 0
+
+
+def test_tier_weight_prefers_higher_tiers():
+    """测试等级权重：专业版 > 基础版 > 免费版，未知等级按免费版"""
+    from backend.services.job_queue import tier_weight
+
+    assert tier_weight("professional") > tier_weight("basic") > tier_weight("free")
+    assert tier_weight(None) == tier_weight("free")
+
+
+@pytest.mark.asyncio
+async def test_process_pool_rebuilt_after_child_crash(monkeypatch):
+    """测试子进程崩溃导致进程池损坏时先重建进程池，再在新池中重新执行任务"""
+    from concurrent.futures import ThreadPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    from types import SimpleNamespace
+    from backend.services import generation_executor
+
+    class BrokenPool:
+        def submit(self, *args, **kwargs):
+            raise BrokenProcessPool("A child process terminated abruptly")
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            pass
+
+    runs = []
+    monkeypatch.setattr(generation_executor, "_run_in_child", lambda task_id, *args: runs.append(task_id))
+    monkeypatch.setattr(generation_executor.ProcessPoolGenerationExecutor, "_new_pool", lambda self: BrokenPool())
+    executor = generation_executor.ProcessPoolGenerationExecutor(max_workers=1)
+    broken = executor._pool
+    monkeypatch.setattr(generation_executor.ProcessPoolGenerationExecutor, "_new_pool", lambda self: ThreadPoolExecutor(1))
+    requeued = []
+
+    async def requeue(manager, task_id):
+        requeued.append(task_id)
+
+    monkeypatch.setattr(executor, "_requeue", requeue)
+    manager = SimpleNamespace(worker_id="api-test", active_tasks={"svc_crash": None}, _cancel_requested=set())
+
+    await executor._run(manager, "svc_crash", {}, None)
+
+    assert executor._pool is not broken
+    assert runs == ["svc_crash"] and requeued == []
+    assert executor.stats()["pool_rebuilds"] == 1 and executor.crashed == 1
+    assert "svc_crash" not in manager.active_tasks
+    executor._pool.shutdown()
+
+
+def test_pending_filter_skips_cancel_requested_jobs():
+    """测试已请求取消的任务不会被认领"""
+    sql = str(select(MCPService).where(pending_job_filter()).compile(dialect=postgresql.dialect()))
+
+    assert "cancel_requested_at IS NULL" in sql
+
+
+@pytest.mark.asyncio
+async def test_request_cancel_queued_and_running_jobs():
+    """测试取消请求：排队任务直接取消，执行中任务写入取消请求并通知持有者"""
+    from backend.services.job_queue import request_cancel, CANCEL_CHANNEL
+
+    queued = FakeSession(MagicMock(rowcount=1))
+    assert await request_cancel(queued, "svc_queued") == "cancelled"
+    assert "status" in queued.sql(0) and queued.commits == 1
+
+    running = FakeSession(MagicMock(rowcount=0), MagicMock(rowcount=1), MagicMock())
+    assert await request_cancel(running, "svc_running") == "cancelling"
+    assert running.statements[2][1] == {"channel": CANCEL_CHANNEL, "payload": "svc_running"}
+    assert running.commits == 1
+
+    finished = FakeSession(MagicMock(rowcount=0), MagicMock(rowcount=0))
+    assert await request_cancel(finished, "svc_done") is None
+    assert finished.rollbacks == 1 and finished.commits == 0
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_reports_cancel_and_lost_lease():
+    """测试心跳结果：续约成功、已请求取消、租约丢失"""
+    from datetime import datetime
+    from backend.services.job_queue import heartbeat
+
+    def returning(row):
+        result = MagicMock()
+        result.first.return_value = row
+        return result
+
+    assert await heartbeat(FakeSession(returning(SimpleNamespace(cancel_requested_at=None))), "svc", "w") == "alive"
+    assert await heartbeat(FakeSession(returning(SimpleNamespace(cancel_requested_at=datetime(2026, 1, 1)))), "svc", "w") == "cancel"
+    session = FakeSession(returning(None))
+    assert await heartbeat(session, "svc", "w") == "lost"
+    assert "lease_owner" in session.sql(0)
+
+
+@pytest.mark.asyncio
+async def test_reaper_cancels_jobs_with_cancel_request():
+    """测试回收器把已请求取消的过期任务标记为 CANCELLED，不重新入队"""
+    from backend.models.mcp_service import ServiceStatus
+    from backend.services.job_queue import reap_stale_jobs
+
+    rows = MagicMock()
+    rows.all.return_value = [
+        SimpleNamespace(id="svc_cancelled", status=ServiceStatus.CANCELLED),
+        SimpleNamespace(id="svc_stale", status=ServiceStatus.GENERATING),
+    ]
+    session = FakeSession(rows)
+    requeued, failed = await reap_stale_jobs(session)
+
+    assert requeued == ["svc_stale"] and failed == []
+    # 只为重新入队的任务发送通知
+    assert [params["payload"] for _, params in session.statements[1:]] == ["svc_stale"]
+    sql = session.sql(0)
+    assert "cancel_requested_at IS NOT NULL" in sql
+    assert sql.index("cancel_requested_at IS NOT NULL") < sql.index("attempt_count >=")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("lease, notified", [(True, False), (False, True)])
+async def test_enqueue_notification_only_for_unleased_jobs(lease, notified):
+    """测试只为留给 worker_daemon 认领的任务发送入队通知"""
+    from unittest.mock import AsyncMock, patch
+    from backend.services.service_manager import ServiceManager
+
+    farmer = MagicMock()
+    farmer.scalar_one.return_value = SimpleNamespace(services_count=0)
+    session = FakeSession(farmer)
+    session.add = MagicMock()
+
+    manager = ServiceManager(workflow=object())
+    with patch("backend.services.service_manager.AsyncSessionLocal", session_factory(session)), \
+            patch("backend.services.service_manager.generation_cache.lookup", AsyncMock(return_value=None)), \
+            patch("backend.services.service_manager.notify_job_enqueued", AsyncMock()) as notify:
+        task_id, cached = await manager._create_service_record(
+            "创建一个订单查询工具", "farmer_001", None, "gpt-4o", lease=lease
+        )
+
+    assert cached is None
+    assert notify.await_count == (1 if notified else 0)
+    assert session.add.call_args.args[0].lease_owner == (manager.worker_id if lease else None)
+
+
+@pytest.mark.asyncio
+async def test_worker_daemon_signal_requests_shutdown(monkeypatch):
+    """测试停机信号在事件循环线程中停止主循环并唤醒等待"""
+    import os
+    import signal
+    import asyncio
+    from unittest.mock import patch
+    # worker_daemon 导入时会设置代理环境变量，导入完成后还原
+    with patch.dict(os.environ):
+        from backend.scripts import worker_daemon
+
+    woken = []
+    monkeypatch.setattr(worker_daemon, "running", True)
+    monkeypatch.setattr(worker_daemon.listener, "wake", lambda: woken.append(True))
+    loop = asyncio.get_running_loop()
+    worker_daemon.install_signal_handlers(loop)
+    try:
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.sleep(0.05)
+    finally:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+
+    assert worker_daemon.running is False
+    assert woken == [True]
+
+
+
+def _count_result(count: int):
+    result = MagicMock()
+    result.scalar_one.return_value = count
+    return result
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_fill_claims_only_free_slots():
+    """测试任务池只按空闲槽位认领，槽位占满后不再认领但仍刷新队列深度"""
+    import asyncio
+    from unittest.mock import AsyncMock, patch
+    from backend.services.worker_service import GenerationWorkerPool
+
+    release = asyncio.Event()
+
+    async def process(service, worker_id):
+        await release.wait()
+        return True
+
+    pool = GenerationWorkerPool(worker_id="w", max_in_flight=2, job_timeout=60)
+    busy = asyncio.create_task(release.wait())
+    pool._tasks["svc_busy"] = busy
+    session = FakeSession(_count_result(5))
+    claim = AsyncMock(return_value=[SimpleNamespace(id="svc_new")])
+    with patch("backend.services.worker_service.AsyncSessionLocal", session_factory(session)), \
+            patch("backend.services.worker_service.claim_jobs", claim), \
+            patch("backend.services.worker_service.process_single_service", process):
+        assert await pool.fill() == 1
+        assert claim.await_args.kwargs["limit"] == 1
+        assert pool.queue_depth == 5 and pool.in_flight == 2 and pool.free_slots == 0
+
+        # 槽位已满：不认领，只统计队列深度
+        session.results = [_count_result(4)]
+        assert await pool.fill() == 0
+        assert claim.await_count == 1 and pool.queue_depth == 4
+
+        release.set()
+        await asyncio.gather(busy, pool._tasks["svc_new"])
+
+    assert pool.succeeded == 1 and pool.failed == 0 and "svc_new" not in pool._tasks
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("outcome, succeeded, failed", [(True, 1, 0), (False, 0, 1), (RuntimeError("boom"), 0, 1)])
+async def test_worker_pool_counts_succeeded_and_failed_jobs(outcome, succeeded, failed):
+    """测试任务结果分别计入 succeeded / failed"""
+    from unittest.mock import AsyncMock, patch
+    from backend.services.worker_service import GenerationWorkerPool
+
+    done = []
+    pool = GenerationWorkerPool(worker_id="w", max_in_flight=1, job_timeout=60, on_job_done=lambda: done.append(True))
+    process = AsyncMock(side_effect=outcome) if isinstance(outcome, Exception) else AsyncMock(return_value=outcome)
+    with patch("backend.services.worker_service.AsyncSessionLocal", session_factory(FakeSession())), \
+            patch("backend.services.worker_service.process_single_service", process):
+        await pool._run_job("svc")
+
+    assert (pool.succeeded, pool.failed, pool.timed_out) == (succeeded, failed, 0)
+    assert done == [True]
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_marks_timed_out_job_failed():
+    """测试超时任务被标记为 FAILED，同时计入 timed_out 与 failed"""
+    import asyncio
+    from unittest.mock import AsyncMock, patch
+    from backend.services.worker_service import GenerationWorkerPool
+
+    async def process(service, worker_id):
+        await asyncio.sleep(60)
+
+    pool = GenerationWorkerPool(worker_id="w", max_in_flight=1, job_timeout=0.01)
+    with patch("backend.services.worker_service.AsyncSessionLocal", session_factory(FakeSession())), \
+            patch("backend.services.worker_service.process_single_service", process), \
+            patch("backend.services.worker_service._mark_service_failed", AsyncMock()) as mark_failed:
+        await pool._run_job("svc_slow")
+
+    assert (pool.succeeded, pool.failed, pool.timed_out) == (0, 1, 1)
+    assert mark_failed.await_args.args[0] == "svc_slow"
+    assert "timed out" in mark_failed.await_args.args[1]
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_shutdown_releases_leases():
+    """测试停机时取消进行中的任务，释放仍持有的租约并重新发送入队通知"""
+    import asyncio
+    from unittest.mock import AsyncMock, patch
+    from backend.services.worker_service import GenerationWorkerPool
+
+    pool = GenerationWorkerPool(worker_id="w", max_in_flight=2, job_timeout=60)
+    tasks = {service_id: asyncio.create_task(asyncio.sleep(60)) for service_id in ("svc_a", "svc_b")}
+    pool._tasks.update(tasks)
+    session = FakeSession()
+    # svc_b 的租约已被回收器收走，不再通知
+    release = AsyncMock(side_effect=lambda db, service_id, worker_id: service_id == "svc_a")
+    with patch("backend.services.worker_service.AsyncSessionLocal", session_factory(session)), \
+            patch("backend.services.worker_service.release_job", release), \
+            patch("backend.services.worker_service.notify_job_enqueued", AsyncMock()) as notify:
+        await pool.shutdown()
+
+    assert all(task.cancelled() for task in tasks.values())
+    assert [call.args[1:] for call in release.await_args_list] == [("svc_a", "w"), ("svc_b", "w")]
+    assert [call.args[1] for call in notify.await_args_list] == ["svc_a"]
+    assert session.commits == 1
+
+
+def _heartbeat_row(row):
+    result = MagicMock()
+    result.first.return_value = row
+    return result
+
+
+@pytest.mark.asyncio
+async def test_job_heartbeat_renews_lease_periodically_and_on_beat():
+    """测试 JobHeartbeat 按间隔续约，节点边界的 beat() 只在距上次续约超过 interval/2 时续约"""
+    import asyncio
+    from unittest.mock import patch
+    from backend.services.job_queue import JobHeartbeat
+
+    alive = SimpleNamespace(cancel_requested_at=None)
+    session = FakeSession(*[_heartbeat_row(alive) for _ in range(20)])
+    with patch("backend.services.job_queue.AsyncSessionLocal", session_factory(session)):
+        async with JobHeartbeat("svc", "w", interval=0.01, lease_seconds=30) as hb:
+            await asyncio.sleep(0.05)
+        periodic = len(session.statements)
+
+        async with JobHeartbeat("svc", "w", interval=60, lease_seconds=30) as hb:
+            hb.beat()
+            assert hb._pending is None
+            hb._last_beat -= 31
+            hb.beat()
+            await hb._pending
+
+    assert periodic >= 2
+    assert len(session.statements) == periodic + 1
+    assert session.commits == len(session.statements)
+    sql = session.sql(0)
+    assert "lease_expires_at=" in sql and "mcp_services.lease_owner = " in sql
+    params = session.statements[0][0].compile(dialect=postgresql.dialect()).params
+    assert (params["lease_expires_at"] - params["updated_at"]).total_seconds() == 30
+    assert params["lease_owner_1"] == "w"
+    assert not hb.lost and not hb.cancel_requested
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("row, lost", [
+    (None, True),
+    (SimpleNamespace(cancel_requested_at="2026-01-01"), False),
+])
+async def test_job_heartbeat_cancels_job_on_lost_lease_or_cancel(row, lost):
+    """测试续约发现租约丢失或已请求取消时取消正在执行的任务"""
+    import asyncio
+    from unittest.mock import patch
+    from backend.services.job_queue import JobHeartbeat
+
+    heartbeats = []
+
+    async def job():
+        async with JobHeartbeat("svc", "w", interval=0.01) as hb:
+            heartbeats.append(hb)
+            await asyncio.sleep(60)
+
+    session = FakeSession(_heartbeat_row(row))
+    with patch("backend.services.job_queue.AsyncSessionLocal", session_factory(session)):
+        task = asyncio.create_task(job())
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(task, timeout=5)
+
+    hb = heartbeats[0]
+    assert hb.lost is lost and hb.cancel_requested is (not lost)
+    # 心跳循环随上下文退出一起停止
+    assert hb._loop_task.done()
+
+
+@pytest.mark.asyncio
+async def test_reaper_case_splits_requeue_fail_and_cancel():
+    """测试回收器的单条 UPDATE：CASE 按取消、尝试次数用尽、重新入队依次判定，并按返回状态分流"""
+    from backend.config.settings import settings
+    from backend.models.mcp_service import ServiceStatus
+    from backend.services.job_queue import reap_stale_jobs, JOB_CHANNEL
+
+    rows = MagicMock()
+    rows.all.return_value = [
+        SimpleNamespace(id="svc_exhausted", status=ServiceStatus.FAILED),
+        SimpleNamespace(id="svc_retry_1", status=ServiceStatus.GENERATING),
+        SimpleNamespace(id="svc_cancelled", status=ServiceStatus.CANCELLED),
+        SimpleNamespace(id="svc_retry_2", status=ServiceStatus.GENERATING),
+    ]
+    session = FakeSession(rows)
+    requeued, failed = await reap_stale_jobs(session)
+
+    assert requeued == ["svc_retry_1", "svc_retry_2"]
+    assert failed == ["svc_exhausted"]
+    assert [params for _, params in session.statements[1:]] == [
+        {"channel": JOB_CHANNEL, "payload": "svc_retry_1"},
+        {"channel": JOB_CHANNEL, "payload": "svc_retry_2"},
+    ]
+    assert session.commits == 1
+
+    compiled = session.statements[0][0].compile(dialect=postgresql.dialect())
+    sql = str(compiled)
+    status_case = sql[sql.index("SET status=CASE"):sql.index(", total_errors=")]
+    # 取消优先于失败，其余保持 GENERATING（即重新入队）
+    assert status_case.index("cancel_requested_at IS NOT NULL") < status_case.index("attempt_count >=")
+    assert status_case.endswith("ELSE mcp_services.status END")
+    # 只有尝试次数用尽的任务累加错误次数
+    errors_case = sql[sql.index("total_errors=CASE"):]
+    assert "attempt_count >=" in errors_case and "ELSE mcp_services.total_errors END" in errors_case
+    assert compiled.params["param_1"] == ServiceStatus.CANCELLED
+    assert compiled.params["param_2"] == ServiceStatus.FAILED
+    assert compiled.params["attempt_count_1"] == settings.WORKER_MAX_ATTEMPTS
+    assert compiled.params["status_1"] == ServiceStatus.GENERATING
+    assert "RETURNING mcp_services.id, mcp_services.status" in sql
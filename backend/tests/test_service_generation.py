@@ -2,9 +2,9 @@
 服务生成功能测试
 """
 import pytest
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
-from backend.services.service_manager import ServiceManager
+from backend.services.service_manager import ServiceManager, PromptBuilder, MockCompiledWorkflow
 from backend.services.cost_calculator import CostCalculator
 
 
@@ -66,3 +66,672 @@ async def test_pricing_tiers():
     assert calculator.PRICING_TIERS["free"]["max_services"] == 3
     assert calculator.PRICING_TIERS["basic"]["price"] == 9.9
     assert calculator.PRICING_TIERS["professional"]["max_services"] == 50
+
+
+def test_generation_cache_key():
+    """测试生成结果缓存键：相同输入稳定，模型或提示词变化即失效"""
+    from backend.services.generation_cache import compute_cache_key
+
+    prompt = "为产品'玉露香梨'生成查询服务"
+    key = compute_cache_key(prompt, "gpt-4o")
+
+    assert key == compute_cache_key(prompt, "gpt-4o")
+    assert key != compute_cache_key(prompt, "gemini-2.5-pro")
+    assert key != compute_cache_key(prompt + "。", "gpt-4o")
+    assert len(key) == 64
+
+
+def test_generation_cache_stores_only_deliverable_results():
+    """测试只缓存测试评估为 DELIVERABLE 的真实工作流结果"""
+    manager = ServiceManager(workflow=object())
+    deliverable = {
+        "server_code": "# code",
+        "test_report_content": "# report",
+        "deliverability_assessment": "DELIVERABLE",
+    }
+
+    assert manager._is_cacheable_result(deliverable)
+    assert not manager._is_cacheable_result({**deliverable, "deliverability_assessment": "NEEDS_REFINEMENT"})
+    assert not manager._is_cacheable_result({**deliverable, "test_report_content": None})
+    assert not manager._is_cacheable_result({**deliverable, "static_gate_issues": ["line 1: SyntaxError"]})
+    assert not manager._is_cacheable_result({**deliverable, "mock_output": True})
+    assert not ServiceManager(workflow=MockCompiledWorkflow())._is_cacheable_result(deliverable)
+
+
+@pytest.mark.asyncio
+async def test_generation_cache_hit_copies_files(tmp_path):
+    """测试缓存命中时服务文件复制到新服务自己的目录，不与源服务共用"""
+    from types import SimpleNamespace
+    from backend.services.generation_cache import GenerationCache
+
+    source_dir = tmp_path / "source" / "refined"
+    source_dir.mkdir(parents=True)
+    (source_dir / "server.py").write_text("# cached server", encoding="utf-8")
+    (source_dir / "README.md").write_text("# readme", encoding="utf-8")
+    (source_dir / "__pycache__").mkdir()
+    entry = SimpleNamespace(
+        file_path=str(source_dir / "server.py"), code="# cached server", readme="# readme",
+        requirements=None, test_report="# report", quality_score=85.0, test_pass_rate=None,
+        name="cached_service", cache_key="k" * 64, source_service_id="svc_source",
+    )
+
+    service = SimpleNamespace(name="Custom Service")
+    await GenerationCache.apply_to_service(entry, service, tmp_path / "svc_new")
+    assert service.file_path == str(tmp_path / "svc_new" / "server.py")
+    assert (tmp_path / "svc_new" / "README.md").exists()
+    assert not (tmp_path / "svc_new" / "__pycache__").exists()
+    assert service.parent_service_id == "svc_source"
+
+    # 源目录已被清理时按缓存的代码重建服务文件
+    (source_dir / "server.py").unlink()
+    rebuilt = SimpleNamespace(name="Custom Service")
+    await GenerationCache.apply_to_service(entry, rebuilt, tmp_path / "svc_rebuilt")
+    assert (tmp_path / "svc_rebuilt" / "server.py").read_text(encoding="utf-8") == "# cached server"
+
+
+@pytest.mark.asyncio
+async def test_initial_state_reaches_graph_nodes():
+    """测试初始状态中的模型与轮次上限经 LangGraph 传递到节点（未声明的键会被丢弃）"""
+    import backend.mcpybarra_core  # noqa: F401
+    from langgraph.graph import StateGraph, END
+    from mcp_swe_flow.state import MCPWorkflowState
+
+    received = {}
+
+    async def swe_generate(state):
+        received.update(state)
+        return {"next_step": "end"}
+
+    graph = StateGraph(MCPWorkflowState)
+    graph.add_node("swe_generate", swe_generate)
+    graph.set_entry_point("swe_generate")
+    graph.add_edge("swe_generate", END)
+
+    manager = ServiceManager(workflow=object())
+    initial_state = manager.build_initial_state("创建一个订单查询工具", "claude-sonnet-4", "svc_state")
+    await graph.compile().ainvoke(initial_state)
+
+    assert received["swe_model"] == "claude-sonnet-4"
+    for key in ("max_refine_loops", "max_planning_turns", "max_codegen_turns",
+                "max_planning_tool_calls", "max_codegen_tool_calls"):
+        assert received[key] == initial_state[key]
+
+
+@pytest.mark.asyncio
+async def test_progress_store_tracks_nodes():
+    """测试节点级进度：阶段随 next_step 推进，测试/优化循环不回退进度"""
+    from backend.services.progress_store import ProgressStore
+    
+    store = ProgressStore(backend="memory")
+    await store.start("svc_progress")
+    
+    snapshot = await store.record_node("svc_progress", "load_input", {"next_step": "swe_generate"})
+    assert snapshot["current_stage"] == "coding"
+    
+    await store.record_node("svc_progress", "swe_generate", {"next_step": "server_test"})
+    await store.record_node("svc_progress", "server_test", {"next_step": "refine_code"})
+    await store.record_node("svc_progress", "refine_code", {"next_step": "server_test"})
+    snapshot = await store.record_node("svc_progress", "server_test", {"next_step": "refine_code"})
+    
+    assert snapshot["progress"] == 90
+    assert snapshot["current_stage"] == "refining"
+    assert [n["node"] for n in snapshot["nodes"]][-2:] == ["refine_code", "server_test"]
+    
+    await store.finish("svc_progress")
+    assert await store.get("svc_progress") is None
+
+
+def test_workflow_registry_compiles_once():
+    """测试工作流注册表只编译一次并共享ServiceManager"""
+    from backend.services.workflow_registry import WorkflowRegistry
+    
+    registry = WorkflowRegistry()
+    with patch('backend.services.service_manager._create_workflow') as create_workflow:
+        first = registry.get_service_manager()
+        second = registry.get_service_manager()
+        assert registry.get_workflow() is first.workflow
+    
+    assert first is second
+    assert create_workflow.call_count == 1
+    assert registry.stats()["workflow_reuses"] >= 1
+
+
+def test_plan_cache_adapts_only_product_fields():
+    """测试规划缓存命中时只替换产品字段，端口、状态码等数字保持不变"""
+    import backend.mcpybarra_core  # noqa: F401
+    from mcp_swe_flow.plan_cache import adapt_plan
+
+    plan = "服务监听 0.0.0.0:8000，返回 HTTP 200/404。产品名称：苹果\n单价：12.8元，price 12.8，库存：0。"
+    adapted = adapt_plan(plan, ["苹果", "12.8", "0"], ["香梨", "9.9", "5"])
+
+    assert adapted == "服务监听 0.0.0.0:8000，返回 HTTP 200/404。产品名称：香梨\n单价：9.9元，price 9.9，库存：5。"
+    # 新值与旧值重叠时不会被二次替换，列表长度不一致时保持原样
+    assert adapt_plan("单价：12元", ["苹果", "12", "0"], ["苹果", "120", "0"]) == "单价：120元"
+    assert adapt_plan(plan, ["苹果"], ["香梨", "9.9"]) == plan
+
+
+def test_plan_cache_fingerprint_masks_labelled_fields():
+    """测试指纹只屏蔽提示词中标注的产品字段，不同产品的同类提示词指纹相同"""
+    import backend.mcpybarra_core  # noqa: F401
+    from mcp_swe_flow.plan_cache import normalize_request
+
+    def fingerprint(name, price, stock):
+        product = {"name": name, "price": price, "stock": stock, "description": "果肉细腻", "origin": "山西"}
+        prompt = PromptBuilder.build_product_service_prompt(
+            name, "水果", price, stock, "果肉细腻", "张三", "山西", None, "query"
+        ) + "\n服务端口 8000，HTTP 200"
+        return normalize_request(prompt, PromptBuilder.product_mask_values(product, "张三"))
+
+    apple = fingerprint("苹果", 12.8, 0)
+    assert apple == fingerprint("香梨", 9.9, 1000)
+    assert "苹果" not in apple and "12.8" not in apple
+    assert "8000" in apple and "200" in apple
+
+
+def test_plan_cache_similarity_limited_to_product_prompts(tmp_path):
+    """测试相似度复用只在产品提示词之间发生，自由需求只能精确命中"""
+    import backend.mcpybarra_core  # noqa: F401
+    from mcp_swe_flow.plan_cache import PlanCache
+
+    cache = PlanCache(cache_dir=tmp_path)
+    cache.similarity = 0.8
+    scope = cache.scope("gpt-4o", "doc")
+    cache.store("创建一个订单查询工具，支持按手机号查询", scope, "free-form plan", "gpt-4o")
+    cache.store("为<field>创建产品查询服务，单价<field>元", scope, "product plan", "gpt-4o", mask_values=["苹果", "12.8"])
+
+    assert cache.lookup("创建一个订单查询工具，支持按手机号查询", scope, similar=False)["plan"] == "free-form plan"
+    assert cache.lookup("创建一个订单查询工具，支持按手机号查找", scope, similar=False) is None
+    assert cache.lookup("创建一个订单查询工具，支持按手机号查找", scope) is None
+    similar = cache.lookup("为<field>创建产品查询服务，单价<field>元。", scope)
+    assert similar["plan"] == "product plan" and similar["match"] == "similar"
+
+
+@pytest.mark.asyncio
+async def test_template_fast_path_synthesizes_services(tmp_path):
+    """测试模板快速通道生成的标准服务通过静态检查与冒烟测试"""
+    from backend.services import service_templates
+    
+    product = {
+        "name": '玉露"香梨',
+        "category": "水果",
+        "price": 12.8,
+        "stock": 100,
+        "description": "果肉细腻\n汁多味甜",
+        "certifications": ["有机认证"],
+    }
+    for service_type in service_templates.TEMPLATE_SERVICE_TYPES:
+        result = await service_templates.synthesize(service_type, product, "测试农户", tmp_path / service_type)
+        assert result["passed"], result["test_report"]
+        assert result["test_pass_rate"] == 1.0
+    
+    assert not service_templates.supports("full")
+
+
+@pytest.mark.asyncio
+async def test_batch_group_bounded_by_max_concurrency(monkeypatch):
+    """测试批量生成同时执行的任务数不超过 BATCH_MAX_CONCURRENCY"""
+    import asyncio
+    from backend.config.settings import settings
+
+    monkeypatch.setattr(settings, "BATCH_MAX_CONCURRENCY", 2)
+    running, peak, submitted = 0, 0, []
+
+    async def run():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+
+    class Executor:
+        leases_locally = True
+
+        async def submit(self, manager, task_id, initial_state, request_id=None):
+            submitted.append(task_id)
+            return asyncio.create_task(run())
+
+    manager = ServiceManager(workflow=object())
+    monkeypatch.setattr(manager, "_plan_for_group", AsyncMock(return_value=None))
+    pending = [(f"svc_batch_{i}", "为产品生成查询服务", None) for i in range(5)]
+    with patch('backend.services.service_manager.get_generation_executor', return_value=Executor()):
+        await manager._run_batch_group(("水果", "query", "gpt-4o"), pending, None)
+        await asyncio.gather(*manager.active_tasks.values())
+
+    assert submitted == [task_id for task_id, _, _ in pending]
+    assert peak == 2
+
+
+def test_server_name_generated_locally(tmp_path):
+    """测试服务名本地生成（关键词提取 + 目录冲突检查）"""
+    import backend.mcpybarra_core  # noqa: F401  设置 mcp_swe_flow 导入路径
+    from mcp_swe_flow.server_naming import generate_server_name, unique_server_name
+    
+    prompt = PromptBuilder.build_product_service_prompt(
+        "玉露香梨", "水果", 12.8, 100, "脆甜多汁", "测试农户", service_type="order"
+    )
+    name = generate_server_name(prompt, product_name="Yulu Pear")
+    assert name.startswith("mcp_yulu_pear_order")
+    assert name.isidentifier() and len(name) <= 40
+    assert generate_server_name("I need an MCP server that can convert image files") == "mcp_convert_image"
+    
+    assert unique_server_name(name, tmp_path) == name
+    assert unique_server_name(name, tmp_path) == f"{name}_2"
+
+
+@pytest.mark.asyncio
+async def test_model_race_picks_first_passing_candidate(tmp_path, monkeypatch):
+    """测试多模型竞速：先通过检查的模型胜出，其余被取消"""
+    import asyncio
+    import backend.mcpybarra_core  # noqa: F401  设置 mcp_swe_flow 导入路径
+    from mcp_swe_flow import model_race
+    
+    monkeypatch.setenv("SWE_AGENT_FORCED_MODEL", "")
+    assert model_race.candidate_models(["a", "b", "a"]) == ["a", "b"]
+    
+    server_file = tmp_path / "server.py"
+    server_file.write_text("mcp = object()\n@mcp.tool()\ndef ping():\n    return 'pong'\nmcp.run()\n", encoding="utf-8")
+    monkeypatch.setattr(model_race, "server_start_gate", AsyncMock(return_value=[]))
+    # 竞速日志写入源码树下的 logs 目录，测试中替换掉
+    monkeypatch.setattr(model_race, "get_agent_logger", MagicMock())
+    
+    async def generate(state):
+        # 每个候选使用独立的日志列表，统计节点只汇总胜出模型的日志
+        state["log_files"].append(f"SWE-Agent-{state['race_candidate']}.jsonl")
+        delay = {"slow": 5, "broken": 0.01, "fast": 0.05}[state["swe_model"]]
+        await asyncio.sleep(delay)
+        if state["swe_model"] == "broken":
+            return {**state, "error": "generation failed"}
+        return {**state, "server_file_path": str(server_file)}
+    
+    state = {"log_files": ["input.jsonl"]}
+    result = await model_race.race_generation(state, ["slow", "broken", "fast"], generate)
+    outcomes = {c["model"]: c["outcome"] for c in result["race_report"]["candidates"]}
+    
+    assert result["swe_model"] == "fast"
+    assert outcomes == {"slow": "cancelled", "broken": "failed", "fast": "won"}
+    assert result["log_files"] == ["input.jsonl", "SWE-Agent-fast.jsonl"]
+    assert state["log_files"] == ["input.jsonl"]
+    # 被取消候选在途调用的用量不会上报，报告标明成本为下限
+    assert result["race_report"]["total_cost_is_lower_bound"]
+
+
+@pytest.mark.asyncio
+async def test_test_plan_runs_independent_steps_concurrently():
+    """测试测试计划按依赖并发执行，执行日志保持计划顺序"""
+    import asyncio
+    import json
+    import time
+    from types import SimpleNamespace
+    from unittest.mock import MagicMock
+    import backend.mcpybarra_core  # noqa: F401  设置 mcp_swe_flow 导入路径
+    from mcp_swe_flow.server_test_plan import build_step_graph, execute_test_plan
+    
+    async def slow_echo(params):
+        await asyncio.sleep(0.2)
+        return json.dumps(params)
+    
+    adapter = SimpleNamespace(tools=[SimpleNamespace(name="echo", ainvoke=slow_echo)])
+    plan = [
+        {"step_id": "a", "tool_name": "echo", "parameters": {"x": 1}, "description": ""},
+        {"step_id": "b", "tool_name": "echo", "parameters": {"x": 2}, "description": ""},
+        {"step_id": "c", "tool_name": "echo", "parameters": {"x": "$outputs.a.x"}, "description": ""},
+        {"step_id": "d", "tool_name": "echo", "parameters": {"path": "notes.txt"}, "description": ""},
+        {"step_id": "e", "tool_name": "echo", "parameters": {"path": "notes.txt"}, "description": ""},
+    ]
+    assert build_step_graph(plan) == [set(), set(), {0}, set(), {3}]
+    
+    started = time.monotonic()
+    log = await execute_test_plan(adapter, plan, MagicMock())
+    
+    assert time.monotonic() - started < 0.7  # 关键路径两步，顺序执行需 1 秒
+    assert [entry["step"]["step_id"] for entry in log] == ["a", "b", "c", "d", "e"]
+    assert log[2]["substituted_params"] == {"x": 1}
+    assert all(entry["result"]["status"] == "success" for entry in log)
+
+
+def test_static_gate_rejects_broken_server(tmp_path):
+    """测试静态预检：语法、依赖导入与 FastMCP 工具签名问题在启动服务前被发现"""
+    import backend.mcpybarra_core  # noqa: F401  设置 mcp_swe_flow 导入路径
+    from mcp_swe_flow.static_gate import check_server_code
+    
+    server = (
+        "import json\n"
+        "try:\n    import ujson_not_installed\nexcept ImportError:\n    ujson_not_installed = None\n"
+        "from mcp.server.fastmcp import FastMCP\n"
+        "mcp = FastMCP('demo')\n"
+        "@mcp.tool()\ndef query_product(name: str, limit: int = 10) -> str:\n    return json.dumps([name])\n"
+        "if __name__ == '__main__':\n    mcp.run()\n"
+    )
+    result = check_server_code(server, tmp_path / "server.py")
+    assert result.passed, result.issues
+    assert [tool["signature"] for tool in result.tools] == ["query_product(name: str, limit: int = ...)"]
+    
+    broken = server.replace("import json", "import json\nimport pkg_not_installed_xyz").replace(
+        "limit: int = 10", "*args"
+    ).replace("    mcp.run()", "    pass")
+    issues = check_server_code(broken, tmp_path / "server.py").issues
+    assert any("pkg_not_installed_xyz" in issue for issue in issues)
+    assert any("*args" in issue for issue in issues)
+    assert any(".run(" in issue for issue in issues)
+    
+    assert "SyntaxError" in check_server_code(server + "def broken(:\n", tmp_path / "server.py").issues[0]
+
+
+def test_server_test_plan_reused_while_tool_surface_unchanged(tmp_path):
+    """测试测试计划缓存：工具名与参数schema不变时复用，变化后失效"""
+    from types import SimpleNamespace
+    import backend.mcpybarra_core  # noqa: F401  设置 mcp_swe_flow 导入路径
+    from mcp_swe_flow.server_test_cache import load_test_plan, store_test_plan, tool_surface_hash
+    
+    schema = {"type": "object", "properties": {"name": {"type": "string"}}}
+    tools = [
+        SimpleNamespace(name="query_product", description="v1", args_schema=schema),
+        SimpleNamespace(name="ping", description="", args_schema={}),
+    ]
+    plan = [{"step_id": "s1", "tool_name": "ping", "parameters": {}, "description": "ping"}]
+    surface = tool_surface_hash(tools)
+    assert load_test_plan(tmp_path, surface) is None
+    assert store_test_plan(tmp_path, surface, plan, {"input_tokens": 900, "output_tokens": 100, "cost": 0.01})
+    
+    # 仅描述/实现变化、顺序不同：命中
+    refined = [tools[1], SimpleNamespace(name="query_product", description="v2", args_schema=schema)]
+    entry = load_test_plan(tmp_path, tool_surface_hash(refined))
+    assert entry["test_plan"] == plan and entry["planning_tokens"] == 1000
+    
+    # 参数变化：失效
+    changed = [tools[1], SimpleNamespace(name="query_product", description="v1", args_schema={"type": "object", "properties": {}})]
+    assert load_test_plan(tmp_path, tool_surface_hash(changed)) is None
+
+
+@pytest.mark.asyncio
+async def test_tool_calls_run_concurrently_with_per_call_errors(monkeypatch):
+    """测试同一轮的工具调用并发执行：结果保持调用顺序，超时与异常只影响对应调用"""
+    import asyncio
+    import time
+    from types import SimpleNamespace
+    from unittest.mock import MagicMock
+    import backend.mcpybarra_core  # noqa: F401  设置 mcp_swe_flow 导入路径
+    from mcp_swe_flow.tool_executor import execute_tool_calls
+    
+    monkeypatch.setenv("TOOL_CALL_TIMEOUT_SECONDS", "5")
+    monkeypatch.setenv("TOOL_TIMEOUT_HANG", "1")
+    monkeypatch.setenv("MAX_PARALLEL_TOOL_CALLS", "4")
+    
+    def tool(name, delay, output=None, error=None):
+        async def ainvoke(args):
+            await asyncio.sleep(delay)
+            if error:
+                raise error
+            return output or f"{name}:{args['q']}"
+        return SimpleNamespace(name=name, ainvoke=ainvoke)
+    
+    tools = [
+        tool("slow", 0.3),
+        tool("fast", 0.01),
+        tool("hang", 60),
+        tool("boom", 0.01, error=RuntimeError("bad input")),
+    ]
+    calls = [
+        {"name": "slow", "args": {"q": 1}, "id": "c1"},
+        {"name": "fast", "args": {"q": 2}, "id": "c2"},
+        {"name": "hang", "args": {"q": 3}, "id": "c3"},
+        {"name": "boom", "args": {"q": 4}, "id": "c4"},
+        {"name": "missing", "args": {}, "id": "c5"},
+    ]
+    agent_logger = MagicMock()
+    
+    started = time.monotonic()
+    results = await execute_tool_calls(calls, tools, agent_logger)
+    elapsed = time.monotonic() - started
+    
+    # 并发：总耗时由超时的调用决定，而不是各调用之和
+    assert elapsed < 1.5
+    assert [r.call_id for r in results] == ["c1", "c2", "c3", "c4", "c5"]
+    assert [r.output for r in results[:2]] == ["slow:1", "fast:2"]
+    assert results[0].ok and results[1].ok
+    assert "timed out after 1s" in results[2].error
+    assert "bad input" in results[3].error
+    assert "not found" in results[4].error
+    error_calls = [c.kwargs["call_id"] for c in agent_logger.log.call_args_list if c.kwargs["event_type"] == "tool_error"]
+    assert sorted(error_calls) == ["c3", "c4", "c5"]
+
+
+@pytest.mark.asyncio
+async def test_save_file_tool_calls_serialized_in_call_order():
+    """测试文件保存工具的多个调用按调用顺序串行，不与彼此重叠"""
+    import asyncio
+    from types import SimpleNamespace
+    from unittest.mock import MagicMock
+    import backend.mcpybarra_core  # noqa: F401  设置 mcp_swe_flow 导入路径
+    from mcp_swe_flow.tool_executor import execute_tool_calls, SAVE_FILE_TOOL_NAME
+    
+    events = []
+    
+    async def save(args):
+        events.append(("start", args["n"]))
+        await asyncio.sleep(0.05 if args["n"] == 1 else 0.01)
+        events.append(("end", args["n"]))
+        return "saved"
+    
+    tools = [SimpleNamespace(name=SAVE_FILE_TOOL_NAME, ainvoke=save)]
+    calls = [{"name": SAVE_FILE_TOOL_NAME, "args": {"n": n}, "id": f"s{n}"} for n in (1, 2, 3)]
+    results = await execute_tool_calls(calls, tools, MagicMock())
+    
+    assert all(r.ok for r in results)
+    assert events == [("start", 1), ("end", 1), ("start", 2), ("end", 2), ("start", 3), ("end", 3)]
+
+
+def test_complete_prefix_keeps_only_finished_statements():
+    """测试流式代码前缀：装饰器与函数不拆开，文档字符串内的顶格行不当作新语句的完成依据"""
+    import ast
+    import backend.mcpybarra_core  # noqa: F401  设置 mcp_swe_flow 导入路径
+    from mcp_swe_flow.streaming_codegen import complete_prefix
+    
+    # 装饰器链与被装饰函数一起视为未完成
+    decorated = "import os\n\n@mcp.tool()\n@cache\ndef f():\n    return 1\n"
+    assert complete_prefix(decorated) == "import os\n"
+    assert complete_prefix("import os\n\n@mcp.tool()\ndef f(\n") == "import os\n"
+    
+    # 已闭合的模块文档字符串完整保留
+    module_doc = '"""\nDemo server.\nUsage: run it\n"""\nimport os\n\nx = 1\n'
+    assert complete_prefix(module_doc) == '"""\nDemo server.\nUsage: run it\n"""\nimport os\n'
+    
+    # 函数文档字符串中的顶格行：后续语句到达后整体编译通过
+    function_doc = 'def f():\n    """\nText at col 0\n    """\n    return 1\n\nz = 2\n'
+    ast.parse(complete_prefix(function_doc))
+    
+    # else/except 等续行与注释不会切断上一条语句
+    assert complete_prefix("try:\n    x = 1\nexcept Exception:\n    pass\n# note\ny = 2\n") == (
+        "try:\n    x = 1\nexcept Exception:\n    pass\n# note"
+    )
+    assert complete_prefix("x = 1") == ""
+
+
+@pytest.mark.parametrize("chunks, error", [
+    # 代码被包在 markdown 代码块里：第一次检查即判定
+    (["```python\nimport os\n", "```python\nimport os\n\nx = 1\n"], "markdown code fence"),
+    # 代码中夹杂说明文字：同一位置连续两次报错才判定
+    (["import os\n\nHere is the server code.\nx = 1\ny = 2\n",
+      "import os\n\nHere is the server code.\nx = 1\ny = 2\nz = 3\n"], "line 3: invalid syntax"),
+    # 文档字符串尚未闭合只是输入被截断，不判定
+    (['"""\nDemo server.\nUsage: run it\n', '"""\nDemo server.\nUsage: run it\nMore text\n'], None),
+    (["def f():\n    \"\"\"\nText at col 0\n    more\n", "def f():\n    \"\"\"\nText at col 0\n    more\nand more\n"], None),
+    # 正常代码
+    (["import os\n\n@mcp.tool()\ndef f():\n    return 1\n", "import os\n\n@mcp.tool()\ndef f():\n    return 1\n\nmcp.run()\n"], None),
+])
+def test_incremental_validator_flags_only_clearly_malformed_code(chunks, error):
+    """测试增量校验：代码块围栏与说明文字被判定为格式错误，截断的文档字符串与装饰器不误判"""
+    import backend.mcpybarra_core  # noqa: F401  设置 mcp_swe_flow 导入路径
+    from mcp_swe_flow.streaming_codegen import IncrementalCodeValidator
+    
+    validator = IncrementalCodeValidator(check_every_chars=1)
+    results = [validator.feed(code) for code in chunks]
+    
+    if error is None:
+        assert results == [None] * len(chunks)
+    else:
+        assert error in results[-1]
+        if "fence" in error:
+            assert error in results[0]
+        else:
+            assert results[0] is None
+
+
+def test_context_budget_drops_tool_call_groups_whole():
+    """测试上下文预算：只保留最新代码稿，超预算时按组丢弃最早的轮次，tool_call 与 ToolMessage 始终成对"""
+    from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+    import backend.mcpybarra_core  # noqa: F401  设置 mcp_swe_flow 导入路径
+    from mcp_swe_flow.context_budget import ContextBudget, estimate_tokens
+    from mcp_swe_flow.tool_executor import SAVE_FILE_TOOL_NAME
+    
+    def turn(index, *tools):
+        reasoning = f"turn {index}: " + "analysis of the search results " * 60
+        calls = [{"name": name, "args": args, "id": f"call_{index}_{n}"} for n, (name, args) in enumerate(tools)]
+        replies = [ToolMessage(content=f"result {index}.{n} " + "x" * 3000, tool_call_id=call["id"]) for n, call in enumerate(calls)]
+        return [AIMessage(content=reasoning, tool_calls=calls), *replies]
+    
+    task = HumanMessage(content="Build an MCP server for order lookup.")
+    history = [
+        task,
+        *turn(1, ("tavily_technical_search", {"query": "orders api"}), ("context7_fetch", {"library": "httpx"})),
+        *turn(2, (SAVE_FILE_TOOL_NAME, {"file_path": "server.py", "content": "import os\n" * 200})),
+        *turn(3, ("tavily_technical_search", {"query": "pagination"})),
+        *turn(4, (SAVE_FILE_TOOL_NAME, {"file_path": "server.py", "content": "import sys\n" * 200})),
+    ]
+    snapshot = [m.model_copy() for m in history]
+    
+    budget = ContextBudget(budget=estimate_tokens(history[-2:]) + 900, tool_output_chars=200)
+    fitted = budget.fit(history)
+    
+    # 存储的历史不被修改，任务提示原样保留在首位
+    assert [m.content for m in history] == [m.content for m in snapshot]
+    assert fitted[0] is task
+    # 当前轮（最新代码稿及其结果）完整保留
+    assert fitted[-2:] == history[-2:]
+    assert fitted[-2].tool_calls[0]["args"]["content"] == "import sys\n" * 200
+    # 丢弃的是完整分组：每个 ToolMessage 都能在保留的 AI 消息中找到对应调用，反之亦然
+    call_ids = [call["id"] for m in fitted if isinstance(m, AIMessage) for call in m.tool_calls]
+    result_ids = [m.tool_call_id for m in fitted if isinstance(m, ToolMessage)]
+    assert call_ids == result_ids
+    assert not isinstance(fitted[1], ToolMessage)
+    
+    stats = budget.turns[-1]
+    assert stats["messages_dropped"] > 0 and stats["drafts_omitted"] == 1
+    assert stats["tokens_after"] <= budget.budget < stats["tokens_before"]
+    assert "call_1_0" not in call_ids
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("script, handshake_delay, error", [
+    # 秒退：立即失败并带上 stderr 末尾，不等待握手超时
+    ("import sys\nsys.stderr.write('KeyError: ORDER_API_KEY\\n')\nsys.exit(1)\n", 60, "立刻退出"),
+    # 正常：握手完成即就绪
+    ("import sys, time\nsys.stderr.write('serving\\n')\nsys.stderr.flush()\ntime.sleep(30)\n", 0.2, None),
+    # 挂起：超时后失败
+    ("import time\ntime.sleep(30)\n", 60, "未完成握手"),
+])
+async def test_stdio_server_readiness_races_handshake_and_exit(script, handshake_delay, error):
+    """测试就绪探测：握手与服务器退出同时等待，秒退的服务器立即失败并带上 stderr"""
+    import asyncio
+    import sys
+    import time
+    import backend.mcpybarra_core  # noqa: F401  设置 mcp_swe_flow 导入路径
+    from mcp_swe_flow.server_readiness import StderrCapture, await_handshake
+    
+    async def handshake():
+        await asyncio.sleep(handshake_delay)
+        return "initialized"
+    
+    stderr = StderrCapture()
+    process = await asyncio.create_subprocess_exec(sys.executable, "-c", script, stderr=stderr.errlog)
+    stderr.start()
+    started = time.monotonic()
+    try:
+        if error is None:
+            assert await await_handshake(handshake(), stderr, timeout=2) == "initialized"
+            assert not stderr.exited.is_set()
+        else:
+            with pytest.raises(RuntimeError, match=error) as excinfo:
+                await await_handshake(handshake(), stderr, timeout=2)
+            if "退出" in error:
+                assert "KeyError: ORDER_API_KEY" in str(excinfo.value)
+                assert time.monotonic() - started < 1.5
+    finally:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+
+
+def test_prompt_split_at_cache_breakpoint():
+    """测试提示词在缓存断点处拆分：显式缓存提示只用于支持 cache_control 的模型"""
+    from types import SimpleNamespace
+    import backend.mcpybarra_core  # noqa: F401  设置 mcp_swe_flow 导入路径
+    from mcp_swe_flow.prompts.utils import CACHE_BREAKPOINT, build_prompt_message, split_cacheable
+    
+    rendered = f"Instructions\nMCP doc\n{CACHE_BREAKPOINT}\n\nRequirement: order lookup"
+    prefix, suffix = split_cacheable(rendered)
+    assert (prefix, suffix) == ("Instructions\nMCP doc\n\n", "Requirement: order lookup")
+    # 没有断点的模板：整体作为动态部分
+    assert split_cacheable("Requirement only") == ("", "Requirement only")
+    
+    for model_name in ("openrouter/anthropic/claude-3.5-sonnet", "claude-sonnet-4-20250514"):
+        # 绑定了工具的模型从 .bound 取模型名
+        for llm in (SimpleNamespace(model_name=model_name), SimpleNamespace(bound=SimpleNamespace(model_name=model_name))):
+            content = build_prompt_message(rendered, llm).content
+            assert content == [
+                {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": suffix},
+            ]
+    
+    for model_name in ("gpt-4o", "qwen-plus"):
+        assert build_prompt_message(rendered, SimpleNamespace(model_name=model_name)).content == prefix + suffix
+    assert build_prompt_message("Requirement only", SimpleNamespace(model_name="claude-sonnet-4-20250514")).content == "Requirement only"
+    assert build_prompt_message(rendered).content == prefix + suffix
+
+
+def test_cached_prompt_tokens_billed_at_cache_rate(monkeypatch):
+    """测试缓存命中的提示词 token：按各服务商的字段提取，按 cache_read_ratio 计费并报告节省"""
+    from unittest.mock import MagicMock
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, LLMResult
+    import backend.mcpybarra_core  # noqa: F401  设置 mcp_swe_flow 导入路径
+    from mcp_swe_flow import config
+    
+    assert config.get_cached_prompt_tokens({"prompt_tokens_details": {"cached_tokens": 300}}) == 300
+    assert config.get_cached_prompt_tokens({"prompt_cache_hit_tokens": 200}) == 200
+    assert config.get_cached_prompt_tokens({"prompt_tokens_details": None, "prompt_tokens": 10}) == 0
+    
+    # gpt-4o: 提示词 0.000018/token，缓存按 0.5 计费
+    price = 0.000018
+    costs = config.calculate_cost("gpt-4o", 1000, 100, cached_prompt_tokens=400)
+    assert costs["prompt_cost"] == pytest.approx((600 + 400 * 0.5) * price)
+    assert costs["completion_cost"] == pytest.approx(100 * 0.000072)
+    assert costs["total_cost"] == pytest.approx(costs["prompt_cost"] + costs["completion_cost"])
+    assert costs["cache_savings"] == pytest.approx(400 * 0.5 * price)
+    # 缓存 token 不超过提示词 token
+    clamped = config.calculate_cost("gpt-4o", 1000, 0, cached_prompt_tokens=5000)
+    assert clamped["prompt_cost"] == pytest.approx(1000 * 0.5 * price)
+    assert clamped["cache_savings"] == pytest.approx(1000 * 0.5 * price)
+    # 未配置缓存价格的服务商按原价计费
+    assert config.calculate_cost("local-model", 1000, 0, cached_prompt_tokens=400)["cache_savings"] == 0
+    
+    # 流式响应的用量在最终消息的 usage_metadata 上
+    monkeypatch.setattr(config, "get_agent_logger", MagicMock())
+    handler = config.TokenCounterHandler("SWE-Agent-test")
+    handler.call_id = "call"
+    message = AIMessage(
+        content="",
+        usage_metadata={
+            "input_tokens": 1000, "output_tokens": 100, "total_tokens": 1100,
+            "input_token_details": {"cache_read": 400},
+        },
+        response_metadata={"model_name": "gpt-4o"},
+    )
+    with config.track_phase_usage() as usage:
+        handler.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]], llm_output=None))
+    
+    assert usage["input_tokens"] == 1000 and usage["cached_input_tokens"] == 400
+    assert usage["cost"] == pytest.approx(costs["total_cost"])
+    logged = handler.agent_logger.log.call_args.kwargs["usage_metadata"]
+    assert logged["cached_input_tokens"] == 400
+    assert logged["cache_savings"] == pytest.approx(costs["cache_savings"])